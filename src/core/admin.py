@@ -2,27 +2,67 @@
 __author__ = 'viniciusfaria'
 
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from . import search
 from .models import Speaker, Contact, Media, Talk
 
 
+# Resultados da busca levados à lista do admin (pk__in).
+SEARCH_LIMIT = 500
+
+
+class IndexSearchChangeList(ChangeList):
+    """
+    A busca da lista usa o índice de search.py (sem acentos, por prefixo,
+    todos os termos) em vez de um LIKE por coluna em search_fields.
+    """
+    def get_query_set(self, request):
+        search_fields, self.search_fields = self.search_fields, ()
+        try:
+            qs = super(IndexSearchChangeList, self).get_query_set(request)
+        finally:
+            self.search_fields = search_fields
+        if self.query:
+            search.index.ensure()
+            ranked = search.index.search(self.query, [self.model_admin.search_kind])
+            qs = qs.filter(pk__in=[pk for score, (kind, pk) in ranked[:SEARCH_LIMIT]])
+        return qs
+
+
+class IndexSearchMixin(object):
+    search_kind = None
+
+    def get_changelist(self, request, **kwargs):
+        return IndexSearchChangeList
+
+
 class ContactInline(admin.TabularInline):
     model = Contact
     extra = 1
 
 
-class SpeakerAdmin(admin.ModelAdmin):
+class SpeakerAdmin(IndexSearchMixin, admin.ModelAdmin):
     inlines = [ContactInline, ]
     prepopulated_fields = {'slug': ('name', )}
+    # Só para exibir a caixa de busca; a busca é feita pelo índice.
+    search_fields = ('name', 'description')
+    search_kind = search.SPEAKER
 
 
 class MediaInline(admin.TabularInline):
     model = Media
     extra = 1
 
+    def queryset(self, request):
+        # Cada linha mostra o __unicode__ da mídia, que usa o título da palestra.
+        return super(MediaInline, self).queryset(request).select_related('talk')
+
 
-class TalkAdmin(admin.ModelAdmin):
+class TalkAdmin(IndexSearchMixin, admin.ModelAdmin):
     list_display = ('title','description','start_time')
     inlines = [MediaInline,]
+    search_fields = ('title', 'description')
+    search_kind = search.TALK
 
 
 admin.site.register(Speaker, SpeakerAdmin)
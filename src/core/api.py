@@ -0,0 +1,88 @@
+# coding: utf-8
+"""
+Documento JSON com a programação completa (palestras, cursos, palestrantes,
+contatos e mídias), pré-calculado e guardado no cache junto com seu ETag.
+"""
+import json
+from datetime import datetime
+from hashlib import sha1
+from django.core.urlresolvers import reverse
+from django.db.models import Max
+from django.utils import timezone
+from .models import Contact, Course, Media, Speaker, Talk
+from .pagecache import page_cache, pin_if_changed
+
+
+class ScheduleDocument(object):
+    def __init__(self, body, last_modified):
+        self.body = body
+        self.etag = sha1(body).hexdigest()
+        self.last_modified = last_modified
+
+
+def serialize_talk(talk):
+    try:
+        course = talk.course
+    except Course.DoesNotExist:
+        course = None
+    return {
+        'id': talk.pk,
+        'title': talk.title,
+        'description': talk.description,
+        'start_time': talk.start_time.strftime('%H:%M'),
+        'url': reverse('core:talk_detail', args=[talk.pk]),
+        'course': course and {'slots': course.slots, 'notes': course.notes},
+        'speakers': [speaker.pk for speaker in talk.speakers.all()],
+        'media': [{'type': m.type, 'title': m.title, 'media_id': m.media_id}
+                  for m in talk.media_set.all()],
+    }
+
+
+def serialize_speaker(speaker):
+    return {
+        'id': speaker.pk,
+        'name': speaker.name,
+        'slug': speaker.slug,
+        'url': speaker.url,
+        'description': speaker.description,
+        'avatar': speaker.avatar.url if speaker.avatar else None,
+        'page': reverse('core:speaker_detail', args=[speaker.slug]),
+        'contacts': [{'kind': c.kind, 'value': c.value} for c in speaker.contact_set.all()],
+    }
+
+
+def last_modified(version):
+    """
+    Data da última alteração: o maior `modified_at` dos models do core. A
+    versão da tag 'core' (em milissegundos) cobre as exclusões, que não
+    deixam registro nas tabelas.
+    """
+    dates = [model.objects.aggregate(m=Max('modified_at'))['m']
+             for model in (Talk, Speaker, Contact, Media)]
+    dates.append(datetime.utcfromtimestamp(version / 1000).replace(tzinfo=timezone.utc))
+    return max(d for d in dates if d is not None)
+
+
+def build_schedule(version):
+    talks = (Talk.objects.select_related(*Talk.objects.subclasses())
+             .prefetch_related('speakers', 'media_set').order_by('start_time', 'pk'))
+    speakers = Speaker.objects.with_contacts().order_by('name')
+    data = {
+        'talks': [serialize_talk(t) for t in talks],
+        'speakers': [serialize_speaker(s) for s in speakers],
+    }
+    body = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return ScheduleDocument(body, last_modified(version))
+
+
+def schedule_document():
+    """O documento da versão atual, do cache ou recém-montado."""
+    version = page_cache.versions(['core'])[0]
+    key = '%s:schedule-json:%d' % (page_cache.prefix, version)
+    document = page_cache.cache.get(key) if page_cache.enabled else None
+    if document is None:
+        pin_if_changed([version])
+        document = build_schedule(version)
+        if page_cache.enabled:
+            page_cache.cache.set(key, document, page_cache.timeout)
+    return document
@@ -0,0 +1,198 @@
+# coding: utf-8
+"""
+Gerador determinístico de dados de carga e medição ponta a ponta das URLs
+do site (latência, consultas ao banco e memória).
+
+A mesma semente gera sempre os mesmos dados, então os resultados de duas
+execuções, gravados em JSON, podem ser comparados.
+"""
+import random
+import resource
+import time
+from datetime import time as clock
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import Client
+from ..subscriptions import stats as subscription_stats
+from ..subscriptions.models import Subscription
+from ..subscriptions.registry import cpf_registry
+from .models import Contact, Course, Media, Speaker, Talk
+from .pagecache import page_cache
+
+
+BATCH_SIZE = 500
+
+ADMIN_USERNAME = 'benchmark'
+ADMIN_PASSWORD = 'benchmark'
+
+WORDS = (u'dados python django web escala cache banco consulta índice teste '
+         u'desempenho código deploy servidor fila rede memória').split()
+
+
+def sentence(rnd, words):
+    return u' '.join(rnd.choice(WORDS) for i in range(words)).capitalize()
+
+
+def generate(seed=0, speakers=1000, talks=2000, courses=200, subscriptions=10000):
+    """Popula o banco; devolve a contagem de cada tipo de objeto criado."""
+    rnd = random.Random(seed)
+
+    Speaker.objects.bulk_create(
+        [Speaker(name=u'Palestrante %d' % i, slug='palestrante-%d' % i,
+                 url='http://exemplo.com/%d' % i, description=sentence(rnd, 30))
+         for i in xrange(speakers)], batch_size=BATCH_SIZE)
+    speaker_pks = list(Speaker.objects.order_by('pk').values_list('pk', flat=True))
+
+    contacts = []
+    for pk in speaker_pks:
+        for kind, value in (('E', 'p%d@exemplo.com' % pk), ('P', '21-%08d' % pk), ('F', '21-%08d' % pk)):
+            if rnd.random() < 0.7:
+                contacts.append(Contact(speaker_id=pk, kind=kind, value=value))
+    Contact.objects.bulk_create(contacts, batch_size=BATCH_SIZE)
+
+    def start_time():
+        return clock(rnd.randint(8, 19), rnd.choice((0, 15, 30, 45)))
+
+    Talk.objects.bulk_create(
+        [Talk(title=sentence(rnd, 5), description=sentence(rnd, 40), start_time=start_time())
+         for i in xrange(talks)], batch_size=BATCH_SIZE)
+    # Herança multi-tabela não funciona com bulk_create.
+    for i in xrange(courses):
+        Course.objects.create(title=sentence(rnd, 4), description=sentence(rnd, 40),
+                              start_time=start_time(), slots=rnd.randint(10, 40),
+                              notes=sentence(rnd, 10))
+    talk_pks = list(Talk.objects.order_by('pk').values_list('pk', flat=True))
+
+    Through = Talk.speakers.through
+    Through.objects.bulk_create(
+        [Through(talk_id=pk, speaker_id=speaker)
+         for pk in talk_pks for speaker in rnd.sample(speaker_pks, min(len(speaker_pks), rnd.randint(1, 3)))],
+        batch_size=BATCH_SIZE)
+
+    medias = []
+    for pk in talk_pks:
+        for type in ('SL', 'YT'):
+            if rnd.random() < 0.5:
+                medias.append(Media(talk_id=pk, type=type, title=sentence(rnd, 3),
+                                    media_id='%s-%d' % (type.lower(), pk)))
+    Media.objects.bulk_create(medias, batch_size=BATCH_SIZE)
+
+    for start in xrange(0, subscriptions, BATCH_SIZE * 10):
+        objs = [Subscription(name=u'Pessoa %d' % i, cpf='%011d' % i, email='pessoa%d@exemplo.com' % i,
+                             paid=rnd.random() < 0.3)
+                for i in xrange(start, min(start + BATCH_SIZE * 10, subscriptions))]
+        Subscription.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+        subscription_stats.record_created(objs)
+
+    # bulk_create não dispara signals: descarta o que foi montado antes e
+    # remonta o registro, como o warmup faria ao iniciar o processo.
+    page_cache.invalidate('core', 'schedule')
+    cpf_registry.clear()
+    cpf_registry.warm()
+
+    return {'speakers': speakers, 'contacts': len(contacts), 'talks': talks, 'courses': courses,
+            'medias': len(medias), 'subscriptions': subscriptions}
+
+
+def scenarios(seed=0, subscriptions=10000):
+    """
+    (nome, método, url, dados) de cada URL medida. Os dados podem ser uma
+    função do número da repetição, para que cada POST seja uma inscrição nova.
+    """
+    rnd = random.Random(seed)
+    talk = Talk.objects.order_by('pk')[rnd.randint(0, Talk.objects.count() - 1)]
+    speaker = Speaker.objects.order_by('pk')[rnd.randint(0, Speaker.objects.count() - 1)]
+    subscription = Subscription.objects.order_by('pk')[0] if subscriptions else None
+
+    def new_subscription(i):
+        return {'name': u'Nova %d' % i, 'cpf': '%011d' % (subscriptions + i),
+                'email': 'nova%d@exemplo.com' % i}
+
+    result = [
+        ('homepage', 'get', reverse('homepage'), None),
+        ('talks', 'get', reverse('core:talks'), None),
+        ('talk_detail', 'get', reverse('core:talk_detail', args=[talk.pk]), None),
+        ('speaker_detail', 'get', reverse('core:speaker_detail', args=[speaker.slug]), None),
+        ('schedule_json', 'get', reverse('core:schedule_json'), None),
+        ('subscribe_get', 'get', reverse('subscriptions:subscribe'), None),
+        ('subscribe_post', 'post', reverse('subscriptions:subscribe'), new_subscription),
+        ('admin_changelist', 'get', reverse('admin:subscriptions_subscription_changelist'), None),
+        ('admin_export', 'get', reverse('admin:export_subscriptions'), None),
+    ]
+    if subscription:
+        result.insert(7, ('success', 'get', reverse('subscriptions:success', args=[subscription.pk]), None))
+    return result
+
+
+def admin_client():
+    if not User.objects.filter(username=ADMIN_USERNAME).exists():
+        User.objects.create_superuser(ADMIN_USERNAME, 'benchmark@exemplo.com', ADMIN_PASSWORD)
+    client = Client()
+    client.login(username=ADMIN_USERNAME, password=ADMIN_PASSWORD)
+    return client
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = int(round(p / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def max_rss_kb():
+    # ru_maxrss é o pico do processo: só cresce, então medimos o aumento.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(client, method, url, data=None, repeat=20):
+    """Latências (ms), consultas por requisição e aumento do pico de memória."""
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    timings, queries, statuses = [], [], set()
+    rss_before = max_rss_kb()
+    try:
+        for i in xrange(repeat):
+            payload = data(i) if callable(data) else data
+            began = time.time()
+            response = getattr(client, method)(url, payload or {})
+            # Consome respostas em streaming, como a exportação CSV.
+            len(response.content)
+            timings.append((time.time() - began) * 1000)
+            # connection.queries é zerada no início de cada requisição.
+            queries.append(len(connection.queries))
+            statuses.add(response.status_code)
+    finally:
+        connection.use_debug_cursor = use_debug_cursor
+    return {
+        'url': url,
+        'method': method.upper(),
+        'repeat': repeat,
+        'status': sorted(statuses),
+        'mean_ms': sum(timings) / len(timings),
+        'p50_ms': percentile(timings, 50),
+        'p90_ms': percentile(timings, 90),
+        'p99_ms': percentile(timings, 99),
+        'max_ms': max(timings),
+        'queries': max(queries),
+        'peak_rss_growth_kb': max_rss_kb() - rss_before,
+    }
+
+
+def run(scenario_list, repeat=20, only=None):
+    client = admin_client()
+    results = {}
+    for name, method, url, data in scenario_list:
+        if only and name not in only:
+            continue
+        results[name] = measure(client, method, url, data, repeat)
+    return results
+
+
+def compare(baseline, current, metric='p50_ms'):
+    """[(nome, antes, depois, variação %)] das URLs presentes nas duas execuções."""
+    rows = []
+    for name in sorted(set(baseline) & set(current)):
+        before, after = baseline[name][metric], current[name][metric]
+        change = 100.0 * (after - before) / before if before else 0.0
+        rows.append((name, before, after, change))
+    return rows
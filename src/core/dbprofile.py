@@ -0,0 +1,132 @@
+# coding: utf-8
+"""
+Perfil de desempenho do banco, escolhido por DATABASE_PROFILE.
+
+Com 'tuned':
+
+* SQLite: cada conexão nova recebe os PRAGMAs de SQLITE_PRAGMAS (WAL,
+  busy_timeout, synchronous, cache_size...). Com WAL, leitores não esperam
+  pelo escritor; com busy_timeout, o escritor espera a vez em vez de falhar
+  na hora com "database is locked". O que ainda falhar por lock pode ser
+  repetido com retry_on_lock.
+* PostgreSQL: as conexões deixam de ser fechadas ao fim de cada requisição
+  e são reaproveitadas por até DATABASE_CONN_MAX_AGE segundos. Ao fim da
+  requisição a conexão guardada sempre recebe um rollback, para não ficar
+  "idle in transaction" segurando snapshot e locks. No início da
+  requisição, uma conexão parada há mais de DATABASE_HEALTH_CHECK_INTERVAL
+  segundos é testada e, se não responder, descartada.
+
+Com 'plain' o banco fica como o Django configura.
+"""
+import time
+from django.conf import settings
+from django.core import signals
+from django.db import DatabaseError, IntegrityError, close_connection, connections, transaction
+from django.db.backends.signals import connection_created
+
+
+def profile():
+    return getattr(settings, 'DATABASE_PROFILE', 'plain')
+
+
+def configure_connection(sender, connection, **kwargs):
+    connection._opened_at = connection._checked_at = time.time()
+    if connection.vendor != 'sqlite':
+        return
+    # Direto na conexão do sqlite3, fora das contagens de consultas.
+    for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', ()):
+        connection.connection.execute('PRAGMA %s = %s' % (pragma, value))
+
+
+def persistent(connection):
+    return connection.vendor == 'postgresql'
+
+
+def release_connections(**kwargs):
+    """No lugar do close_connection do Django: só fecha o que não é persistente ou expirou."""
+    max_age = getattr(settings, 'DATABASE_CONN_MAX_AGE', 600)
+    now = time.time()
+    for connection in connections.all():
+        # Desfaz o que a requisição deixou aberto, como o close_connection faz.
+        transaction.abort(connection.alias)
+        if connection.connection is None:
+            continue
+        if not persistent(connection) or now - getattr(connection, '_opened_at', 0) > max_age:
+            connection.close()
+            continue
+        # O abort só desfaz transações marcadas como sujas; depois de uma
+        # requisição só de leitura o psycopg2 ainda estaria numa transação.
+        try:
+            connection.connection.rollback()
+        except Exception:
+            discard(connection)
+            continue
+        connection._checked_at = now
+
+
+def healthy(connection):
+    if getattr(connection.connection, 'closed', False):
+        return False
+    try:
+        cursor = connection.connection.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+        connection.connection.rollback()
+    except Exception:
+        return False
+    return True
+
+
+def check_connections(**kwargs):
+    """Descarta as conexões persistentes que caíram enquanto estavam paradas."""
+    interval = getattr(settings, 'DATABASE_HEALTH_CHECK_INTERVAL', 30)
+    now = time.time()
+    for connection in connections.all():
+        if connection.connection is None or not persistent(connection):
+            continue
+        if now - getattr(connection, '_checked_at', 0) < interval:
+            continue
+        if healthy(connection):
+            connection._checked_at = now
+        else:
+            discard(connection)
+
+
+def discard(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+    connection.connection = None
+
+
+def install():
+    if profile() != 'tuned':
+        return
+    connection_created.connect(configure_connection, dispatch_uid='dbprofile')
+    if any(persistent(connections[alias]) for alias in connections):
+        signals.request_finished.disconnect(close_connection)
+        signals.request_finished.connect(release_connections, dispatch_uid='dbprofile')
+        signals.request_started.connect(check_connections, dispatch_uid='dbprofile')
+
+
+def is_lock_error(error):
+    return 'locked' in str(error)
+
+
+def retry_on_lock(func, attempts=None, delay=0.05):
+    """
+    Executa func() e, se o SQLite responder "database is locked", tenta de
+    novo com espera crescente. func deve controlar a própria transação.
+    """
+    if attempts is None:
+        attempts = getattr(settings, 'DATABASE_LOCK_RETRIES', 5)
+    for attempt in range(attempts):
+        try:
+            return func()
+        except IntegrityError:
+            raise
+        except DatabaseError, e:
+            if not is_lock_error(e) or attempt == attempts - 1:
+                raise
+            time.sleep(delay * 2 ** attempt)
@@ -0,0 +1,54 @@
+# coding: utf-8
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    """
+    Cache limitado em memória: quando atinge `maxsize`, descarta o item usado
+    há mais tempo. É compartilhado entre as threads do processo.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key, func):
+        """Devolve o valor em cache ou calcula com `func()` e guarda."""
+        try:
+            hash(key)
+        except TypeError:
+            return func()
+        value = self.get(key, self)
+        if value is self:
+            value = func()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,29 @@
+# coding: utf-8
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from ... import thumbnails
+from ...models import Speaker
+
+
+class Command(BaseCommand):
+    help = (u'Gera as miniaturas dos avatares dos palestrantes que ainda não as têm. '
+            u'Rode periodicamente: recupera as que se perderam quando um worker reiniciou.')
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', default=4,
+                    help=u'Avatares processados em paralelo.'),
+        make_option('--force', action='store_true', default=False,
+                    help=u'Gera de novo mesmo as miniaturas que já existem.'),
+    )
+
+    def handle(self, *args, **options):
+        if not thumbnails.available():
+            raise CommandError(u'Instale o Pillow para gerar as miniaturas.')
+        done = failed = 0
+        speakers = Speaker.objects.exclude(avatar='').exclude(avatar=None)
+        for speaker, variants in thumbnails.backfill(speakers, options['workers'], options['force']):
+            if variants is None:
+                failed += 1
+                self.stdout.write(u'Falha: %s (%s)\n' % (speaker, speaker.avatar.name))
+            else:
+                done += 1
+        self.stdout.write(u'%d avatares processados, %d falhas.\n' % (done, failed))
@@ -0,0 +1,46 @@
+# coding: utf-8
+from optparse import make_option
+from timeit import Timer
+from django.core.management.base import BaseCommand
+from django.template import Context, Template
+from ...templatetags import slideshare, youtube
+
+
+PAGE = Template(
+    "{% load slideshare youtube %}"
+    "{% for m in medias %}{% slideshare m.id m.doc %}{% youtube m.id %}{% endfor %}")
+
+
+class Command(BaseCommand):
+    help = u'Mede o custo por renderização das tags slideshare e youtube.'
+    option_list = BaseCommand.option_list + (
+        make_option('--number', type='int', default=2000,
+                    help=u'Quantidade de renderizações por medida.'),
+        make_option('--medias', type='int', default=10,
+                    help=u'Quantidade de mídias distintas na página.'),
+    )
+
+    def handle(self, *args, **options):
+        number, count = options['number'], options['medias']
+        medias = [{'id': i, 'doc': 'doc-%d' % i} for i in range(count)]
+
+        def before():
+            # Comportamento antigo: um parse do template a cada tag.
+            for m in medias:
+                Template(slideshare.TEMPLATE).render(Context(m))
+                Template(youtube.TEMPLATE).render(Context(m))
+
+        def compiled():
+            for m in medias:
+                slideshare.embed_template.render(Context(m))
+                youtube.embed_template.render(Context(m))
+
+        def after():
+            PAGE.render(Context({'medias': medias}))
+
+        renders = number * count * 2
+        for label, func in ((u'parse + render', before),
+                            (u'compilado', compiled),
+                            (u'compilado + cache', after)):
+            seconds = Timer(func).timeit(number)
+            self.stdout.write(u'%-20s %8.2f us/render\n' % (label, seconds * 1e6 / renders))
@@ -0,0 +1,78 @@
+# coding: utf-8
+import json
+import platform
+import django
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from south.management.commands import patch_for_test_db_setup
+from ... import benchmark
+
+
+class Command(BaseCommand):
+    help = (u'Gera dados de carga num banco de teste e mede latência, consultas '
+            u'e memória de cada URL do site. Os resultados são gravados em JSON.')
+    option_list = BaseCommand.option_list + (
+        make_option('--seed', type='int', default=0),
+        make_option('--speakers', type='int', default=1000),
+        make_option('--talks', type='int', default=2000),
+        make_option('--courses', type='int', default=200),
+        make_option('--subscriptions', type='int', default=10000,
+                    help=u'Inscrições geradas (até 1 milhão).'),
+        make_option('--repeat', type='int', default=20,
+                    help=u'Requisições por URL.'),
+        make_option('--only', action='append', default=[],
+                    help=u'Mede só esta URL (pode repetir).'),
+        make_option('--output', default='benchmark.json',
+                    help=u'Arquivo JSON com os resultados.'),
+        make_option('--compare', metavar='ARQUIVO',
+                    help=u'Compara o p50 com uma execução anterior.'),
+    )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)['results']
+            except (IOError, ValueError, KeyError), e:
+                raise CommandError(u'Não foi possível ler %s: %s' % (options['compare'], e))
+
+        patch_for_test_db_setup()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            counts = benchmark.generate(options['seed'], options['speakers'], options['talks'],
+                                        options['courses'], options['subscriptions'])
+            scenarios = benchmark.scenarios(options['seed'], options['subscriptions'])
+            results = benchmark.run(scenarios, options['repeat'], options['only'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        document = {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'seed': options['seed'],
+                'repeat': options['repeat'],
+                'data': counts,
+                'database': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'page_cache': getattr(settings, 'PAGE_CACHE_ENABLED', False),
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+
+        self.stdout.write(u'%-18s %9s %9s %9s %8s %10s\n' % (
+            u'url', u'p50 ms', u'p90 ms', u'p99 ms', u'queries', u'mem KB'))
+        for name, r in sorted(results.items()):
+            self.stdout.write(u'%-18s %9.2f %9.2f %9.2f %8d %10d\n' % (
+                name, r['p50_ms'], r['p90_ms'], r['p99_ms'], r['queries'], r['peak_rss_growth_kb']))
+        if baseline is not None:
+            self.stdout.write(u'\n%-18s %9s %9s %8s\n' % (u'url', u'antes', u'depois', u'%'))
+            for name, before, after, change in benchmark.compare(baseline, results):
+                self.stdout.write(u'%-18s %9.2f %9.2f %+7.1f%%\n' % (name, before, after, change))
+        self.stdout.write(u'Resultados em %s\n' % options['output'])
@@ -0,0 +1,17 @@
+# coding: utf-8
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.importlib import import_module
+from ...pagecache import groups, page_cache
+
+
+class Command(BaseCommand):
+    help = u'Mostra hits e misses do cache das páginas públicas.'
+
+    def handle(self, *args, **options):
+        # Os grupos são registrados pelo @cached_page quando as URLs importam as views.
+        import_module(settings.ROOT_URLCONF)
+        for group, (hits, misses) in sorted(page_cache.stats(groups).items()):
+            total = hits + misses
+            ratio = 100.0 * hits / total if total else 0
+            self.stdout.write(u'%-10s %8d hits %8d misses %6.1f%%\n' % (group, hits, misses, ratio))
@@ -0,0 +1,92 @@
+# coding: utf-8
+import json
+import os
+import subprocess
+import sys
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.test.client import RequestFactory
+
+
+URLS = ('/', '/palestras/', '/palestras.json', '/inscricao/', '/admin/')
+
+MODES = (
+    # (nome, TEMPLATE_CACHE, WSGI_WARMUP)
+    ('frio', 'False', 'False'),
+    ('aquecido', 'True', 'True'),
+)
+
+
+def wsgi_get(application, path):
+    """Faz um GET direto na aplicação WSGI; devolve (status, ms)."""
+    environ = RequestFactory()._base_environ(PATH_INFO=path, REQUEST_METHOD='GET')
+    status = []
+    began = time.time()
+    body = application(environ, lambda s, headers, exc_info=None: status.append(s))
+    ''.join(body)
+    if hasattr(body, 'close'):
+        body.close()
+    return status[0].split()[0], (time.time() - began) * 1000
+
+
+class Command(BaseCommand):
+    help = (u'Compara a primeira requisição de um worker sem e com o aquecimento '
+            u'do wsgi.py (templates em cache, URLs, admin e middlewares prontos).')
+    option_list = BaseCommand.option_list + (
+        make_option('--runs', type='int', default=3,
+                    help=u'Processos medidos em cada modo (vale a mediana).'),
+        make_option('--child', action='store_true', default=False,
+                    help=u'Uso interno: mede um processo e imprime o resultado em JSON.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['child']:
+            return self.child()
+
+        results = {}
+        for mode, template_cache, warmup in MODES:
+            env = dict(os.environ, TEMPLATE_CACHE=template_cache, WSGI_WARMUP=warmup)
+            runs = []
+            for i in range(options['runs']):
+                process = subprocess.Popen([sys.executable, sys.argv[0], 'startup_report', '--child'],
+                                           env=env, stdout=subprocess.PIPE)
+                output = process.communicate()[0]
+                if process.returncode:
+                    raise CommandError(u'O processo de medida (%s) falhou.' % mode)
+                runs.append(json.loads(output.strip().splitlines()[-1]))
+            results[mode] = runs
+
+        def median(mode, key, path=None):
+            values = sorted(run[key][path] if path else run[key] for run in results[mode])
+            return values[len(values) // 2]
+
+        self.stdout.write(u'%-24s %12s %12s\n' % (u'', u'frio', u'aquecido'))
+        self.stdout.write(u'%-24s %9.1f ms %9.1f ms\n' % (
+            u'carga do wsgi', median('frio', 'startup_ms'), median('aquecido', 'startup_ms')))
+        for key, label in (('first_ms', u'1a req.'), ('second_ms', u'2a req.')):
+            for path in URLS:
+                self.stdout.write(u'%-24s %9.1f ms %9.1f ms\n' % (
+                    u'%s %s' % (label, path), median('frio', key, path), median('aquecido', key, path)))
+
+    def child(self):
+        from south.management.commands import patch_for_test_db_setup
+        from django.db import connection
+
+        # Banco de teste (em memória com o SQLite), para as páginas terem tabelas.
+        patch_for_test_db_setup()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            began = time.time()
+            from src.wsgi import application
+            startup = (time.time() - began) * 1000
+
+            first, second, status = {}, {}, {}
+            for path in URLS:
+                status[path], first[path] = wsgi_get(application, path)
+            for path in URLS:
+                status[path], second[path] = wsgi_get(application, path)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        self.stdout.write(json.dumps({'startup_ms': startup, 'first_ms': first,
+                                      'second_ms': second, 'status': status}) + '\n')
@@ -0,0 +1,25 @@
+# coding: utf-8
+from django.conf import settings
+from . import routers
+
+
+PIN_COOKIE = 'pin_primary'
+
+
+class ReplicaPinMiddleware(object):
+    """
+    Requisições que escrevem (POST etc.) e as que chegam até
+    REPLICA_PIN_SECONDS depois delas, do mesmo cliente, leem do banco
+    principal. Veja routers.py.
+    """
+    def process_request(self, request):
+        routers.unpin()
+        if request.method not in ('GET', 'HEAD') or PIN_COOKIE in request.COOKIES:
+            routers.pin()
+
+    def process_response(self, request, response):
+        if routers.replicas() and routers.pinned() and request.method not in ('GET', 'HEAD'):
+            response.set_cookie(PIN_COOKIE, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5),
+                                httponly=True)
+        routers.unpin()
+        return response
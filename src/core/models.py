@@ -1,7 +1,18 @@
 # coding: utf-8
+import json
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 from datetime import time
+from . import dbprofile, search, thumbnails
+from .pagecache import page_cache
+
+
+class SpeakerManager(models.Manager):
+    def with_contacts(self):
+        """Palestrantes com todos os contatos carregados em uma consulta só."""
+        return self.prefetch_related('contact_set')
 
 
 class Speaker(models.Model):
@@ -10,10 +21,32 @@ class Speaker(models.Model):
     url = models.URLField(_('Url'))
     description = models.TextField(_(u'Descrição'), blank=True)
     avatar = models.FileField(_('Avatar'), upload_to='palestrantes', blank=True, null=True)
+    # Miniaturas do avatar, em JSON (veja thumbnails.py).
+    avatar_variants = models.TextField(_('Miniaturas do avatar'), blank=True, editable=False)
+    modified_at = models.DateTimeField(_('Modificado em'), auto_now=True)
+
+    objects = SpeakerManager()
 
     def __unicode__(self):
         return self.name
 
+    @property
+    def thumbnails(self):
+        return json.loads(self.avatar_variants) if self.avatar_variants else {}
+
+    @property
+    def contacts(self):
+        """
+        Contatos agrupados por tipo ({'phones': [...], 'emails': [...],
+        'faxes': [...]}), em uma única consulta em vez de uma por tipo. Usa o
+        prefetch de Speaker.objects.with_contacts() quando houver.
+        """
+        if not hasattr(self, '_contacts'):
+            self._contacts = dict((group, []) for group in Contact.GROUPS.values())
+            for contact in self.contact_set.all():
+                self._contacts[Contact.GROUPS[contact.kind]].append(contact)
+        return self._contacts
+
 
 class KindContactManager(models.Manager):
     def __init__(self, kind):
@@ -33,9 +66,17 @@ class Contact(models.Model):
         ('F', _('Fax')),
     )
 
+    # Nome do grupo de cada tipo, como nos managers abaixo.
+    GROUPS = {
+        'P': 'phones',
+        'E': 'emails',
+        'F': 'faxes',
+    }
+
     speaker = models.ForeignKey('Speaker', verbose_name=_('Palestrante'))
     kind = models.CharField(_('Tipo'), max_length=1, choices=KINDS)
     value = models.CharField(_('Valor'), max_length=255)
+    modified_at = models.DateTimeField(_('Modificado em'), auto_now=True)
 
     objects = models.Manager()
     phones = KindContactManager('P')
@@ -56,25 +97,62 @@ class PeriodManager(models.Manager):
         qs = qs.order_by('start_time')
         return qs
 
+    def subclasses(self):
+        """Nomes dos acessores das subclasses do model (ex.: Talk -> course)."""
+        return [r.get_accessor_name() for r in self.model._meta.get_all_related_objects()
+                if isinstance(r.field, models.OneToOneField) and r.field.rel.parent_link]
+
+    def schedule(self):
+        """
+        Grade do evento: (manhã, tarde).
+
+        Palestras, dados das subclasses e palestrantes são carregados em um
+        número fixo de consultas; a separação por período é feita em memória.
+        """
+        qs = self.select_related(*self.subclasses())
+        qs = qs.prefetch_related('speakers')
+        qs = qs.order_by('start_time')
+
+        morning, afternoon = [], []
+        for talk in qs:
+            if talk.start_time < self.midday:
+                morning.append(talk)
+            else:
+                afternoon.append(talk)
+        return morning, afternoon
+
 
 class Talk(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
-    start_time = models.TimeField(blank=True)
+    start_time = models.TimeField(blank=True, db_index=True)
     speakers = models.ManyToManyField('Speaker', verbose_name=_('palestrante'))
+    modified_at = models.DateTimeField(_('Modificado em'), auto_now=True)
 
     objects = PeriodManager()
 
     def __unicode__(self):
         return self.title
 
+    @property
+    def medias(self):
+        """
+        Mídias da palestra agrupadas por tipo. Usa o prefetch de `media_set`
+        quando houver; senão, faz uma única consulta para todos os tipos.
+        """
+        if not hasattr(self, '_medias'):
+            self._medias = {}
+            for media in self.media_set.all():
+                self._medias.setdefault(media.type, []).append(media)
+        return self._medias
+
     @property
     def slides(self):
-        return self.media_set.filter(type="SL")
+        return self.medias.get('SL', [])
 
     @property
     def videos(self):
-        return self.media_set.filter(type="YT")
+        return self.medias.get('YT', [])
 
 
 class Course(Talk):
@@ -84,6 +162,12 @@ class Course(Talk):
     objects = PeriodManager()
 
 
+class MediaManager(models.Manager):
+    def with_talk(self):
+        """Mídias com a palestra na mesma consulta: o __unicode__ usa o título dela."""
+        return self.select_related('talk')
+
+
 class Media(models.Model):
     MEDIAS = (
         ('SL', 'SlideShare'),
@@ -94,7 +178,98 @@ class Media(models.Model):
     type = models.CharField(max_length=2, choices=MEDIAS)
     title = models.CharField(u'Título', max_length=255)
     media_id = models.CharField(max_length=255)
+    modified_at = models.DateTimeField(_('Modificado em'), auto_now=True)
+
+    objects = MediaManager()
 
     def __unicode__(self):
         return u'%s - %s' % (self.talk.title, self.title)
 
+
+# Invalidação do cache das páginas públicas (veja pagecache.py). A tag
+# 'core' muda a cada alteração e versiona o JSON da programação (api.py).
+
+@receiver(pre_save, sender=Speaker)
+def remember_speaker_slug(sender, instance, **kwargs):
+    # Se o slug mudar, a página no endereço antigo também precisa sair do cache.
+    instance._old_slug = None
+    if instance.pk:
+        instance._old_slug = (Speaker.objects.filter(pk=instance.pk)
+                              .values_list('slug', flat=True)[:1] or [None])[0]
+
+
+@receiver(pre_save, sender=Speaker)
+def forget_stale_thumbnails(sender, instance, **kwargs):
+    # Avatar trocado: até as novas miniaturas ficarem prontas, vale o original.
+    if instance.thumbnails.get('source') != (instance.avatar.name if instance.avatar else None):
+        instance.avatar_variants = ''
+
+
+@receiver(post_save, sender=Speaker)
+def schedule_thumbnails(sender, instance, raw=False, **kwargs):
+    if not raw and instance.avatar and not instance.avatar_variants:
+        thumbnails.schedule(instance)
+
+
+@receiver(pre_delete, sender=Speaker)
+@receiver(post_save, sender=Speaker)
+def invalidate_speaker(sender, instance, **kwargs):
+    tags = ['core', 'schedule', 'speaker:%s' % instance.slug]
+    if getattr(instance, '_old_slug', None):
+        tags.append('speaker:%s' % instance._old_slug)
+    tags.extend('talk:%d' % pk for pk in instance.talk_set.values_list('pk', flat=True))
+    page_cache.invalidate(*tags)
+
+
+@receiver(post_delete, sender=Contact)
+@receiver(post_save, sender=Contact)
+def invalidate_contact(sender, instance, **kwargs):
+    slug = Speaker.objects.filter(pk=instance.speaker_id).values_list('slug', flat=True)
+    page_cache.invalidate('core', *['speaker:%s' % s for s in slug])
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Talk)
+@receiver(post_save, sender=Talk)
+def invalidate_talk(sender, instance, **kwargs):
+    page_cache.invalidate('core', 'schedule', 'talk:%d' % instance.pk)
+
+
+@receiver(m2m_changed, sender=Talk.speakers.through)
+def invalidate_talk_speakers(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # speaker.talk_set.clear(): depois da limpeza não dá mais para saber as palestras.
+        pks = list(instance.talk_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove') or (action == 'post_clear' and not reverse):
+        pks = pk_set if reverse else [instance.pk]
+    else:
+        return
+    page_cache.invalidate('core', 'schedule', *['talk:%d' % pk for pk in pks])
+
+
+@receiver(post_delete, sender=Media)
+@receiver(post_save, sender=Media)
+def invalidate_media(sender, instance, **kwargs):
+    page_cache.invalidate('core', 'talk:%d' % instance.talk_id)
+
+
+# Atualização incremental do índice de busca deste processo (veja search.py).
+
+@receiver(post_delete, sender=Speaker)
+@receiver(post_save, sender=Speaker)
+def reindex_speaker(sender, instance, **kwargs):
+    search.index.mark_stale(search.SPEAKER, instance.pk)
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Talk)
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Talk)
+def reindex_talk(sender, instance, **kwargs):
+    search.index.mark_stale(search.TALK, instance.pk)
+
+
+# Ajustes de desempenho do banco (veja dbprofile.py), instalados antes da
+# primeira conexão.
+dbprofile.install()
@@ -0,0 +1,178 @@
+# coding: utf-8
+"""
+Cache das páginas públicas, invalidado pelos dados de que cada página depende.
+
+Cada página declara "tags" (ex.: 'schedule', 'talk:%(pk)s'). Cada tag tem
+uma versão guardada no cache e a chave da página inclui as versões de todas
+as suas tags. Invalidar uma tag é só trocar sua versão: as páginas que
+dependem dela deixam de ser encontradas e as demais continuam valendo.
+
+A chave usa o caminho da URL e só os parâmetros da query string que a
+página declara usar (`params`): utm_*, cache-busters e afins não criam
+cópias da mesma página no cache.
+
+Com réplicas do banco, a página que falta no cache é montada a partir do
+principal se alguma das suas tags mudou há menos de REPLICA_PIN_SECONDS:
+a réplica pode ainda não ter a alteração e a página desatualizada ficaria
+no cache por PAGE_CACHE_TIMEOUT.
+"""
+import time
+from functools import wraps
+from hashlib import md5
+from django.conf import settings
+from django.core.cache import get_cache
+from django.http import HttpResponse, QueryDict
+from django.utils.encoding import iri_to_uri
+from . import routers
+
+
+# Versões de tags e contadores não devem expirar antes das páginas.
+FOREVER = 60 * 60 * 24 * 365
+
+
+class PageCache(object):
+    def __init__(self, cache=None, timeout=None, prefix='pagecache'):
+        self._cache = cache
+        self._timeout = timeout
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = get_cache(getattr(settings, 'PAGE_CACHE_ALIAS', 'default'))
+        return self._cache
+
+    @property
+    def timeout(self):
+        if self._timeout is None:
+            return getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60)
+        return self._timeout
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'PAGE_CACHE_ENABLED', True)
+
+    def _tag_key(self, tag):
+        return '%s:tag:%s' % (self.prefix, tag)
+
+    def _counter_key(self, name, group):
+        return '%s:%s:%s' % (self.prefix, name, group)
+
+    def versions(self, tags):
+        """Versão atual de cada tag; tags sem versão ganham uma nova."""
+        keys = [self._tag_key(tag) for tag in tags]
+        found = self.cache.get_many(keys)
+        versions = []
+        for key in keys:
+            if key not in found:
+                found[key] = self._new_version()
+                self.cache.add(key, found[key], FOREVER)
+            versions.append(found[key])
+        return versions
+
+    def _new_version(self, previous=0):
+        # Baseada no relógio, para que também sirva como "modificado em".
+        return max(int(time.time() * 1000), previous + 1)
+
+    def invalidate(self, *tags):
+        for tag in set(tags):
+            key = self._tag_key(tag)
+            self.cache.set(key, self._new_version(self.cache.get(key) or 0), FOREVER)
+
+    def changed_since(self, versions, seconds):
+        """Alguma das versões (de versions()) é de menos de `seconds` atrás?"""
+        return bool(versions) and max(versions) > (time.time() - seconds) * 1000
+
+    def page_key(self, request, tags, versions=None, params=()):
+        if versions is None:
+            versions = self.versions(tags)
+        versions = '.'.join(str(v) for v in versions)
+        query = QueryDict('', mutable=True)
+        for name in sorted(params):
+            if name in request.GET:
+                query.setlist(name, request.GET.getlist(name))
+        path = request.path + ('?' + query.urlencode() if query else '')
+        path = md5(iri_to_uri(path)).hexdigest()
+        return '%s:page:%s:%s' % (self.prefix, path, md5(versions).hexdigest())
+
+    def count(self, name, group):
+        key = self._counter_key(name, group)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            if not self.cache.add(key, 1, FOREVER):
+                self.cache.incr(key)
+
+    def stats(self, groups):
+        """{grupo: (hits, misses)} para ajustar o cache."""
+        keys = dict((group, (self._counter_key('hits', group), self._counter_key('misses', group)))
+                    for group in groups)
+        found = self.cache.get_many([k for pair in keys.values() for k in pair])
+        return dict((group, (found.get(hits, 0), found.get(misses, 0)))
+                    for group, (hits, misses) in keys.items())
+
+    def get(self, key):
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        content, content_type = cached
+        return HttpResponse(content, content_type=content_type)
+
+    def set(self, key, response):
+        self.cache.set(key, (response.content, response['Content-Type']), self.timeout)
+
+
+page_cache = PageCache()
+
+# Grupos usados nos contadores de hits/misses (o nome da primeira tag).
+groups = set()
+
+
+def pin_if_changed(versions):
+    """
+    Lê do principal o que for montado para o cache se alguma das versões
+    mudou há menos de REPLICA_PIN_SECONDS: a réplica pode ainda estar
+    atrasada, e o que ela devolver ficaria guardado sob a versão nova.
+    """
+    if routers.replicas() and page_cache.changed_since(
+            versions, getattr(settings, 'REPLICA_PIN_SECONDS', 5)):
+        routers.pin()
+
+
+def cached_page(*tags, **options):
+    """
+    Decorator de view: guarda a página renderizada sob as tags dadas.
+    As tags podem usar os argumentos da URL, ex.: 'talk:%(pk)s'. Os
+    parâmetros da query string que mudam a página vão em `params`, ex.:
+    @cached_page('schedule', params=['page']); os demais são ignorados.
+    """
+    params = options.pop('params', ())
+    group = tags[0].split(':')[0]
+    groups.add(group)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not page_cache.enabled or request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            # A chave é calculada antes de renderizar: se os dados mudarem no
+            # meio do caminho, a página fica guardada sob as versões antigas.
+            page_tags = [tag % kwargs for tag in tags]
+            versions = page_cache.versions(page_tags)
+            key = page_cache.page_key(request, page_tags, versions, params)
+            response = page_cache.get(key)
+            if response is not None:
+                page_cache.count('hits', group)
+                return response
+
+            page_cache.count('misses', group)
+            pin_if_changed(versions)
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            if response.status_code == 200:
+                page_cache.set(key, response)
+            return response
+        return wrapper
+    return decorator
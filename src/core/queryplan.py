@@ -0,0 +1,69 @@
+# coding: utf-8
+"""
+Planos de execução das consultas, para os testes garantirem que os caminhos
+quentes usam índices. Funciona com SQLite e PostgreSQL.
+"""
+import re
+from django.db import connections
+
+
+def explain(queryset):
+    """Linhas do plano de execução do queryset no banco em que ele roda."""
+    connection = connections[queryset.db]
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    cursor = connection.cursor()
+    if connection.vendor == 'sqlite':
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+    if connection.vendor == 'postgresql':
+        # Com tabelas pequenas o PostgreSQL sempre prefere o seq scan; o que
+        # interessa aqui é se existe um índice capaz de atender a consulta.
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN ' + sql, params)
+        return [row[0] for row in cursor.fetchall()]
+    raise NotImplementedError(u'EXPLAIN não suportado em %s' % connection.vendor)
+
+
+def _sqlite_index_access(plan, table):
+    for line in plan:
+        match = re.match(r'(SEARCH|SCAN)( TABLE)? %s\b.*USING (COVERING )?INDEX \S+(?: \((.*)\))?' % table, line)
+        if match:
+            return match.group(4) or ''
+    return None
+
+
+def _postgresql_index_access(plan, table):
+    conditions = None
+    for i, line in enumerate(plan):
+        if ('Index' in line or 'Bitmap Heap Scan' in line) and re.search(r' on %s\b' % table, line):
+            conditions = ' '.join(l for l in plan[i + 1:] if 'Cond' in l)
+            break
+    return conditions
+
+
+def index_access(plan, table, vendor):
+    """
+    Condições usadas na busca por índice em `table` ('' se o índice só
+    serve à ordenação) ou None se a tabela é lida por inteiro.
+    """
+    if vendor == 'sqlite':
+        return _sqlite_index_access(plan, table)
+    return _postgresql_index_access(plan, table)
+
+
+class QueryPlanMixin(object):
+    """Asserções sobre o plano de execução, para usar em TestCases."""
+
+    def assertUsesIndex(self, queryset, table, *columns):
+        plan = explain(queryset)
+        vendor = connections[queryset.db].vendor
+        conditions = index_access(plan, table, vendor)
+        self.assertIsNotNone(conditions, u'%s é lida sem índice:\n%s' % (table, '\n'.join(plan)))
+        for column in columns:
+            self.assertIn(column, conditions,
+                          u'O índice usado em %s não cobre %s:\n%s' % (table, column, '\n'.join(plan)))
+
+    def assertSortsWithIndex(self, queryset):
+        plan = explain(queryset)
+        sorts = [line for line in plan if 'TEMP B-TREE' in line or line.lstrip().startswith('Sort')]
+        self.assertFalse(sorts, u'Ordenação sem índice:\n%s' % '\n'.join(plan))
@@ -0,0 +1,121 @@
+# coding: utf-8
+"""
+Leituras das páginas públicas em réplicas do banco.
+
+As leituras dos models das apps em REPLICA_APPS (a programação: palestras,
+palestrantes, mídias) vão para uma das réplicas saudáveis de
+DATABASE_REPLICAS; todo o resto, e todas as escritas, ficam no banco
+principal ('default'). Sem réplicas configuradas nada muda.
+
+Depois de uma escrita a requisição passa a ler do principal, e a
+ReplicaPinMiddleware estende isso às requisições seguintes do mesmo
+cliente por REPLICA_PIN_SECONDS, para que ele veja o que acabou de gravar
+(por exemplo, ao voltar para a lista do admin) mesmo com a réplica atrasada.
+"""
+import random
+import threading
+import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+state = threading.local()
+
+
+def pin():
+    """Faz as leituras desta thread irem para o banco principal."""
+    state.pinned = True
+
+
+def unpin():
+    state.pinned = False
+
+
+def pinned():
+    return getattr(state, 'pinned', False)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+class ReplicaPool(object):
+    """
+    Situação de cada réplica. Cada uma é testada no máximo a cada
+    REPLICA_CHECK_INTERVAL segundos; as que falham ficam de fora até o
+    próximo teste.
+    """
+    def __init__(self):
+        self.status = {}
+        self.lock = threading.Lock()
+
+    def probe(self, alias):
+        try:
+            cursor = connections[alias].cursor()
+            cursor.execute(getattr(settings, 'REPLICA_HEALTH_QUERY', 'SELECT 1'))
+            cursor.fetchone()
+        except Exception:
+            try:
+                connections[alias].close()
+            except Exception:
+                pass
+            return False
+        return True
+
+    def healthy(self, alias, now=None):
+        if now is None:
+            now = time.time()
+        interval = getattr(settings, 'REPLICA_CHECK_INTERVAL', 10)
+        with self.lock:
+            status = self.status.get(alias)
+        if status is not None and now - status[1] < interval:
+            return status[0]
+        ok = self.probe(alias)
+        with self.lock:
+            self.status[alias] = (ok, now)
+        return ok
+
+    def mark_down(self, alias, now=None):
+        with self.lock:
+            self.status[alias] = (False, time.time() if now is None else now)
+
+    def reset(self):
+        with self.lock:
+            self.status.clear()
+
+    def choose(self, aliases):
+        """Uma réplica saudável ao acaso, ou None se nenhuma estiver."""
+        candidates = [alias for alias in aliases if self.healthy(alias)]
+        return random.choice(candidates) if candidates else None
+
+
+pool = ReplicaPool()
+
+
+class ReplicaRouter(object):
+    def routed(self, model):
+        return model._meta.app_label in getattr(settings, 'REPLICA_APPS', ('core',))
+
+    def db_for_read(self, model, **hints):
+        if not replicas() or not self.routed(model):
+            return None
+        if pinned():
+            return DEFAULT_DB_ALIAS
+        return pool.choose(replicas()) or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        pin()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Réplicas têm os mesmos dados do principal.
+        databases = set((DEFAULT_DB_ALIAS,) + tuple(replicas()))
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        # As réplicas recebem o esquema pela replicação, não pelo syncdb.
+        if db in replicas():
+            return False
+        return None
@@ -0,0 +1,314 @@
+# coding: utf-8
+"""
+Busca na programação: índice invertido, em memória, sobre título e
+descrição das palestras e nome e descrição dos palestrantes.
+
+Os termos são normalizados sem acento e em minúsculas ("Descrição" e
+"descricao" são o mesmo termo) e o resultado é ordenado por BM25, com peso
+maior para título e nome. Todos os termos da busca precisam aparecer; o
+último vale também como prefixo ("pyth" acha "python").
+
+Cada processo monta o seu índice na primeira busca. Depois disso ele é
+atualizado pelos signals de save/delete deste processo e, para as
+alterações feitas em outros processos, a cada SEARCH_SYNC_INTERVAL
+segundos pelo modified_at dos models. Itens apagados em outro processo
+saem do índice quando aparecem em uma busca e não estão mais no banco.
+
+Os signals só marcam o item; ele é relido do banco antes da próxima busca.
+A carga, a sincronização e essa releitura leem sempre do banco principal:
+uma réplica atrasada devolveria dados antigos, e a sincronização só olha
+SEARCH_SYNC_OVERLAP segundos para trás.
+Assim o índice nunca guarda dados de uma transação que acabou desfeita
+(que o modified_at não traria de volta).
+
+A memória fica limitada a SEARCH_MAX_TERMS termos distintos por item; o
+índice guarda só a frequência de cada termo, os dados exibidos vêm do banco.
+"""
+import bisect
+import math
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from datetime import timedelta
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+
+STOPWORDS = frozenset(u'''
+a ao aos as com da das de do dos e em na nas no nos o os ou para pela pelas
+pelo pelos por que se sem um uma umas uns the of and to in on for
+'''.split())
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+# Acentos e demais marcas que o NFKD separa das letras, para o translate.
+COMBINING = dict.fromkeys(c for c in xrange(0x10000) if unicodedata.combining(unichr(c)))
+
+# Parâmetros do BM25.
+K1 = 1.2
+B = 0.75
+
+# Tipos de documento e o peso de cada campo indexado.
+TALK, SPEAKER = 'talk', 'speaker'
+KINDS = (TALK, SPEAKER)
+FIELDS = {
+    TALK: (('title', 3), ('description', 1)),
+    SPEAKER: (('name', 3), ('description', 1)),
+}
+
+
+def fold(text):
+    """Minúsculas e sem acentos: u'Descrição' -> u'descricao'."""
+    text = unicode(text or u'')
+    try:
+        return text.encode('ascii') and text.lower()
+    except UnicodeEncodeError:
+        return unicodedata.normalize('NFKD', text).translate(COMBINING).lower()
+
+
+def tokenize(text):
+    return [word for word in WORD.findall(fold(text)) if len(word) > 1 and word not in STOPWORDS]
+
+
+def max_terms():
+    return getattr(settings, 'SEARCH_MAX_TERMS', 200)
+
+
+def sync_interval():
+    return getattr(settings, 'SEARCH_SYNC_INTERVAL', 30)
+
+
+def weighted_terms(kind, values):
+    """{termo: frequência ponderada} dos campos, com no máximo max_terms() termos."""
+    terms, limit = {}, max_terms()
+    for field, weight in FIELDS[kind]:
+        for term in tokenize(values.get(field)):
+            if term in terms or len(terms) < limit:
+                terms[term] = terms.get(term, 0) + weight
+    return terms
+
+
+def doc_id(kind, pk):
+    """Id numérico de (tipo, pk) no índice."""
+    return pk * len(KINDS) + KINDS.index(kind)
+
+
+def doc_key(id):
+    return KINDS[id % len(KINDS)], id // len(KINDS)
+
+
+class Index(object):
+    """
+    Para cada termo, os ids dos documentos em array('l') e as frequências em
+    array('H'): cerca de 10 bytes por ocorrência, em vez de uma entrada de
+    dict. Remover custa percorrer as listas dos termos do documento, o que
+    só acontece quando ele muda.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.postings = {}      # termo -> (ids, frequências)
+            self.terms = {}         # termo -> o mesmo termo (uma só cópia de cada)
+            self.documents = {}     # id -> (tamanho, termos)
+            self.total_length = 0
+            self.vocabulary = None  # termos ordenados, para os prefixos
+            self.built = False
+            self.synced_at = None
+            self.checked_at = 0
+
+    def add(self, kind, pk, values):
+        id = doc_id(kind, pk)
+        terms = weighted_terms(kind, values)
+        with self.lock:
+            self.remove(kind, pk)
+            for term, frequency in terms.iteritems():
+                if term not in self.postings:
+                    self.postings[term] = (array('l'), array('H'))
+                    self.terms[term] = term
+                    self.vocabulary = None
+                ids, frequencies = self.postings[term]
+                ids.append(id)
+                frequencies.append(min(frequency, 0xffff))
+            length = sum(terms.itervalues())
+            # Os documentos guardam a mesma string do índice, não uma cópia cada um.
+            self.documents[id] = (length, tuple(self.terms[term] for term in terms))
+            self.total_length += length
+
+    def remove(self, kind, pk):
+        id = doc_id(kind, pk)
+        with self.lock:
+            if id not in self.documents:
+                return
+            length, terms = self.documents.pop(id)
+            self.total_length -= length
+            for term in terms:
+                ids, frequencies = self.postings[term]
+                position = ids.index(id)
+                del ids[position]
+                del frequencies[position]
+                if not ids:
+                    del self.postings[term]
+                    del self.terms[term]
+                    self.vocabulary = None
+
+    def expand(self, prefix, limit=50):
+        """Termos do índice que começam com prefix."""
+        with self.lock:
+            if self.vocabulary is None:
+                self.vocabulary = sorted(self.postings)
+            vocabulary = self.vocabulary
+        start = bisect.bisect_left(vocabulary, prefix)
+        result = []
+        for term in vocabulary[start:start + limit]:
+            if not term.startswith(prefix):
+                break
+            result.append(term)
+        return result
+
+    def matches(self, term, prefix=False):
+        """[(id, frequência)] do termo (ou dos termos com o prefixo)."""
+        if not prefix:
+            ids, frequencies = self.postings.get(term, ((), ()))
+            return zip(ids, frequencies)
+        found = {}
+        for expanded in self.expand(term):
+            ids, frequencies = self.postings[expanded]
+            for id, frequency in zip(ids, frequencies):
+                if frequency > found.get(id, 0):
+                    found[id] = frequency
+        return found.items()
+
+    def search(self, query, kinds=None):
+        """[(pontuação, (tipo, pk))], da maior pontuação para a menor."""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self.lock:
+            count = len(self.documents) or 1
+            average = float(self.total_length) / count or 1.0
+            # O termo mais raro primeiro: os seguintes só olham os candidatos dele.
+            postings = sorted((self.matches(term, prefix=(i == len(terms) - 1))
+                               for i, term in enumerate(terms)), key=len)
+            scores = None
+            for matches in postings:
+                idf = math.log(1 + (count - len(matches) + 0.5) / (len(matches) + 0.5))
+                term_scores = {}
+                for id, frequency in matches:
+                    if scores is not None and id not in scores:
+                        continue
+                    length = self.documents[id][0]
+                    term_scores[id] = (scores or {}).get(id, 0) + idf * frequency * (K1 + 1) / (
+                        frequency + K1 * (1 - B + B * length / average))
+                scores = term_scores
+                if not scores:
+                    return []
+        results = [(score, doc_key(id)) for id, score in scores.iteritems()]
+        if kinds:
+            results = [(score, key) for score, key in results if key[0] in kinds]
+        results.sort(key=lambda item: (-item[0], item[1]))
+        return results
+
+    def __len__(self):
+        return len(self.documents)
+
+
+class SearchIndex(Index):
+    """O índice da programação, com a carga e a sincronização a partir do banco."""
+
+    def clear(self):
+        with self.lock:
+            super(SearchIndex, self).clear()
+            self.stale = set()  # (tipo, pk) alterados por este processo
+
+    def load(self, kind, queryset):
+        """Indexa as linhas do queryset; devolve os pks lidos."""
+        fields = [field for field, weight in FIELDS[kind]]
+        loaded = set()
+        for row in queryset.values_list('pk', *fields).order_by().iterator():
+            self.add(kind, row[0], dict(zip(fields, row[1:])))
+            loaded.add(row[0])
+        return loaded
+
+    def querysets(self, since=None):
+        from .models import Speaker, Talk
+        talks, speakers = Talk.objects.using(DEFAULT_DB_ALIAS), Speaker.objects.using(DEFAULT_DB_ALIAS)
+        if since is not None:
+            talks, speakers = talks.filter(modified_at__gte=since), speakers.filter(modified_at__gte=since)
+        return ((TALK, talks), (SPEAKER, speakers))
+
+    def build(self):
+        with self.lock:
+            self.clear()
+            started = timezone.now()
+            for kind, queryset in self.querysets():
+                self.load(kind, queryset)
+            self.built, self.synced_at, self.checked_at = True, started, time.time()
+
+    def sync(self):
+        """Traz o que outros processos alteraram desde a última sincronização."""
+        with self.lock:
+            started = timezone.now()
+            # Margem para relógios um pouco diferentes entre os servidores.
+            since = self.synced_at - timedelta(seconds=getattr(settings, 'SEARCH_SYNC_OVERLAP', 5))
+            for kind, queryset in self.querysets(since):
+                self.load(kind, queryset)
+            self.synced_at, self.checked_at = started, time.time()
+
+    def refresh(self):
+        """Relê do banco os itens marcados; os que não existem mais saem do índice."""
+        with self.lock:
+            stale, self.stale = self.stale, set()
+            for kind, queryset in self.querysets():
+                pks = set(pk for k, pk in stale if k == kind)
+                if pks:
+                    for pk in pks - self.load(kind, queryset.filter(pk__in=list(pks))):
+                        self.remove(kind, pk)
+
+    def ensure(self):
+        if not self.built:
+            self.build()
+            return
+        if self.stale:
+            self.refresh()
+        if time.time() - self.checked_at >= sync_interval():
+            self.sync()
+
+    def mark_stale(self, kind, pk):
+        """O item mudou neste processo: relê do banco antes da próxima busca."""
+        if self.built:
+            with self.lock:
+                self.stale.add((kind, pk))
+
+    def results(self, query, limit=20, kinds=None):
+        """[(tipo, objeto)] mais relevantes para a busca, já lidos do banco."""
+        from .models import Speaker, Talk
+        self.ensure()
+        models = {TALK: Talk, SPEAKER: Speaker}
+        ranked = self.search(query, kinds)
+        results = []
+        # Lê do banco em lotes até ter `limit` itens; o que sumiu do banco sai do índice.
+        while ranked and len(results) < limit:
+            page, ranked = ranked[:limit], ranked[limit:]
+            objects = dict((kind, models[kind].objects.in_bulk([pk for score, (k, pk) in page if k == kind]))
+                           for kind in models)
+            # O que falta pode ser só atraso da réplica: confirma no principal antes de remover.
+            for kind, model in models.items():
+                missing = [pk for score, (k, pk) in page if k == kind and pk not in objects[kind]]
+                if missing:
+                    objects[kind].update(model.objects.using(DEFAULT_DB_ALIAS).in_bulk(missing))
+            for score, (kind, pk) in page:
+                obj = objects[kind].get(pk)
+                if obj is None:
+                    self.remove(kind, pk)
+                elif len(results) < limit:
+                    results.append((kind, obj))
+        return results
+
+
+index = SearchIndex()
@@ -0,0 +1,189 @@
+# coding: utf-8
+"""
+Arquivos estáticos em produção.
+
+No collectstatic, CompressedCachedStorage grava cada arquivo também com o
+hash do conteúdo no nome (style.3f2a9c1b0d4e.css, via {% static %}) e, para
+os tipos de texto, as variantes .gz e .br (esta se o módulo brotli estiver
+instalado) já comprimidas.
+
+A view `serve` entrega esses arquivos escolhendo a variante pelo
+Accept-Encoding, com ETag/If-None-Match, Range e cache "immutable" de um
+ano para os nomes com hash. Se o servidor web souber enviar o arquivo
+sozinho (STATIC_SENDFILE_HEADER = 'X-Sendfile' ou 'X-Accel-Redirect'), a
+view só responde com o cabeçalho e o worker não lê o arquivo.
+"""
+import gzip
+import mimetypes
+import os
+import re
+from StringIO import StringIO
+from email.utils import formatdate
+from django.conf import settings
+from django.contrib.staticfiles.storage import CachedStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.core.servers.basehttp import FileWrapper
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.txt', '.json', '.xml', '.ico')
+
+# (sufixo, Content-Encoding), na ordem de preferência.
+ENCODINGS = (('.br', 'br'), ('.gz', 'gzip'))
+
+HASHED = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+FOREVER = 60 * 60 * 24 * 365
+
+
+def gzip_bytes(data):
+    out = StringIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0)
+    f.write(data)
+    f.close()
+    return out.getvalue()
+
+
+class CompressedCachedStorage(CachedStaticFilesStorage):
+    def compress(self, name):
+        """Grava name.gz e name.br, se ficarem menores que o original."""
+        with self.open(name) as f:
+            data = f.read()
+        variants = [('.gz', gzip_bytes(data))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(data)))
+        written = []
+        for suffix, compressed in variants:
+            if len(compressed) < len(data):
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                written.append(self._save(name + suffix, ContentFile(compressed)))
+        return written
+
+    def post_process(self, paths, dry_run=False, **options):
+        for name, hashed_name, processed in super(CompressedCachedStorage, self).post_process(
+                paths, dry_run, **options):
+            if not dry_run and not isinstance(processed, Exception):
+                for target in (name, hashed_name):
+                    if target and target.endswith(COMPRESSIBLE):
+                        self.compress(target)
+            yield name, hashed_name, processed
+
+
+def accepted_encodings(request):
+    header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0'):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def choose_variant(request, fullpath, ranged):
+    """(caminho, Content-Encoding) do arquivo a enviar."""
+    if not ranged:
+        accepted = accepted_encodings(request)
+        for suffix, coding in ENCODINGS:
+            if coding in accepted and os.path.exists(fullpath + suffix):
+                return fullpath + suffix, coding
+    return fullpath, None
+
+
+def parse_range(header, size):
+    """(início, fim) inclusivo de um único intervalo 'bytes=', ou None."""
+    match = re.match(r'^bytes=(\d*)-(\d*)$', header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), int(last) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start > end or start >= size:
+        return None
+    return start, min(end, size - 1)
+
+
+def etag_for(stat, coding):
+    return '"%x-%x%s"' % (int(stat.st_mtime), stat.st_size, '-' + coding if coding else '')
+
+
+@require_safe
+def serve(request, path, document_root=None):
+    document_root = document_root or settings.STATIC_ROOT
+    try:
+        fullpath = safe_join(document_root, path)
+    except ValueError:
+        raise Http404(path)
+    if not os.path.isfile(fullpath):
+        raise Http404(path)
+
+    range_header = request.META.get('HTTP_RANGE')
+    filename, coding = choose_variant(request, fullpath, bool(range_header))
+    stat = os.stat(filename)
+    etag = etag_for(stat, coding)
+
+    def headers(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        response['Vary'] = 'Accept-Encoding'
+        if HASHED.search(path):
+            response['Cache-Control'] = 'public, max-age=%d, immutable' % FOREVER
+            response['Expires'] = formatdate(stat.st_mtime + FOREVER, usegmt=True)
+        else:
+            response['Cache-Control'] = 'public, max-age=%d' % getattr(settings, 'STATIC_MAX_AGE', 60 * 60)
+        return response
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+            return headers(HttpResponseNotModified())
+    else:
+        since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if since is not None and int(stat.st_mtime) <= since:
+            return headers(HttpResponseNotModified())
+
+    content_type, _ = mimetypes.guess_type(fullpath)
+    size, status, start, end = stat.st_size, 200, 0, stat.st_size - 1
+    if range_header and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        byte_range = parse_range(range_header, size)
+        if byte_range is None:
+            response = headers(HttpResponse(status=416))
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+        status, (start, end) = 206, byte_range
+
+    sendfile = getattr(settings, 'STATIC_SENDFILE_HEADER', None)
+    if sendfile and status == 200:
+        # O servidor web lê e envia o arquivo; o worker só responde os cabeçalhos.
+        response = HttpResponse(content_type=content_type or 'application/octet-stream')
+        if sendfile == 'X-Accel-Redirect':
+            prefix = getattr(settings, 'STATIC_SENDFILE_PREFIX', '/protected-static/')
+            response[sendfile] = prefix + os.path.relpath(filename, document_root)
+        else:
+            response[sendfile] = filename
+    else:
+        f = open(filename, 'rb')
+        if status == 206:
+            f.seek(start)
+            response = HttpResponse(f.read(end - start + 1), status=206,
+                                    content_type=content_type or 'application/octet-stream')
+            f.close()
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        else:
+            response = HttpResponse(FileWrapper(f), content_type=content_type or 'application/octet-stream')
+        response['Content-Length'] = str(end - start + 1)
+
+    response['Accept-Ranges'] = 'bytes'
+    if coding:
+        response['Content-Encoding'] = coding
+    return headers(response)
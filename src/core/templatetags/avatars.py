@@ -0,0 +1,25 @@
+# coding: utf-8
+from django import template
+from django.conf import settings
+from ..thumbnails import choose
+
+register = template.Library()
+
+MIMETYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+
+@register.inclusion_tag('core/avatar.html')
+def avatar(speaker, size='medium'):
+    """
+    {% avatar speaker 'medium' %}: <picture> com a miniatura do tamanho
+    pedido em cada formato, o último de AVATAR_FORMATS como <img>. Sem
+    miniaturas, o avatar original.
+    """
+    formats = getattr(settings, 'AVATAR_FORMATS', ('webp', 'jpeg'))
+    src, width, height = choose(speaker, size, formats[-1])
+    sources = []
+    for format in formats[:-1]:
+        url = choose(speaker, size, format)[0]
+        if url != src:
+            sources.append((MIMETYPES[format], url))
+    return {'speaker': speaker, 'src': src, 'width': width, 'height': height, 'sources': sources}
@@ -3,6 +3,7 @@ __author__ = 'viniciusfaria'
 
 from django import template
 from django.template import Context, Template, Node
+from ..lru import LRUCache
 
 
 TEMPLATE = """
@@ -22,6 +23,11 @@ TEMPLATE = """
 </object>
 """
 
+# O template é compilado uma única vez por processo e os fragmentos já
+# renderizados ficam num cache limitado, indexado pelos argumentos da tag.
+embed_template = Template(TEMPLATE)
+rendered = LRUCache(maxsize=512)
+
 
 def do_slideshare(parser, token):
     try:
@@ -48,9 +54,9 @@ class SlideShareNode(Node):
         except template.VariableDoesNotExist:
             actual_doc = self.doc
 
-        t = Template(TEMPLATE)
-        c = Context({'id': actual_id, 'doc': actual_doc}, autoescape=context.autoescape)
-        return t.render(c)
+        key = (actual_id, actual_doc, context.autoescape)
+        return rendered.get_or_set(key, lambda: embed_template.render(
+            Context({'id': actual_id, 'doc': actual_doc}, autoescape=context.autoescape)))
 
 
 register = template.Library()
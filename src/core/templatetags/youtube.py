@@ -3,6 +3,7 @@ __author__ = 'viniciusfaria'
 
 from django import template
 from django.template import Context, Template, Node
+from ..lru import LRUCache
 
 
 TEMPLATE = """
@@ -20,6 +21,11 @@ TEMPLATE = """
 </object>
 """
 
+# O template é compilado uma única vez por processo e os fragmentos já
+# renderizados ficam num cache limitado, indexado pelos argumentos da tag.
+embed_template = Template(TEMPLATE)
+rendered = LRUCache(maxsize=512)
+
 
 def do_youtube(parser, token):
     try:
@@ -41,9 +47,9 @@ class YoutubeNode(Node):
         except template.VariableDoesNotExist:
             actual_id = self.id
 
-        t = Template(TEMPLATE)
-        c = Context({'id': actual_id}, autoescape=context.autoescape)
-        return t.render(c)
+        key = (actual_id, None, context.autoescape)
+        return rendered.get_or_set(key, lambda: embed_template.render(
+            Context({'id': actual_id}, autoescape=context.autoescape)))
 
 
 register = template.Library()
@@ -1,8 +1,41 @@
 # coding: utf-8
+import gzip
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from StringIO import StringIO
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core import signals
+from django.core.cache import get_cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
 from django.core.urlresolvers import reverse
+from django.db import DatabaseError, connection, connections
+from django.db.models.signals import post_save
 from django.db.utils import IntegrityError
+from django.template import Context, Template, loader
 from django.test import TestCase
-from .models import Contact, Media, PeriodManager, Speaker, Talk
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone, unittest
+from mock import patch
+from . import benchmark, dbprofile, routers, search, static, thumbnails
+from .lru import LRUCache
+from .management.commands import avatar_thumbnails
+from ..subscriptions.models import Subscription
+from ..subscriptions.registry import cpf_registry
+from .. import warmup
+from .models import Contact, Course, Media, PeriodManager, Speaker, Talk
+from .pagecache import PageCache, page_cache
+from .queryplan import QueryPlanMixin
+from .templatetags import slideshare, youtube
 
 
 class HomepageTest(TestCase):
@@ -85,6 +118,39 @@ class ContactModelTest(TestCase):
         self.assertEqual(1, contact.pk)
 
 
+class SpeakerContactsTest(TestCase):
+    def setUp(self):
+        self.speaker = Speaker.objects.create(
+            name="Henrique Bastos", slug="henrique-bastos",
+            url="http://henriquebastos.net", avatar="",
+            description="Passionate software developer!")
+        Contact.objects.create(speaker=self.speaker, kind='E', value='henrique@bastos.net')
+        Contact.objects.create(speaker=self.speaker, kind='P', value='21-96186180')
+        Contact.objects.create(speaker=self.speaker, kind='P', value='21-80862728')
+
+    def test_grouped_in_one_query(self):
+        speaker = Speaker.objects.get(pk=self.speaker.pk)
+        with self.assertNumQueries(1):
+            contacts = speaker.contacts
+            self.assertEqual(['henrique@bastos.net'], [c.value for c in contacts['emails']])
+            self.assertEqual(['21-96186180', '21-80862728'], [c.value for c in contacts['phones']])
+            self.assertEqual([], contacts['faxes'])
+
+    def test_with_contacts(self):
+        """Para vários palestrantes, uma consulta para todos os contatos."""
+        Speaker.objects.create(name="Outro", slug="outro", url="http://outro.net")
+        with self.assertNumQueries(2):
+            speakers = list(Speaker.objects.with_contacts())
+            self.assertEqual([3, 0], [len(s.contact_set.all()) for s in speakers])
+            self.assertEqual(2, len(speakers[0].contacts['phones']))
+
+    def test_detail_page(self):
+        with self.assertNumQueries(2):
+            resp = self.client.get(reverse('core:speaker_detail', args=['henrique-bastos']))
+        self.assertContains(resp, 'mailto:henrique@bastos.net')
+        self.assertContains(resp, '21-80862728')
+
+
 class TalkModelTest(TestCase):
     def setUp(self):
         self.talk = Talk.objects.create(
@@ -135,6 +201,40 @@ class PeriodManagerTest(TestCase):
             ['Afternoon Talk'],
             lambda t: t.title)
 
+    def test_schedule(self):
+        morning, afternoon = Talk.objects.schedule()
+        self.assertEqual(['Morning Talk'], [t.title for t in morning])
+        self.assertEqual(['Afternoon Talk'], [t.title for t in afternoon])
+
+
+class TalksViewQueriesTest(TestCase):
+    def create_talks(self, count):
+        start = Talk.objects.count()
+        for i in range(start, start + count):
+            speaker = Speaker.objects.create(name='Speaker %d' % i, slug='speaker-%d' % i,
+                                             url='http://speaker%d.net' % i)
+            talk = Talk.objects.create(title='Talk %d' % i, start_time='%02d:00' % (8 + i % 10))
+            course = Course.objects.create(title='Course %d' % i, start_time='%02d:00' % (8 + i % 10),
+                                           slots=20, notes='Notes')
+            talk.speakers.add(speaker)
+            course.speakers.add(speaker)
+
+    def test_query_count_is_constant(self):
+        """O número de consultas da grade não depende da quantidade de palestras."""
+        self.create_talks(2)
+        with self.assertNumQueries(2):
+            resp = self.client.get(reverse('core:talks'))
+        self.assertContains(resp, 'Speaker 1', 2)
+
+        self.create_talks(10)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('core:talks'))
+
+    def test_course_data(self):
+        self.create_talks(1)
+        resp = self.client.get(reverse('core:talks'))
+        self.assertContains(resp, '20 vagas', 1)
+
 
 class MediaModelTest(TestCase):
     def setUp(self):
@@ -147,6 +247,15 @@ class MediaModelTest(TestCase):
     def test_unicode(self):
         self.assertEqual("Talk 1 - Video", unicode(self.media))
 
+    def test_unicode_does_not_query_talk(self):
+        media = Media.objects.with_talk().get(pk=self.media.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual("Talk 1 - Video", unicode(media))
+
+    def test_default_manager_without_join(self):
+        u"""Os prefetch de media_set não trazem a palestra de novo."""
+        self.assertNotIn('core_talk', str(Media.objects.filter(talk__in=[1]).query))
+
 
 class TalkDetailTest(TestCase):
     def setUp(self):
@@ -163,6 +272,14 @@ class TalkDetailTest(TestCase):
         talk = self.resp.context['talk']
         self.assertIsInstance(talk, Talk)
 
+    def test_slides_and_videos(self):
+        talk = Talk.objects.get(pk=1)
+        Media.objects.create(talk=talk, type='SL', media_id='slide-1', title='Slide')
+        Media.objects.create(talk=talk, type='YT', media_id='video-1', title='Video')
+        with self.assertNumQueries(1):
+            self.assertEqual(['slide-1'], [m.media_id for m in talk.slides])
+            self.assertEqual(['video-1'], [m.media_id for m in talk.videos])
+
     '''
     def test_videos_in_context(self):
         self.assertIn('videos', self.resp.context)
@@ -170,3 +287,914 @@ class TalkDetailTest(TestCase):
     def test_slides_in_context(self):
         self.assertIn('slides', self.resp.context)
     '''
+
+
+class LRUCacheTest(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(2, len(cache))
+
+    def test_unhashable_key_is_not_cached(self):
+        cache = LRUCache()
+        self.assertEqual(1, cache.get_or_set(['a'], lambda: 1))
+        self.assertEqual(0, len(cache))
+
+
+class EmbedTagsTest(TestCase):
+    def setUp(self):
+        slideshare.rendered.clear()
+        youtube.rendered.clear()
+
+    def render(self, source, **context):
+        return Template('{% load slideshare youtube %}' + source).render(Context(context))
+
+    def test_slideshare(self):
+        html = self.render('{% slideshare id doc %}', id=1, doc='doc-1')
+        self.assertIn('__sse1', html)
+        self.assertIn('doc=doc-1', html)
+
+    def test_youtube(self):
+        html = self.render('{% youtube id %}', id='QjA5faZF1A8')
+        self.assertIn('http://www.youtube.com/v/QjA5faZF1A8', html)
+
+    def test_fragments_are_cached(self):
+        """Renderizar a mesma mídia duas vezes usa o fragmento em cache."""
+        first = self.render('{% youtube id %}', id='QjA5faZF1A8')
+        second = self.render('{% youtube id %}', id='QjA5faZF1A8')
+        self.assertEqual(first, second)
+        self.assertEqual(1, youtube.rendered.hits)
+
+    def test_cache_key_includes_autoescape(self):
+        self.render('{% youtube id %}', id='<b>')
+        self.render('{% autoescape off %}{% youtube id %}{% endautoescape %}', id='<b>')
+        self.assertEqual(2, len(youtube.rendered))
+
+
+class TalkDetailQueriesTest(TestCase):
+    def setUp(self):
+        self.talk = Talk.objects.create(title='Talk', start_time='10:00')
+        self.talk.speakers.add(Speaker.objects.create(
+            name='Henrique Bastos', slug='henrique-bastos', url='http://henriquebastos.net'))
+
+    def create_medias(self, count):
+        for i in range(count):
+            Media.objects.create(talk=self.talk, type='SL', media_id='sl%d' % i, title='Slide %d' % i)
+            Media.objects.create(talk=self.talk, type='YT', media_id='yt%d' % i, title='Video %d' % i)
+
+    def get(self):
+        return self.client.get(reverse('core:talk_detail', args=[self.talk.pk]))
+
+    def test_query_count_is_constant(self):
+        """Talk, palestrantes e mídias: o total de consultas não depende das mídias."""
+        self.create_medias(1)
+        with self.assertNumQueries(3):
+            resp = self.get()
+        self.assertContains(resp, 'Henrique Bastos')
+        self.assertContains(resp, '__ssesl0')
+        self.assertContains(resp, 'youtube.com/v/yt0')
+
+        self.create_medias(5)
+        with self.assertNumQueries(3):
+            self.get()
+
+
+@override_settings(PAGE_CACHE_ENABLED=True)
+class PageCacheTest(TestCase):
+    def setUp(self):
+        page_cache.cache.clear()
+        self.henrique = Speaker.objects.create(
+            name='Henrique Bastos', slug='henrique-bastos', url='http://henriquebastos.net')
+        self.vinicius = Speaker.objects.create(
+            name=u'Vinícius Faria', slug='vinicius-faria', url='http://viniciusfaria.net')
+        self.talk = Talk.objects.create(title='Talk', start_time='10:00')
+        self.talk.speakers.add(self.henrique)
+        self.other = Talk.objects.create(title='Other', start_time='14:00')
+        self.other.speakers.add(self.vinicius)
+
+    def get(self, name, *args):
+        return self.client.get(reverse(name, args=args))
+
+    def assertCached(self, name, *args):
+        with self.assertNumQueries(0):
+            self.get(name, *args)
+
+    def assertNotCached(self, name, *args):
+        self.assertTrue(self.get(name, *args).templates)
+
+    def test_hit(self):
+        self.assertNotCached('core:talks')
+        self.assertCached('core:talks')
+        self.assertEqual((1, 1), page_cache.stats(['schedule'])['schedule'])
+
+    def test_ignores_query_string(self):
+        """Parâmetros que a página não usa (utm_*, cache-busters) não criam outra cópia."""
+        self.get('core:talks')
+        with self.assertNumQueries(0):
+            self.client.get(reverse('core:talks'), {'utm_source': 'twitter', '_': '1234'})
+
+    def test_declared_params(self):
+        request = RequestFactory().get('/palestras/', {'page': '2', 'utm_source': 'twitter'})
+        key = page_cache.page_key(request, ['schedule'], [1], params=['page'])
+        self.assertNotEqual(key, page_cache.page_key(RequestFactory().get('/palestras/'), ['schedule'], [1],
+                                                     params=['page']))
+        self.assertEqual(key, page_cache.page_key(RequestFactory().get('/palestras/', {'page': '2'}),
+                                                  ['schedule'], [1], params=['page']))
+
+    def test_stats_command(self):
+        self.get('core:talks')
+        out = StringIO()
+        call_command('pagecache_stats', stdout=out)
+        self.assertIn('schedule', out.getvalue())
+        # A home é estática e não passa pelo cache.
+        self.assertNotIn('homepage', out.getvalue())
+
+    def test_speaker_edit(self):
+        """Editar um palestrante limpa a página dele, a grade e suas palestras."""
+        for name, arg in (('core:speaker_detail', 'henrique-bastos'), ('core:speaker_detail', 'vinicius-faria'),
+                          ('core:talks', None), ('core:talk_detail', self.talk.pk),
+                          ('core:talk_detail', self.other.pk)):
+            self.get(name, *filter(None, [arg]))
+
+        self.henrique.description = 'Novo'
+        self.henrique.save()
+
+        self.assertNotCached('core:speaker_detail', 'henrique-bastos')
+        self.assertNotCached('core:talks')
+        self.assertNotCached('core:talk_detail', self.talk.pk)
+        self.assertCached('core:speaker_detail', 'vinicius-faria')
+        self.assertCached('core:talk_detail', self.other.pk)
+
+    def test_media(self):
+        """Uma mídia nova só afeta a página da sua palestra."""
+        self.get('core:talks')
+        self.get('core:talk_detail', self.talk.pk)
+        Media.objects.create(talk=self.talk, type='YT', media_id='QjA5faZF1A8', title='Video')
+        self.assertNotCached('core:talk_detail', self.talk.pk)
+        self.assertCached('core:talks')
+
+    def test_contact(self):
+        self.get('core:speaker_detail', 'henrique-bastos')
+        Contact.objects.create(speaker=self.henrique, kind='E', value='henrique@bastos.net')
+        self.assertNotCached('core:speaker_detail', 'henrique-bastos')
+
+    def test_talk_speakers(self):
+        self.get('core:talk_detail', self.other.pk)
+        self.henrique.talk_set.add(self.other)
+        self.assertNotCached('core:talk_detail', self.other.pk)
+
+
+class PageCacheFileBackendTest(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        cache = get_cache('django.core.cache.backends.filebased.FileBasedCache', LOCATION=self.location)
+        self.page_cache = PageCache(cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_invalidate(self):
+        versions = self.page_cache.versions(['schedule', 'talk:1'])
+        self.page_cache.invalidate('talk:1')
+        new = self.page_cache.versions(['schedule', 'talk:1'])
+        self.assertEqual(versions[0], new[0])
+        self.assertTrue(new[1] > versions[1])
+
+    def test_counters(self):
+        self.page_cache.count('hits', 'talk')
+        self.page_cache.count('hits', 'talk')
+        self.assertEqual({'talk': (2, 0)}, self.page_cache.stats(['talk']))
+
+
+@override_settings(PAGE_CACHE_ENABLED=True)
+class ScheduleJsonTest(TestCase):
+    def setUp(self):
+        page_cache.cache.clear()
+        speaker = Speaker.objects.create(
+            name='Henrique Bastos', slug='henrique-bastos', url='http://henriquebastos.net')
+        Contact.objects.create(speaker=speaker, kind='E', value='henrique@bastos.net')
+        self.talk = Talk.objects.create(title='Talk', start_time='10:00')
+        self.talk.speakers.add(speaker)
+        Course.objects.create(title='Course', start_time='14:00', slots=20, notes='Notes')
+        self.resp = self.client.get(reverse('core:schedule_json'))
+
+    def test_document(self):
+        data = json.loads(self.resp.content)
+        self.assertEqual('application/json', self.resp['Content-Type'])
+        self.assertEqual(['Talk', 'Course'], [t['title'] for t in data['talks']])
+        self.assertEqual({'slots': 20, 'notes': 'Notes'}, data['talks'][1]['course'])
+        self.assertEqual([{'kind': 'E', 'value': 'henrique@bastos.net'}], data['speakers'][0]['contacts'])
+
+    def test_not_modified(self):
+        """Com o ETag certo a resposta é 304, sem consultar o banco."""
+        with self.assertNumQueries(0):
+            resp = self.client.get(reverse('core:schedule_json'),
+                                   HTTP_IF_NONE_MATCH=self.resp['ETag'])
+        self.assertEqual(304, resp.status_code)
+
+    def test_head(self):
+        """HEAD responde como o GET, inclusive com o 304 condicional."""
+        resp = self.client.head(reverse('core:schedule_json'))
+        self.assertEqual((200, self.resp['ETag']), (resp.status_code, resp['ETag']))
+        resp = self.client.head(reverse('core:schedule_json'), HTTP_IF_NONE_MATCH=self.resp['ETag'])
+        self.assertEqual(304, resp.status_code)
+        self.assertEqual(405, self.client.post(reverse('core:schedule_json')).status_code)
+
+    def test_if_modified_since(self):
+        resp = self.client.get(reverse('core:schedule_json'),
+                               HTTP_IF_MODIFIED_SINCE=self.resp['Last-Modified'])
+        self.assertEqual(304, resp.status_code)
+
+    def test_changes_etag(self):
+        Media.objects.create(talk=self.talk, type='YT', media_id='QjA5faZF1A8', title='Video')
+        resp = self.client.get(reverse('core:schedule_json'), HTTP_IF_NONE_MATCH=self.resp['ETag'])
+        self.assertEqual(200, resp.status_code)
+        self.assertNotEqual(self.resp['ETag'], resp['ETag'])
+        self.assertEqual('QjA5faZF1A8', json.loads(resp.content)['talks'][0]['media'][0]['media_id'])
+
+
+class IndexTest(QueryPlanMixin, TestCase):
+    """As consultas que as views públicas fazem (veja views.py e api.py)."""
+
+    def test_schedule_order(self):
+        u"""Grade (talks e o JSON): todas as palestras, já em ordem pelo índice de start_time."""
+        qs = Talk.objects.select_related(*Talk.objects.subclasses())
+        self.assertSortsWithIndex(qs.order_by('start_time'))
+        self.assertSortsWithIndex(qs.order_by('start_time', 'pk'))
+
+    def test_speakers_by_talk(self):
+        u"""prefetch_related('speakers') da grade e do detalhe da palestra."""
+        self.assertUsesIndex(Speaker.objects.filter(talk__in=[1, 2]), 'core_talk_speakers', 'talk_id')
+
+    def test_medias_by_talk(self):
+        u"""prefetch_related('media_set') do detalhe da palestra e do JSON."""
+        self.assertUsesIndex(Media.objects.filter(talk__in=[1, 2]), 'core_media', 'talk_id')
+
+    def test_speaker_by_slug(self):
+        self.assertUsesIndex(Speaker.objects.with_contacts().filter(slug='henrique-bastos'),
+                             'core_speaker', 'slug')
+
+    def test_contacts_by_speaker(self):
+        u"""prefetch_related('contact_set') de Speaker.objects.with_contacts()."""
+        self.assertUsesIndex(Contact.objects.filter(speaker__in=[1, 2]), 'core_contact', 'speaker_id')
+
+
+class BenchmarkTest(TestCase):
+    def setUp(self):
+        self.counts = benchmark.generate(seed=1, speakers=5, talks=6, courses=2, subscriptions=30)
+
+    def test_generate(self):
+        self.assertEqual(5, Speaker.objects.count())
+        self.assertEqual(8, Talk.objects.count())
+        self.assertEqual(2, Course.objects.count())
+        self.assertEqual(self.counts['medias'], Media.objects.count())
+        self.assertTrue(all(t.speakers.exists() for t in Talk.objects.all()))
+
+    def test_deterministic(self):
+        """A mesma semente gera os mesmos dados."""
+        titles = list(Talk.objects.order_by('pk').values_list('title', flat=True))
+        Talk.objects.all().delete()
+        Speaker.objects.all().delete()
+        Subscription.objects.all().delete()
+        benchmark.generate(seed=1, speakers=5, talks=6, courses=2, subscriptions=30)
+        self.assertEqual(titles, list(Talk.objects.order_by('pk').values_list('title', flat=True)))
+
+    def test_run_all_urls(self):
+        results = benchmark.run(benchmark.scenarios(seed=1, subscriptions=30), repeat=2)
+        self.assertItemsEqual(
+            ['homepage', 'talks', 'talk_detail', 'speaker_detail', 'schedule_json', 'subscribe_get',
+             'subscribe_post', 'success', 'admin_changelist', 'admin_export'], results)
+        self.assertEqual([302], results['subscribe_post']['status'])
+        self.assertEqual([200], results['admin_export']['status'])
+        self.assertTrue(results['talks']['p50_ms'] <= results['talks']['p99_ms'])
+
+    def test_compare(self):
+        rows = benchmark.compare({'a': {'p50_ms': 10.0}, 'b': {'p50_ms': 1.0}}, {'a': {'p50_ms': 5.0}})
+        self.assertEqual([('a', 10.0, 5.0, -50.0)], rows)
+
+
+class WarmupTest(TestCase):
+    def tearDown(self):
+        loader.template_source_loaders = None
+
+    def test_project_templates(self):
+        names = warmup.project_templates()
+        for name in ('base.html', 'core/talks_snippet.html', 'subscriptions/subscription_form.html'):
+            self.assertIn(name, names)
+
+    def test_compiles_into_cached_loader(self):
+        """Depois do aquecimento os templates já estão compilados no loader em cache."""
+        cached = (('django.template.loaders.cached.Loader', (
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader')),)
+        with override_settings(TEMPLATE_LOADERS=cached):
+            loader.template_source_loaders = None
+            steps = dict(warmup.warm_up())
+            self.assertItemsEqual(['models', 'urls', 'templates', 'search', 'cpf_registry'], steps)
+            template_cache = loader.template_source_loaders[0].template_cache
+            self.assertIn('core/talks.html', template_cache)
+            self.assertIn('base.html', template_cache)
+
+    def test_warms_cpf_registry(self):
+        """O registro de CPFs é montado no aquecimento, não na primeira inscrição."""
+        cpf_registry.clear()
+        with override_settings(CPF_REGISTRY_WARMUP=True):
+            warmup.warm_up()
+        self.assertTrue(cpf_registry.is_warm())
+
+
+class FakeDbConnection(object):
+    """Como o psycopg2: qualquer consulta abre uma transação."""
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.closed = False
+        self.in_transaction = False
+
+    def cursor(self):
+        if not self.alive:
+            raise DatabaseError('server closed the connection unexpectedly')
+        return self
+
+    def execute(self, sql):
+        self.in_transaction = True
+
+    def close(self):
+        self.closed = True
+
+    def rollback(self):
+        if not self.alive:
+            raise DatabaseError('server closed the connection unexpectedly')
+        self.in_transaction = False
+
+
+class FakeWrapper(object):
+    vendor = 'postgresql'
+    alias = 'fake'
+
+    def __init__(self, connection, opened_at):
+        self.connection = connection
+        self._opened_at = self._checked_at = opened_at
+
+    def close(self):
+        self.connection.close()
+        self.connection = None
+
+
+class DatabaseProfileTest(TestCase):
+    def test_sqlite_pragmas(self):
+        """As conexões SQLite recebem os PRAGMAs do perfil."""
+        self.assertEqual(1, connection.connection.execute('PRAGMA synchronous').fetchone()[0])
+        self.assertEqual(5000, connection.connection.execute('PRAGMA busy_timeout').fetchone()[0])
+
+    def test_retry_on_lock(self):
+        calls = []
+
+        def locked_twice():
+            calls.append(1)
+            if len(calls) < 3:
+                raise DatabaseError('database is locked')
+            return 'ok'
+
+        self.assertEqual('ok', dbprofile.retry_on_lock(locked_twice, delay=0))
+        self.assertEqual(3, len(calls))
+
+    def test_retry_gives_up(self):
+        def locked():
+            raise DatabaseError('database is locked')
+        self.assertRaises(DatabaseError, dbprofile.retry_on_lock, locked, attempts=2, delay=0)
+
+    def test_other_errors_not_retried(self):
+        calls = []
+
+        def broken():
+            calls.append(1)
+            raise DatabaseError('no such table')
+        self.assertRaises(DatabaseError, dbprofile.retry_on_lock, broken, delay=0)
+        self.assertEqual(1, len(calls))
+
+    def test_health_check_discards_dead_connection(self):
+        wrapper = FakeWrapper(FakeDbConnection(alive=False), opened_at=0)
+        with patch.object(dbprofile.connections, 'all', return_value=[wrapper]):
+            dbprofile.check_connections()
+        self.assertIsNone(wrapper.connection)
+
+    def test_health_check_keeps_live_connection(self):
+        db = FakeDbConnection()
+        wrapper = FakeWrapper(db, opened_at=0)
+        with patch.object(dbprofile.connections, 'all', return_value=[wrapper]):
+            dbprofile.check_connections()
+        self.assertIs(db, wrapper.connection)
+        self.assertTrue(wrapper._checked_at > 0)
+
+    @override_settings(DATABASE_CONN_MAX_AGE=600)
+    def test_release_keeps_young_connections(self):
+        young = FakeWrapper(FakeDbConnection(), opened_at=time.time())
+        old = FakeWrapper(FakeDbConnection(), opened_at=time.time() - 601)
+        with patch.object(dbprofile.connections, 'all', return_value=[young, old]):
+            with patch.object(dbprofile.transaction, 'abort'):
+                dbprofile.release_connections()
+        self.assertIsNotNone(young.connection)
+        self.assertIsNone(old.connection)
+
+    def test_release_ends_read_only_transaction(self):
+        """Depois de um GET, a conexão guardada não fica numa transação aberta."""
+        db = FakeDbConnection()
+        db.execute('SELECT 1')
+        wrapper = FakeWrapper(db, opened_at=time.time())
+        signals.request_finished.connect(dbprofile.release_connections, dispatch_uid='dbprofile-test')
+        try:
+            with patch.object(dbprofile.connections, 'all', return_value=[wrapper]):
+                with patch.object(dbprofile.transaction, 'abort'):
+                    self.client.get('/')
+        finally:
+            signals.request_finished.disconnect(dispatch_uid='dbprofile-test')
+        self.assertIs(db, wrapper.connection)
+        self.assertFalse(db.in_transaction)
+
+    def test_release_closes_when_rollback_fails(self):
+        db = FakeDbConnection(alive=False)
+        wrapper = FakeWrapper(db, opened_at=time.time())
+        with patch.object(dbprofile.connections, 'all', return_value=[wrapper]):
+            with patch.object(dbprofile.transaction, 'abort'):
+                dbprofile.release_connections()
+        self.assertIsNone(wrapper.connection)
+        self.assertTrue(db.closed)
+
+
+class ReplicaRouterTest(TestCase):
+    """Principal em memória (o banco de teste) e réplica num arquivo SQLite."""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'replica.db')
+        connections.databases['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': self.path}
+        connections.ensure_defaults('replica')
+
+        Talk.objects.create(title=u'Replicada', start_time='10:00')
+        self.replicate()
+        Talk.objects.create(title=u'Só no principal', start_time='11:00')
+
+        routers.unpin()
+        routers.pool.reset()
+        self.settings = override_settings(DATABASE_REPLICAS=('replica',))
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        connections['replica'].close()
+        if hasattr(connections._connections, 'replica'):
+            delattr(connections._connections, 'replica')
+        del connections.databases['replica']
+        routers.pool.reset()
+        routers.unpin()
+        shutil.rmtree(self.dir)
+
+    def replicate(self):
+        # O que a replicação faria: uma cópia do banco principal. Só com
+        # SELECTs, que não encerram a transação do teste (o iterdump encerraria).
+        source, target = connection.connection, sqlite3.connect(self.path)
+        tables = source.execute("SELECT name, sql FROM sqlite_master "
+                                "WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall()
+        for name, sql in tables:
+            target.execute(sql)
+            columns = [c[0] for c in source.execute('SELECT * FROM "%s" LIMIT 0' % name).description]
+            values = " || ', ' || ".join('quote("%s")' % column for column in columns)
+            for (row,) in source.execute('SELECT %s FROM "%s"' % (values, name)):
+                target.execute('INSERT INTO "%s" VALUES (%s)' % (name, row))
+        target.commit()
+        target.close()
+
+    def test_core_reads_from_replica(self):
+        self.assertEqual('replica', Talk.objects.all().db)
+        self.assertEqual([u'Replicada'], [t.title for t in Talk.objects.all()])
+
+    def test_subscriptions_on_primary(self):
+        self.assertEqual('default', Subscription.objects.all().db)
+
+    def test_write_pins_reads_to_primary(self):
+        """Depois de uma escrita a thread lê do principal."""
+        Speaker.objects.create(name='Henrique Bastos', slug='henrique-bastos', url='http://henriquebastos.net')
+        self.assertEqual('default', Talk.objects.all().db)
+
+    def test_public_page_from_replica(self):
+        resp = self.client.get(reverse('core:talks'))
+        self.assertContains(resp, u'Replicada')
+        self.assertNotContains(resp, u'Só no principal')
+
+    def test_read_after_write(self):
+        """Depois de um POST o cliente lê do principal por alguns segundos."""
+        self.client.post(reverse('subscriptions:subscribe'), {'name': 'Henrique', 'cpf': '12345678901',
+                                                             'email': 'henrique@bastos.net'})
+        self.assertIn('pin_primary', self.client.cookies)
+        self.assertContains(self.client.get(reverse('core:talks')), u'Só no principal')
+
+    @override_settings(PAGE_CACHE_ENABLED=True)
+    def test_page_cache_after_invalidation(self):
+        """Página invalidada há pouco é montada a partir do principal antes de ir para o cache."""
+        page_cache.cache.clear()
+        page_cache.invalidate('schedule')
+        self.assertContains(self.client.get(reverse('core:talks')), u'Só no principal')
+        # A versão em cache é a do principal, mesmo para quem depois leria da réplica.
+        with override_settings(REPLICA_PIN_SECONDS=0):
+            self.assertContains(self.client.get(reverse('core:talks')), u'Só no principal')
+
+    @override_settings(PAGE_CACHE_ENABLED=True)
+    def test_schedule_json_after_invalidation(self):
+        """O documento JSON invalidado há pouco também é montado a partir do principal."""
+        page_cache.cache.clear()
+        page_cache.invalidate('core')
+        resp = self.client.get(reverse('core:schedule_json'))
+        self.assertIn(u'Só no principal', [t['title'] for t in json.loads(resp.content)['talks']])
+
+    @override_settings(PAGE_CACHE_ENABLED=True, REPLICA_PIN_SECONDS=0)
+    def test_page_cache_from_replica(self):
+        """Sem invalidação recente, a página que falta no cache é lida da réplica."""
+        page_cache.cache.clear()
+        self.assertNotContains(self.client.get(reverse('core:talks')), u'Só no principal')
+
+    def test_search_index_reads_primary(self):
+        """O índice de busca é montado e sincronizado a partir do principal, nunca da réplica atrasada."""
+        index = search.SearchIndex()
+        index.build()
+        hits = index.search(u'principal')
+        self.assertEqual(1, len(hits))
+        index.sync()
+        index.mark_stale(search.TALK, hits[0][1][1])
+        index.refresh()
+        self.assertEqual([(search.TALK, u'Só no principal')],
+                         [(kind, obj.title) for kind, obj in index.results(u'principal')])
+
+    def test_unhealthy_replica(self):
+        """Réplica fora do ar: as leituras voltam para o principal."""
+        connections['replica'].close()
+        connections.databases['replica']['NAME'] = os.path.join(self.dir, 'nao-existe', 'replica.db')
+        self.assertEqual('default', Talk.objects.all().db)
+
+    def test_health_is_cached(self):
+        routers.pool.mark_down('replica', now=time.time())
+        self.assertEqual('default', Talk.objects.all().db)
+        with override_settings(REPLICA_CHECK_INTERVAL=0):
+            self.assertEqual('replica', Talk.objects.all().db)
+
+
+class StaticServeTest(TestCase):
+    def setUp(self):
+        self.root, self.source = tempfile.mkdtemp(), tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.source, 'css'))
+        shutil.copytree(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'img'),
+                        os.path.join(self.source, 'img'))
+        with open(os.path.join(self.source, 'css', 'style.css'), 'w') as f:
+            f.write('#page { margin: 0 auto; }\n' * 100)
+        self.settings = override_settings(STATIC_ROOT=self.root, STATICFILES_DIRS=(self.source,),
+                                          STATICFILES_STORAGE='src.core.static.CompressedCachedStorage')
+        self.settings.enable()
+        # O collectstatic e a tag {% static %} usam instâncias montadas uma vez só.
+        staticfiles_storage._setup()
+        finders._finders.clear()
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.storage = static.CompressedCachedStorage()
+        self.css = self.storage.hashed_name('css/style.css')
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        self.settings.disable()
+        staticfiles_storage._setup()
+        finders._finders.clear()
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.source)
+
+    def get(self, path, **headers):
+        return static.serve(self.factory.get('/static/' + path, **headers), path, document_root=self.root)
+
+    def body(self, response):
+        return ''.join(response)
+
+    def test_collectstatic_writes_hashed_and_compressed(self):
+        self.assertTrue(re.match(r'^css/style\.[0-9a-f]{12}\.css$', self.css))
+        for name in (self.css, self.css + '.gz', 'css/style.css.gz'):
+            self.assertTrue(os.path.exists(os.path.join(self.root, name)), name)
+        original = open(os.path.join(self.root, self.css), 'rb').read()
+        self.assertEqual(original, gzip.open(os.path.join(self.root, self.css + '.gz')).read())
+
+    def test_own_cache(self):
+        """Os nomes com hash ficam num cache próprio, não no default das páginas."""
+        storage = static.CompressedCachedStorage()
+        self.assertIs(get_cache('staticfiles')._cache, storage.cache._cache)
+        storage.cache.set('teste', 1)
+        self.assertIsNone(get_cache('default').get('teste'))
+
+    def test_binary_not_compressed(self):
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'img', 'logo.jpg')))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'img', 'logo.jpg.gz')))
+
+    def test_gzip_variant(self):
+        resp = self.get(self.css, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual('gzip', resp['Content-Encoding'])
+        self.assertEqual('text/css', resp['Content-Type'])
+        self.assertEqual('Accept-Encoding', resp['Vary'])
+        self.assertEqual(open(os.path.join(self.root, self.css + '.gz'), 'rb').read(), self.body(resp))
+
+    def test_identity(self):
+        for encoding in ('', 'gzip;q=0'):
+            resp = self.get(self.css, HTTP_ACCEPT_ENCODING=encoding)
+            self.assertFalse(resp.has_header('Content-Encoding'))
+            self.assertEqual(open(os.path.join(self.root, self.css), 'rb').read(), self.body(resp))
+
+    def test_cache_control(self):
+        self.assertIn('immutable', self.get(self.css)['Cache-Control'])
+        self.assertEqual('public, max-age=3600', self.get('css/style.css')['Cache-Control'])
+
+    def test_not_modified(self):
+        etag = self.get(self.css, HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        resp = self.get(self.css, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, resp.status_code)
+        self.assertEqual('', resp.content)
+        # A ETag da variante comprimida não vale para a original.
+        self.assertEqual(200, self.get(self.css, HTTP_IF_NONE_MATCH=etag).status_code)
+
+    def test_range(self):
+        original = open(os.path.join(self.root, self.css), 'rb').read()
+        resp = self.get(self.css, HTTP_RANGE='bytes=10-19', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(206, resp.status_code)
+        self.assertFalse(resp.has_header('Content-Encoding'))
+        self.assertEqual('bytes 10-19/%d' % len(original), resp['Content-Range'])
+        self.assertEqual(original[10:20], resp.content)
+        self.assertEqual(original[-5:], self.get(self.css, HTTP_RANGE='bytes=-5').content)
+        self.assertEqual(416, self.get(self.css, HTTP_RANGE='bytes=%d-' % len(original)).status_code)
+
+    def test_sendfile(self):
+        with override_settings(STATIC_SENDFILE_HEADER='X-Accel-Redirect'):
+            resp = self.get(self.css, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual('/protected-static/%s.gz' % self.css, resp['X-Accel-Redirect'])
+        self.assertEqual('', resp.content)
+
+    def test_outside_root(self):
+        from django.http import Http404
+        self.assertRaises(Http404, self.get, '../etc/passwd')
+        self.assertRaises(Http404, self.get, 'css/nao-existe.css')
+
+    def test_static_tag(self):
+        html = Template("{% load static from staticfiles %}{% static 'css/style.css' %}").render(Context())
+        self.assertEqual('/static/' + self.css, html)
+
+
+def fake_render(data, size, format):
+    return '%s-%d-%s' % (format, size, data), (size, size)
+
+
+@override_settings(AVATAR_WORKERS=0, AVATAR_SIZES=(('small', 64), ('medium', 200)),
+                   AVATAR_FORMATS=('webp', 'jpeg'))
+class AvatarThumbnailsTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.root)
+        self.settings.enable()
+        default_storage._setup()
+        # Sem depender do Pillow: as "imagens" são texto.
+        self.patches = [patch.object(thumbnails, 'render', fake_render),
+                        patch.object(thumbnails, 'formats', lambda: ['webp', 'jpeg'])]
+        for p in self.patches:
+            p.start()
+        self.speaker = Speaker.objects.create(name='Henrique Bastos', slug='henrique-bastos',
+                                              url='http://henriquebastos.net')
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.settings.disable()
+        default_storage._setup()
+        shutil.rmtree(self.root)
+
+    def upload(self, content='foto'):
+        self.speaker.avatar.save('foto.jpg', ContentFile(content))
+        return Speaker.objects.get(pk=self.speaker.pk)
+
+    def test_variant_name(self):
+        self.assertTrue(re.match(r'^palestrantes/foto\.medium\.[0-9a-f]{12}\.webp$',
+                                 thumbnails.variant_name('palestrantes/foto.jpg', 'medium', 'webp', 'x')))
+
+    def test_generated_on_upload(self):
+        speaker = self.upload()
+        variants = speaker.thumbnails
+        self.assertEqual(speaker.avatar.name, variants['source'])
+        self.assertEqual(['medium', 'small'], sorted(variants['sizes']))
+        medium = variants['sizes']['medium']
+        self.assertEqual(200, medium['width'])
+        self.assertTrue(medium['webp'].startswith('palestrantes/foto.medium.'))
+        self.assertEqual('webp-200-foto', default_storage.open(medium['webp']).read())
+        self.assertEqual('jpeg-200-foto', default_storage.open(medium['jpeg']).read())
+
+    def test_not_in_request_thread(self):
+        with override_settings(AVATAR_WORKERS=2):
+            with patch.object(thumbnails, 'pool') as pool:
+                self.upload()
+        self.assertEqual(1, pool.return_value.apply_async.call_count)
+        self.assertEqual('', Speaker.objects.get(pk=self.speaker.pk).avatar_variants)
+
+    def test_template_picks_variant(self):
+        speaker = self.upload()
+        medium = speaker.thumbnails['sizes']['medium']
+        html = Template("{% load avatars %}{% avatar speaker 'medium' %}").render(Context({'speaker': speaker}))
+        self.assertIn('<source type="image/webp" srcset="/media/%s" />' % medium['webp'], html)
+        self.assertIn('<img src="/media/%s" alt="Henrique Bastos" width="200" height="200" />'
+                      % medium['jpeg'], html)
+
+    def test_speaker_page(self):
+        speaker = self.upload()
+        resp = self.client.get(reverse('core:speaker_detail', args=['henrique-bastos']))
+        self.assertContains(resp, speaker.thumbnails['sizes']['medium']['jpeg'])
+
+    def test_original_without_variants(self):
+        with patch.object(thumbnails, 'formats', lambda: []):
+            speaker = self.upload()
+        self.assertEqual('', speaker.avatar_variants)
+        html = Template("{% load avatars %}{% avatar speaker %}").render(Context({'speaker': speaker}))
+        self.assertEqual('<picture><img src="%s" alt="Henrique Bastos" /></picture>' % speaker.avatar.url,
+                         html.strip())
+
+    def test_no_avatar(self):
+        html = Template("{% load avatars %}{% avatar speaker %}").render(Context({'speaker': self.speaker}))
+        self.assertEqual('', html.strip())
+
+    def test_new_avatar_replaces_variants(self):
+        old = self.upload('antiga').thumbnails
+        speaker = self.upload('nova')
+        self.assertNotEqual(old['source'], speaker.thumbnails['source'])
+        self.assertEqual('webp-64-nova', default_storage.open(speaker.thumbnails['sizes']['small']['webp']).read())
+
+    def test_stale_variants_ignored(self):
+        """Enquanto as miniaturas do avatar novo não ficam prontas, vale o original."""
+        self.upload()
+        with override_settings(AVATAR_WORKERS=2):
+            with patch.object(thumbnails, 'pool'):
+                speaker = self.upload('outra')
+        self.assertEqual((speaker.avatar.url, None, None), thumbnails.choose(speaker, 'medium'))
+
+    def test_store_gives_up_with_warning(self):
+        """Se o palestrante não tiver mais o avatar, desiste e registra no log."""
+        name = default_storage.save('palestrantes/foto.jpg', ContentFile('foto'))
+        with patch.object(thumbnails.time, 'sleep') as sleep:
+            with patch.object(thumbnails.logger, 'warning') as warning:
+                self.assertIsNone(thumbnails.process(self.speaker.pk, name, default_storage, retries=2))
+        self.assertEqual(3, sleep.call_count)
+        self.assertTrue(warning.called)
+
+    def test_backfill_recovers_lost_task(self):
+        """Tarefa perdida num reinício do worker: o comando gera as miniaturas que faltam."""
+        self.upload()
+        with override_settings(AVATAR_WORKERS=2):
+            with patch.object(thumbnails, 'pool'):
+                speaker = self.upload('outra')
+        call_command('avatar_thumbnails', workers=1, stdout=StringIO())
+        self.assertEqual(speaker.avatar.name, Speaker.objects.get(pk=speaker.pk).thumbnails['source'])
+
+    def test_backfill_command(self):
+        names = []
+        for i in range(5):
+            name = default_storage.save('palestrantes/p%d.jpg' % i, ContentFile('p%d' % i))
+            Speaker.objects.filter(pk=Speaker.objects.create(
+                name='P%d' % i, slug='p%d' % i, url='http://p.com').pk).update(avatar=name)
+            names.append(name)
+        out = StringIO()
+        call_command('avatar_thumbnails', workers=3, stdout=out)
+        self.assertIn('5 avatares processados, 0 falhas.', out.getvalue())
+        for speaker in Speaker.objects.filter(avatar__in=names):
+            self.assertEqual(speaker.avatar.name, speaker.thumbnails['source'])
+            self.assertEqual('jpeg-64-%s' % speaker.slug,
+                             default_storage.open(speaker.thumbnails['sizes']['small']['jpeg']).read())
+
+    def test_backfill_skips_done(self):
+        self.upload()
+        with patch.object(thumbnails, 'build') as build:
+            list(thumbnails.backfill(Speaker.objects.all(), workers=1))
+        self.assertFalse(build.called)
+
+    def test_command_without_pillow(self):
+        with patch.object(thumbnails, 'formats', lambda: []):
+            self.assertRaises(CommandError, avatar_thumbnails.Command().handle, workers=1, force=False)
+
+
+@unittest.skipIf(thumbnails.Image is None, u'Pillow não instalado')
+class AvatarRenderTest(TestCase):
+    def test_render(self):
+        out = StringIO()
+        thumbnails.Image.new('RGBA', (800, 600), (255, 0, 0, 128)).save(out, 'PNG')
+        content, size = thumbnails.render(out.getvalue(), 200, 'jpeg')
+        self.assertEqual((200, 150), size)
+        self.assertEqual('JPEG', thumbnails.Image.open(StringIO(content)).format)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        search.index.clear()
+        self.speaker = Speaker.objects.create(name=u'Henrique Bastos', slug='henrique-bastos',
+                                              url='http://henriquebastos.net',
+                                              description=u'Programador Python e Django.')
+        self.talk = Talk.objects.create(title=u'Introdução ao Django', start_time='10:00',
+                                        description=u'Descrição da palestra sobre aplicações web.')
+        self.other = Talk.objects.create(title=u'Testes automatizados', start_time='14:00',
+                                         description=u'Como testar projetos Django.')
+
+    def tearDown(self):
+        search.index.clear()
+
+    def keys(self, query):
+        return [(kind, obj.pk) for kind, obj in search.index.results(query)]
+
+    def test_fold(self):
+        self.assertEqual(u'descricao', search.fold(u'Descrição'))
+        self.assertEqual([u'introducao', u'django'], search.tokenize(u'Introdução ao Django!'))
+
+    def test_accents(self):
+        self.assertEqual([('talk', self.talk.pk)], self.keys(u'descricao'))
+        self.assertEqual([('talk', self.talk.pk)], self.keys(u'DESCRIÇÃO'))
+        self.assertEqual([('talk', self.talk.pk)], self.keys(u'aplicacoes'))
+
+    def test_title_ranks_higher(self):
+        keys = self.keys(u'django')
+        self.assertEqual(('talk', self.talk.pk), keys[0])
+        self.assertEqual(set([('talk', self.other.pk), ('speaker', self.speaker.pk)]), set(keys[1:]))
+
+    def test_all_terms_and_prefix(self):
+        self.assertEqual([('talk', self.other.pk)], self.keys(u'django test'))
+        self.assertEqual([('speaker', self.speaker.pk)], self.keys(u'progr'))
+        self.assertEqual([], self.keys(u'django inexistente'))
+        self.assertEqual([], self.keys(u'de ao'))
+
+    def test_incremental(self):
+        self.keys(u'django')
+        with patch.object(search.index, 'build') as build:
+            talk = Talk.objects.create(title=u'Cache distribuído', start_time='11:00', description=u'Redis.')
+            self.assertEqual([('talk', talk.pk)], self.keys(u'distribuido'))
+            talk.title = u'Filas'
+            talk.save()
+            self.assertEqual([], self.keys(u'distribuido'))
+            self.assertEqual([('talk', talk.pk)], self.keys(u'filas'))
+            talk.delete()
+            self.assertEqual([], self.keys(u'filas'))
+            course = Course.objects.create(title=u'Curso de Celery', start_time='15:00', description=u'Filas.',
+                                           slots=20, notes='')
+            self.assertEqual([('talk', course.pk)], self.keys(u'celery'))
+        self.assertFalse(build.called)
+
+    def test_rolled_back_save(self):
+        """Um save desfeito não deixa no índice os dados que não foram gravados."""
+        self.keys(u'django')
+        self.talk.title = u'Nunca gravado'
+        # O que o signal vê num save cuja transação é desfeita em seguida.
+        post_save.send(sender=Talk, instance=self.talk, created=False)
+        self.assertEqual([], self.keys(u'gravado'))
+        self.assertEqual([('talk', self.talk.pk)], self.keys(u'introducao'))
+
+    def test_changes_from_other_processes(self):
+        """Alterações sem signal (outro processo) chegam pelo modified_at."""
+        self.keys(u'django')
+        Talk.objects.filter(pk=self.other.pk).update(title=u'Deploy contínuo', modified_at=timezone.now())
+        self.assertEqual([], self.keys(u'continuo'))
+        with override_settings(SEARCH_SYNC_INTERVAL=0):
+            self.assertEqual([('talk', self.other.pk)], self.keys(u'continuo'))
+
+    def test_deleted_elsewhere(self):
+        self.keys(u'django')
+        connection.cursor().execute('DELETE FROM core_talk WHERE id = %s', [self.other.pk])
+        self.assertNotIn(('talk', self.other.pk), self.keys(u'django'))
+        self.assertEqual([], search.index.search(u'automatizados'))
+
+    def test_max_terms(self):
+        with override_settings(SEARCH_MAX_TERMS=3):
+            search.index.add(search.TALK, 999, {'title': u'alfa beta gama', 'description': u'delta epsilon'})
+        self.assertEqual(3, len(search.index.documents[search.doc_id(search.TALK, 999)][1]))
+        self.assertEqual([], search.index.search(u'delta'))
+
+    def test_warm_up(self):
+        with override_settings(SEARCH_WARMUP=True):
+            warmup.warm_up()
+        self.assertTrue(search.index.built)
+        self.assertEqual(3, len(search.index))
+
+    def test_view(self):
+        resp = self.client.get(reverse('core:search'), {'q': u'descricao'})
+        self.assertContains(resp, u'Introdução ao Django')
+        self.assertNotContains(resp, u'Testes automatizados')
+        with self.assertNumQueries(2):
+            self.client.get(reverse('core:search'), {'q': u'django'})
+
+    def test_admin_search(self):
+        """A busca das listas do admin usa o índice, sem LIKE nas colunas."""
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        with self.settings(DEBUG=True):
+            start = len(connection.queries)
+            resp = self.client.get(reverse('admin:core_talk_changelist'), {'q': u'descricao'})
+            sql = [q['sql'] for q in connection.queries[start:] if 'core_talk' in q['sql']]
+        self.assertEqual([self.talk], list(resp.context['cl'].result_list))
+        self.assertFalse([q for q in sql if 'LIKE' in q], sql)
+        resp = self.client.get(reverse('admin:core_speaker_changelist'), {'q': u'progr'})
+        self.assertEqual([self.speaker], list(resp.context['cl'].result_list))
+
+    def test_view_without_results(self):
+        self.assertContains(self.client.get(reverse('core:search'), {'q': u'xyz'}), u'Nenhum resultado')
@@ -0,0 +1,208 @@
+# coding: utf-8
+"""
+Miniaturas dos avatares dos palestrantes.
+
+Quando um avatar novo é gravado, o post_save de Speaker entrega o trabalho
+a um pool de AVATAR_WORKERS threads (o Pillow libera o GIL enquanto reduz e
+codifica a imagem); a requisição não espera. Cada tamanho de AVATAR_SIZES é
+gerado em cada formato de AVATAR_FORMATS e gravado ao lado do original,
+com o hash do conteúdo no nome (palestrantes/foto.medium.3f2a9c1b0d4e.webp),
+e os nomes ficam em Speaker.avatar_variants. Até lá, e sem o Pillow
+instalado, a tag {% avatar %} usa o arquivo original.
+
+As tarefas do pool ficam só na memória do processo: as que estiverem na
+fila quando o worker reiniciar se perdem. O comando `avatar_thumbnails`
+gera as miniaturas de todo palestrante cujo avatar_variants não é do
+avatar atual, então deve rodar periodicamente (cron) para recuperá-las; ele
+também gera as dos avatares anteriores a esta funcionalidade.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+from threading import Lock
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_connection
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+# Nome do formato no Pillow e extensão do arquivo.
+FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+    'png': ('PNG', 'png'),
+}
+
+
+def sizes():
+    """((rótulo, lado máximo em pixels), ...)"""
+    return getattr(settings, 'AVATAR_SIZES', (('small', 64), ('medium', 200), ('large', 400)))
+
+
+def formats():
+    """Formatos de AVATAR_FORMATS que o Pillow instalado sabe gravar."""
+    wanted = getattr(settings, 'AVATAR_FORMATS', ('webp', 'jpeg'))
+    if Image is None:
+        return []
+    Image.init()
+    return [f for f in wanted if FORMATS[f][0] in Image.SAVE]
+
+
+def available():
+    return bool(formats())
+
+
+def variant_name(name, label, format, content):
+    """Nome da miniatura: ao lado do original, com o hash do conteúdo."""
+    digest = hashlib.md5(content).hexdigest()[:12]
+    return '%s.%s.%s.%s' % (os.path.splitext(name)[0], label, digest, FORMATS[format][1])
+
+
+def render(data, size, format):
+    """Miniatura (bytes) da imagem em data, cabendo em size x size."""
+    image = Image.open(StringIO(data))
+    image.load()
+    if format == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA')
+    image.thumbnail((size, size), getattr(Image, 'LANCZOS', Image.ANTIALIAS))
+    out = StringIO()
+    image.save(out, FORMATS[format][0], quality=getattr(settings, 'AVATAR_QUALITY', 80), optimize=True)
+    return out.getvalue(), image.size
+
+
+def build(name, storage):
+    """
+    Gera e grava as miniaturas do arquivo `name`; não toca no banco.
+    Devolve {'source': name, 'sizes': {rótulo: {formato: nome, 'width':, 'height':}}}.
+    """
+    with storage.open(name, 'rb') as f:
+        data = f.read()
+    variants = {}
+    for label, size in sizes():
+        for format in formats():
+            content, (width, height) = render(data, size, format)
+            target = variant_name(name, label, format, content)
+            if not storage.exists(target):
+                target = storage.save(target, ContentFile(content))
+            variant = variants.setdefault(label, {'width': width, 'height': height})
+            variant[format] = target
+    return {'source': name, 'sizes': variants}
+
+
+def store(pk, name, variants):
+    """Grava as miniaturas no palestrante, se o avatar ainda for `name`."""
+    from .models import Speaker
+    from .pagecache import page_cache
+    updated = Speaker.objects.filter(pk=pk, avatar=name).update(avatar_variants=json.dumps(variants))
+    if updated:
+        slugs = Speaker.objects.filter(pk=pk).values_list('slug', flat=True)
+        page_cache.invalidate(*['speaker:%s' % slug for slug in slugs])
+    return updated
+
+
+def process(pk, name, storage, retries=None):
+    """
+    build + store. Chamado logo depois do post_save, o palestrante pode
+    ainda não estar visível fora da transação do admin: tenta de novo.
+    """
+    if retries is None:
+        retries = getattr(settings, 'AVATAR_STORE_RETRIES', 5)
+    try:
+        variants = build(name, storage)
+        for attempt in range(retries + 1):
+            if store(pk, name, variants):
+                return variants
+            time.sleep(0.1 * 2 ** attempt)
+        # Palestrante apagado, avatar trocado ou transação ainda aberta; no
+        # último caso o `avatar_thumbnails` periódico grava as miniaturas.
+        logger.warning(u'Miniaturas de %s não gravadas: o palestrante %s não tem mais esse avatar',
+                       name, pk)
+    except Exception:
+        logger.exception(u'Falha ao gerar as miniaturas de %s', name)
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(getattr(settings, 'AVATAR_WORKERS', 2))
+        return _pool
+
+
+def run_in_worker(pk, name, storage):
+    try:
+        return process(pk, name, storage)
+    finally:
+        # Cada thread do pool tem a própria conexão com o banco.
+        close_connection()
+
+
+def schedule(speaker):
+    """Agenda as miniaturas do avatar atual do palestrante."""
+    if not speaker.avatar or not available():
+        return None
+    args = (speaker.pk, speaker.avatar.name, speaker.avatar.storage)
+    if not getattr(settings, 'AVATAR_WORKERS', 2):
+        return process(*args)
+    return pool().apply_async(run_in_worker, args)
+
+
+def backfill(speakers, workers=4, force=False):
+    """
+    Gera em paralelo as miniaturas dos palestrantes que ainda não as têm
+    (ou de todos, com force). As imagens são feitas nas threads; o banco só
+    é atualizado nesta. Devolve um iterador de (palestrante, variantes ou None).
+    """
+    pending = [s for s in speakers if s.avatar and (force or s.thumbnails.get('source') != s.avatar.name)]
+
+    def task(speaker):
+        try:
+            return speaker, build(speaker.avatar.name, speaker.avatar.storage)
+        except Exception:
+            logger.exception(u'Falha ao gerar as miniaturas de %s', speaker.avatar.name)
+            return speaker, None
+
+    workers = ThreadPool(workers) if workers > 1 else None
+    results = workers.imap_unordered(task, pending) if workers else (task(s) for s in pending)
+    try:
+        for speaker, variants in results:
+            if variants is not None:
+                store(speaker.pk, speaker.avatar.name, variants)
+            yield speaker, variants
+    finally:
+        if workers:
+            workers.terminate()
+
+
+def choose(speaker, size, format=None):
+    """
+    (url, largura, altura) da miniatura do tamanho pedido, no primeiro
+    formato disponível (ou no formato pedido); o original, se não houver.
+    """
+    thumbnails = speaker.thumbnails
+    variant = None
+    if speaker.avatar and thumbnails.get('source') == speaker.avatar.name:
+        variant = thumbnails.get('sizes', {}).get(size)
+    if variant:
+        for name in ([format] if format else getattr(settings, 'AVATAR_FORMATS', ('webp', 'jpeg'))):
+            if name in variant:
+                return speaker.avatar.storage.url(variant[name]), variant['width'], variant['height']
+    if speaker.avatar:
+        return speaker.avatar.url, None, None
+    return None, None, None
@@ -10,6 +10,8 @@ urlpatterns = patterns('src.core.views',
     url(r'^palestras/$', 'talks', name='talks'),
     #url(r'^palestras/$', TalksView.as_view(), name='talks'),
     url(r'^palestras/(?P<pk>\d+)/$', TalkDetail.as_view(), name='talk_detail'),
+    url(r'^palestras\.json$', 'schedule_json', name='schedule_json'),
+    url(r'^busca/$', 'search', name='search'),
 )
 
 
@@ -1,9 +1,15 @@
 # coding: utf-8
+from django.http import HttpResponse
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition, require_safe
 from django.views.generic import TemplateView, DetailView
 from django.views.generic.simple import direct_to_template
+from .api import schedule_document
 from .models import Speaker, Talk
+from .pagecache import cached_page
+from .search import SPEAKER, TALK, index
 
 
 class Homepage(TemplateView):
@@ -17,6 +23,11 @@ def homepage(request):
 
 class SpeakerDetail(DetailView):
     model = Speaker
+    queryset = Speaker.objects.with_contacts()
+
+    @method_decorator(cached_page('speaker:%(slug)s'))
+    def dispatch(self, *args, **kwargs):
+        return super(SpeakerDetail, self).dispatch(*args, **kwargs)
 
 '''
 def speaker_detail(request, slug):
@@ -37,15 +48,22 @@ class TalksView(TemplateView):
         return context
 '''
 
+@cached_page('schedule')
 def talks(request):
+    morning_talks, afternoon_talks = Talk.objects.schedule()
     context = {
-        'morning_talks': Talk.objects.at_morning(),
-        'afternoon_talks': Talk.objects.at_afternoon(),
+        'morning_talks': morning_talks,
+        'afternoon_talks': afternoon_talks,
     }
     return direct_to_template(request, 'core/talks.html', context)
 
 class TalkDetail(DetailView):
     model = Talk
+    queryset = Talk.objects.prefetch_related('speakers', 'media_set')
+
+    @method_decorator(cached_page('talk:%(pk)s'))
+    def dispatch(self, *args, **kwargs):
+        return super(TalkDetail, self).dispatch(*args, **kwargs)
 
 '''
 def talk_detail(request, pk):
@@ -57,3 +75,33 @@ def talk_detail(request, pk):
     }
     return direct_to_template(request, 'core/talk_detail.html', context)
 '''
+
+
+def _schedule_document(request):
+    # Guardado na requisição para que ETag, Last-Modified e corpo venham do
+    # mesmo documento, com uma única leitura do cache.
+    if not hasattr(request, '_schedule_document'):
+        request._schedule_document = schedule_document()
+    return request._schedule_document
+
+
+@require_safe
+@condition(etag_func=lambda request: _schedule_document(request).etag,
+           last_modified_func=lambda request: _schedule_document(request).last_modified)
+def schedule_json(request):
+    response = HttpResponse(_schedule_document(request).body, content_type='application/json')
+    # Os clientes podem guardar a resposta, mas devem revalidá-la a cada uso.
+    response['Cache-Control'] = 'public, no-cache'
+    return response
+
+
+@require_safe
+def search(request):
+    query = request.GET.get('q', '').strip()[:200]
+    results = index.results(query) if query else []
+    context = {
+        'query': query,
+        'talks': [obj for kind, obj in results if kind == TALK],
+        'speakers': [obj for kind, obj in results if kind == SPEAKER],
+    }
+    return direct_to_template(request, 'core/search.html', context)
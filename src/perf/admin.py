@@ -0,0 +1,64 @@
+# coding: utf-8
+from django.conf.urls import patterns, url
+from django.contrib import admin
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.generic.simple import direct_to_template
+from . import profiling
+from .models import Profile
+
+
+class ProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'path', 'view', 'user', 'duration', 'sql_count', 'sql_time',
+                    'template_time', 'links')
+    list_filter = ['view']
+    search_fields = ('path', 'view')
+    date_hierarchy = 'created_at'
+    readonly_fields = ('path', 'view', 'user', 'duration', 'sql_count', 'sql_time',
+                       'template_time', 'data')
+    exclude = ('breakdown',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def links(self, obj):
+        return u'<a href="%s">relatório</a> | <a href="%s">baixar</a>' % (
+            reverse('admin:perf_profile_report', args=[obj.pk]),
+            reverse('admin:perf_profile_download', args=[obj.pk]))
+
+    links.short_description = u'Perfil'
+    links.allow_tags = True
+
+    def get_urls(self):
+        return patterns('',
+            url(r'^(\d+)/relatorio/$', self.admin_site.admin_view(self.report),
+                name='perf_profile_report'),
+            url(r'^(\d+)/baixar/$', self.admin_site.admin_view(self.download),
+                name='perf_profile_download'),
+        ) + super(ProfileAdmin, self).get_urls()
+
+    def report(self, request, pk):
+        profile = get_object_or_404(Profile, pk=pk)
+        sort = profiling.sort_key(request.GET.get('sort'))
+        return direct_to_template(request, 'perf/profile_report.html', {
+            'title': unicode(profile),
+            'profile': profile,
+            'report': profiling.report(profile, sort),
+            'sort': sort,
+            'sorts': profiling.SORTS,
+        })
+
+    def download(self, request, pk):
+        # Arquivo no formato do pstats: pstats.Stats('perfil-N.prof'), snakeviz etc.
+        profile = get_object_or_404(Profile, pk=pk)
+        profile.data.open('rb')
+        try:
+            response = HttpResponse(profile.data.read(), content_type='application/octet-stream')
+        finally:
+            profile.data.close()
+        response['Content-Disposition'] = 'attachment; filename=perfil-%d.prof' % profile.pk
+        return response
+
+
+admin.site.register(Profile, ProfileAdmin)
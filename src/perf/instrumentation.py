@@ -0,0 +1,146 @@
+# coding: utf-8
+"""
+Contadores de SQL e de renderização de templates da requisição corrente.
+
+Os contadores ficam num thread-local e só são atualizados entre start() e
+stop(); fora de uma requisição medida o custo é um teste de atributo.
+Consultas lentas são registradas sempre, também nos comandos de manage.py.
+"""
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db.backends import BaseDatabaseWrapper
+from django.template.base import Template
+from . import sqllog
+
+
+state = threading.local()
+
+
+def start(context=None):
+    state.active = True
+    state.context = context
+    state.sql_count = 0
+    state.sql_time = 0.0
+    state.template_time = 0.0
+    state.template_depth = 0
+    state.sql_seen = {}
+    state.repeated = 0
+    state.capture = None
+
+
+def stop():
+    """(consultas, ms em SQL, ms em templates, consultas repetidas) da requisição."""
+    state.active = False
+    state.context = None
+    return state.sql_count, state.sql_time * 1000, state.template_time * 1000, state.repeated
+
+
+def capture():
+    """
+    Passa a guardar, até o fim da requisição, o tempo de cada SQL e de cada
+    template (inclusive os incluídos). Usado pelo profiling sob demanda.
+    """
+    state.capture = {'sql': {}, 'templates': {}}
+    return state.capture
+
+
+def _captured(kind, key, elapsed):
+    entry = state.capture[kind].setdefault(key, [0, 0.0])
+    entry[0] += 1
+    entry[1] += elapsed * 1000
+
+
+def set_context(context):
+    """A view ou o comando que está executando, para o log das consultas."""
+    state.context = context
+
+
+def active():
+    return getattr(state, 'active', False)
+
+
+class TimedCursor(object):
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def _timed(self, method, sql, params):
+        began = time.time()
+        try:
+            return method(sql, params)
+        finally:
+            elapsed = time.time() - began
+            context = getattr(state, 'context', None)
+            if elapsed * 1000 >= sqllog.slow_query_ms():
+                sqllog.log_slow(sql, params, elapsed * 1000, context)
+            if active():
+                state.sql_count += 1
+                state.sql_time += elapsed
+                if state.capture is not None:
+                    _captured('sql', sql, elapsed)
+                # Mesmo SQL com parâmetros diferentes, várias vezes: N+1.
+                seen = state.sql_seen[sql] = state.sql_seen.get(sql, 0) + 1
+                if seen == sqllog.repeated_query_threshold():
+                    state.repeated += 1
+                    sqllog.log_repeated(sql, params, seen, context)
+
+    def execute(self, sql, params=()):
+        return self._timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(self.cursor.executemany, sql, param_list)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def timed_render(render):
+    def _render(self, context):
+        if not active():
+            return render(self, context)
+        # Templates incluídos ou herdados rodam dentro do externo: só ele conta.
+        state.template_depth += 1
+        began = time.time()
+        try:
+            return render(self, context)
+        finally:
+            elapsed = time.time() - began
+            state.template_depth -= 1
+            if not state.template_depth:
+                state.template_time += elapsed
+            if state.capture is not None:
+                _captured('templates', self.name or u'<string>', elapsed)
+    _render.perf_original = render
+    return _render
+
+
+def timed_cursor(cursor):
+    def wrapper(self):
+        return TimedCursor(cursor(self))
+    wrapper.perf_original = cursor
+    return wrapper
+
+
+def command_context(execute):
+    def wrapper(self, *args, **options):
+        previous = getattr(state, 'context', None)
+        set_context('manage.py %s' % type(self).__module__.rsplit('.', 1)[-1])
+        try:
+            return execute(self, *args, **options)
+        finally:
+            set_context(previous)
+    wrapper.perf_original = execute
+    return wrapper
+
+
+def install():
+    """Instala os medidores (uma vez por processo)."""
+    if not hasattr(BaseCommand.execute, 'perf_original'):
+        BaseCommand.execute = command_context(BaseCommand.execute)
+    if not hasattr(BaseDatabaseWrapper.cursor, 'perf_original'):
+        BaseDatabaseWrapper.cursor = timed_cursor(BaseDatabaseWrapper.cursor)
+    if not hasattr(Template._render, 'perf_original'):
+        Template._render = timed_render(Template._render)
@@ -0,0 +1,92 @@
+# coding: utf-8
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.urlresolvers import Resolver404, resolve
+from django.http import HttpResponse
+from . import instrumentation, profiling
+from .stats import store
+
+
+def view_name(request, view_func):
+    """Nome da URL (com namespace) ou, sem nome, o caminho da view."""
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        match = None
+    if match is not None and match.url_name:
+        return ':'.join(match.namespaces + [match.url_name])
+    return '%s.%s' % (view_func.__module__, getattr(view_func, '__name__', view_func.__class__.__name__))
+
+
+class PerfMiddleware(object):
+    """
+    Mede tempo total, consultas SQL (quantidade e tempo) e renderização de
+    templates de cada view. Deve ser a primeira da lista, para medir também
+    as demais middlewares.
+    """
+    def __init__(self):
+        if not getattr(settings, 'PERF_ENABLED', True):
+            raise MiddlewareNotUsed
+        instrumentation.install()
+
+    def process_request(self, request):
+        request._perf_started = time.time()
+        instrumentation.start()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._perf_view = view_name(request, view_func)
+        instrumentation.set_context(request._perf_view)
+
+    def process_response(self, request, response):
+        started = getattr(request, '_perf_started', None)
+        if started is None or not instrumentation.active():
+            return response
+        sql_count, sql_time, template_time, repeated = instrumentation.stop()
+        name = getattr(request, '_perf_view', None)
+        if name is not None:
+            # Respostas sem view (404 na resolução, redirects do CommonMiddleware)
+            # não entram no relatório.
+            store.record(name, (time.time() - started) * 1000, sql_count, sql_time, template_time,
+                         repeated)
+        return response
+
+
+class ProfileMiddleware(object):
+    """
+    Executa a view sob o profiler quando um usuário staff pede (veja
+    profiling.py). Deve vir por último, depois da AuthenticationMiddleware
+    e das demais process_view.
+    """
+    def __init__(self):
+        if not getattr(settings, 'PERF_ENABLED', True):
+            raise MiddlewareNotUsed
+        instrumentation.install()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        mode = profiling.requested(request)
+        if mode is None:
+            return None
+
+        name = getattr(request, '_perf_view', None) or view_name(request, view_func)
+        started_here = not instrumentation.active()
+        if started_here:
+            instrumentation.start(name)
+        before = (instrumentation.state.sql_count, instrumentation.state.sql_time,
+                  instrumentation.state.template_time)
+        captured = instrumentation.capture()
+
+        response, profiler, duration = profiling.run(view_func, request, view_args, view_kwargs)
+        counters = (instrumentation.state.sql_count - before[0],
+                    (instrumentation.state.sql_time - before[1]) * 1000,
+                    (instrumentation.state.template_time - before[2]) * 1000)
+        instrumentation.state.capture = None
+        if started_here:
+            instrumentation.stop()
+
+        profile = profiling.save(request, name, profiler, duration, counters, captured)
+        if mode == 'text':
+            sort = request.GET.get(profiling.SORT_PARAM)
+            return HttpResponse(profiling.report(profile, sort), content_type='text/plain; charset=utf-8')
+        response['X-Profile-Id'] = str(profile.pk)
+        return response
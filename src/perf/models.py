@@ -0,0 +1,54 @@
+# coding: utf-8
+# Os agregados ficam no cache (veja stats.py); só os perfis sob demanda
+# são gravados no banco. O models.py é carregado na inicialização, também
+# nos comandos de manage.py, então é daqui que os medidores são instalados.
+import json
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models
+from . import instrumentation
+
+
+class ProfileManager(models.Manager):
+    def prune(self, keep):
+        """Apaga os perfis (e seus arquivos) além dos `keep` mais recentes."""
+        old = self.order_by('-created_at', '-pk')[keep:]
+        for profile in old:
+            profile.delete()
+
+
+class Profile(models.Model):
+    """Uma requisição executada sob o cProfile a pedido de um usuário staff."""
+    path = models.CharField('Caminho', max_length=255)
+    view = models.CharField('View', max_length=255)
+    user = models.ForeignKey(User, verbose_name=u'Usuário', null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField('Criado em', auto_now_add=True)
+    duration = models.FloatField(u'Duração (ms)')
+    sql_count = models.PositiveIntegerField('Consultas')
+    sql_time = models.FloatField('SQL (ms)')
+    template_time = models.FloatField('Templates (ms)')
+    breakdown = models.TextField(default='{}')
+    data = models.FileField('Perfil', upload_to='perfis')
+
+    objects = ProfileManager()
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.path, self.created_at)
+
+    def get_breakdown(self):
+        return json.loads(self.breakdown)
+
+    def delete(self, *args, **kwargs):
+        storage, name = self.data.storage, self.data.name
+        super(Profile, self).delete(*args, **kwargs)
+        if name:
+            storage.delete(name)
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = u"Perfil de requisição"
+        verbose_name_plural = u"Perfis de requisição"
+
+
+if getattr(settings, 'PERF_ENABLED', True):
+    instrumentation.install()
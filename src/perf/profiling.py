@@ -0,0 +1,111 @@
+# coding: utf-8
+"""
+Profiling de uma requisição sob demanda, para usuários staff.
+
+Acrescente `?_profile=1` à URL (ou envie o cabeçalho `X-Profile: 1`) para
+executar a view sob o cProfile e guardar o perfil, que fica listado no
+admin. Com `_profile=text` a resposta é o próprio relatório em vez da
+página; `_profile_sort` escolhe a ordenação.
+"""
+import cProfile
+import json
+import marshal
+import pstats
+import time
+from StringIO import StringIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from .models import Profile
+
+
+PARAM = '_profile'
+SORT_PARAM = '_profile_sort'
+HEADER = 'HTTP_X_PROFILE'
+
+SORTS = ('cumulative', 'time', 'calls')
+LIMIT = 60
+TOP = 20
+
+
+def requested(request):
+    """O modo pedido ('1' ou 'text'), ou None; só para usuários staff."""
+    mode = request.GET.get(PARAM) or request.META.get(HEADER)
+    user = getattr(request, 'user', None)
+    if not mode or user is None or not user.is_staff:
+        return None
+    return mode
+
+
+def sort_key(value):
+    return value if value in SORTS else SORTS[0]
+
+
+def run(view_func, request, args, kwargs):
+    """Executa a view sob o profiler, inclusive a renderização e o streaming."""
+    def call():
+        response = view_func(request, *args, **kwargs)
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        # Consome respostas geradas aos poucos, como a exportação CSV.
+        response.content = response.content
+        return response
+
+    profiler = cProfile.Profile()
+    began = time.time()
+    response = profiler.runcall(call)
+    return response, profiler, (time.time() - began) * 1000
+
+
+def top(captured, limit=TOP):
+    """[{'key', 'count', 'ms'}] dos itens que mais tomaram tempo."""
+    rows = [{'key': key, 'count': count, 'ms': ms} for key, (count, ms) in captured.items()]
+    return sorted(rows, key=lambda row: row['ms'], reverse=True)[:limit]
+
+
+def save(request, view, profiler, duration, counters, captured):
+    profiler.create_stats()
+    sql_count, sql_time, template_time = counters
+    profile = Profile(path=request.get_full_path()[:255], view=view[:255], user=request.user,
+                      duration=duration, sql_count=sql_count, sql_time=sql_time,
+                      template_time=template_time,
+                      breakdown=json.dumps({'sql': top(captured['sql']),
+                                            'templates': top(captured['templates'])}))
+    profile.data.save('perfil.prof', ContentFile(marshal.dumps(profiler.stats)), save=False)
+    profile.save()
+    Profile.objects.prune(getattr(settings, 'PERF_PROFILE_KEEP', 50))
+    return profile
+
+
+class StoredStats(object):
+    """O que o pstats.Stats espera de um profiler, a partir dos dados gravados."""
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def load_stats(profile, stream=None):
+    profile.data.open('rb')
+    try:
+        data = marshal.loads(profile.data.read())
+    finally:
+        profile.data.close()
+    return pstats.Stats(StoredStats(data), stream=stream)
+
+
+def report(profile, sort=None, limit=LIMIT):
+    """Relatório em texto: tempos de SQL e templates e as funções mais caras."""
+    out = StringIO()
+    out.write(u'%s\nTotal: %.1f ms | SQL: %d consultas, %.1f ms | Templates: %.1f ms\n\n' % (
+        profile.path, profile.duration, profile.sql_count, profile.sql_time, profile.template_time))
+    breakdown = profile.get_breakdown()
+    for title, rows in ((u'SQL', breakdown.get('sql', [])), (u'Templates', breakdown.get('templates', []))):
+        out.write(u'%s (mais lentos)\n' % title)
+        for row in rows:
+            out.write(u'%9.1f ms %5dx  %s\n' % (row['ms'], row['count'], row['key']))
+        out.write(u'\n')
+
+    stats = load_stats(profile, out)
+    stats.sort_stats(sort_key(sort)).print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,93 @@
+# coding: utf-8
+"""
+Registro de consultas lentas e de consultas repetidas (N+1), com o ponto
+do nosso código que as originou: as últimas chamadas dentro do projeto e,
+se a consulta saiu de um template, o template e a tag que a dispararam
+(esta última só com TEMPLATE_DEBUG, que guarda a origem de cada nó).
+"""
+import logging
+import os
+import sys
+from django.conf import settings
+from django.template.base import Node, Template
+
+
+logger = logging.getLogger('src.perf.sql')
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PERF_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def slow_query_ms():
+    return getattr(settings, 'PERF_SLOW_QUERY_MS', 100)
+
+
+def repeated_query_threshold():
+    return getattr(settings, 'PERF_REPEATED_QUERY_THRESHOLD', 5)
+
+
+def stack_depth():
+    return getattr(settings, 'PERF_STACK_DEPTH', 6)
+
+
+def node_source(node):
+    """'arquivo.html:linha {% tag %}' do nó, a partir da origem gravada pelo TEMPLATE_DEBUG."""
+    origin, (start, end) = node.source
+    try:
+        source = origin.reload()
+    except Exception:
+        return u'%s %s' % (origin.name, type(node).__name__)
+    line = source.count('\n', 0, start) + 1
+    return u'%s:%d %s' % (os.path.basename(origin.name), line, source[start:end])
+
+
+def call_site(frame=None):
+    """
+    (linhas do stack, template) da chamada corrente. O stack só tem os
+    frames do projeto, do mais externo para o mais interno.
+    """
+    frame = frame or sys._getframe(1)
+    lines, template = [], None
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.abspath(code.co_filename)
+        owner = frame.f_locals.get('self')
+        if template is None:
+            if isinstance(owner, Node) and getattr(owner, 'source', None):
+                template = node_source(owner)
+            elif isinstance(owner, Template) and owner.name:
+                template = owner.name
+        if filename.startswith(PROJECT_DIR) and not filename.startswith(PERF_DIR):
+            name = code.co_name
+            if owner is not None and not isinstance(owner, (Node, Template)):
+                name = '%s.%s' % (type(owner).__name__, name)
+            lines.append(u'%s:%d %s' % (os.path.relpath(filename, PROJECT_DIR), frame.f_lineno, name))
+            if len(lines) >= stack_depth():
+                break
+        frame = frame.f_back
+    lines.reverse()
+    return lines, template
+
+
+def describe(context, lines, template):
+    parts = [u'origem: %s' % (context or u'desconhecida')]
+    if template:
+        parts.append(u'template: %s' % template)
+    parts.extend(u'  %s' % line for line in lines)
+    return u'\n'.join(parts)
+
+
+def log_slow(sql, params, duration, context):
+    lines, template = call_site()
+    logger.warning(u'Consulta lenta (%.1f ms): %s; params=%r\n%s',
+                   duration, sql, params, describe(context, lines, template),
+                   extra={'sql': sql, 'params': params, 'duration': duration,
+                          'context': context, 'stack': lines, 'template': template})
+
+
+def log_repeated(sql, params, count, context):
+    lines, template = call_site()
+    logger.warning(u'Consulta repetida %d vezes na mesma requisição (possível N+1): %s; '
+                   u'params=%r\n%s', count, sql, params, describe(context, lines, template),
+                   extra={'sql': sql, 'params': params, 'count': count,
+                          'context': context, 'stack': lines, 'template': template})
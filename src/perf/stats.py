@@ -0,0 +1,173 @@
+# coding: utf-8
+"""
+Agregados de desempenho por view, guardados no cache.
+
+Cada processo acumula as medições em memória e as soma no cache a cada
+PERF_FLUSH_INTERVAL segundos, então o custo por requisição é só o de
+atualizar alguns contadores. As medições são separadas em janelas de
+PERF_WINDOW segundos e o relatório soma as últimas PERF_WINDOWS janelas.
+
+Os tempos ficam num histograma de faixas fixas, que pode ser somado entre
+processos; os percentis são o limite da faixa em que caem. A soma no cache
+não é atômica: flushes simultâneos de processos diferentes podem perder
+medições, o que é aceitável para um relatório estatístico.
+"""
+import threading
+import time
+from hashlib import md5
+from django.conf import settings
+from django.core.cache import get_cache
+
+
+# Limite superior (ms) de cada faixa do histograma; a última é aberta.
+BUCKETS = (1, 2, 3, 5, 7, 10, 15, 20, 30, 50, 75, 100, 150, 200, 300, 500,
+           750, 1000, 1500, 2000, 3000, 5000, 10000)
+
+FIELDS = ('count', 'wall', 'sql_count', 'sql_time', 'template', 'nplusone')
+
+
+def empty():
+    stats = dict((field, 0) for field in FIELDS)
+    stats['max_queries'] = 0
+    stats['buckets'] = [0] * (len(BUCKETS) + 1)
+    return stats
+
+
+def bucket(ms):
+    for i, limit in enumerate(BUCKETS):
+        if ms <= limit:
+            return i
+    return len(BUCKETS)
+
+
+def add(stats, wall, sql_count, sql_time, template, repeated=0):
+    stats['count'] += 1
+    stats['nplusone'] += bool(repeated)
+    stats['wall'] += wall
+    stats['sql_count'] += sql_count
+    stats['sql_time'] += sql_time
+    stats['template'] += template
+    stats['max_queries'] = max(stats['max_queries'], sql_count)
+    stats['buckets'][bucket(wall)] += 1
+
+
+def merge(into, stats):
+    for field in FIELDS:
+        into[field] += stats.get(field, 0)
+    into['max_queries'] = max(into['max_queries'], stats['max_queries'])
+    into['buckets'] = [a + b for a, b in zip(into['buckets'], stats['buckets'])]
+    return into
+
+
+def percentile(buckets, p):
+    """Limite superior (ms) da faixa que contém o percentil p; None acima da última."""
+    total = sum(buckets)
+    if not total:
+        return 0
+    seen = 0
+    for i, n in enumerate(buckets):
+        seen += n
+        if seen * 100.0 >= p * total:
+            return BUCKETS[i] if i < len(BUCKETS) else None
+    return None
+
+
+def summary(name, stats):
+    count = stats['count'] or 1
+    return {
+        'view': name,
+        'count': stats['count'],
+        'mean_ms': stats['wall'] / count,
+        'p50_ms': percentile(stats['buckets'], 50),
+        'p95_ms': percentile(stats['buckets'], 95),
+        'p99_ms': percentile(stats['buckets'], 99),
+        'queries': float(stats['sql_count']) / count,
+        'max_queries': stats['max_queries'],
+        'sql_ms': stats['sql_time'] / count,
+        'template_ms': stats['template'] / count,
+        'nplusone': stats['nplusone'],
+    }
+
+
+class Store(object):
+    def __init__(self, cache=None, prefix='perf'):
+        self._cache = cache
+        self.prefix = prefix
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.next_flush = 0
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = get_cache(getattr(settings, 'PERF_CACHE_ALIAS', 'default'))
+        return self._cache
+
+    @property
+    def window(self):
+        return getattr(settings, 'PERF_WINDOW', 60 * 60)
+
+    @property
+    def windows(self):
+        return getattr(settings, 'PERF_WINDOWS', 24)
+
+    def _index_key(self, window):
+        return '%s:%d:views' % (self.prefix, window)
+
+    def _stats_key(self, window, name):
+        return '%s:%d:%s' % (self.prefix, window, md5(name.encode('utf-8')).hexdigest())
+
+    def record(self, name, wall, sql_count, sql_time, template, repeated=0, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if name not in self.pending:
+                self.pending[name] = empty()
+            add(self.pending[name], wall, sql_count, sql_time, template, repeated)
+            if now < self.next_flush:
+                return
+            self.next_flush = now + getattr(settings, 'PERF_FLUSH_INTERVAL', 10)
+            pending, self.pending = self.pending, {}
+        self.flush(pending, now)
+
+    def flush(self, pending=None, now=None):
+        """Soma as medições acumuladas neste processo às do cache."""
+        if pending is None:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        if now is None:
+            now = time.time()
+        window = int(now) // self.window
+        index_key = self._index_key(window)
+        keys = dict((name, self._stats_key(window, name)) for name in pending)
+        found = self.cache.get_many(keys.values() + [index_key])
+        timeout = self.window * (self.windows + 1)
+
+        updated = {index_key: found.get(index_key, set()) | set(pending)}
+        for name, stats in pending.items():
+            updated[keys[name]] = merge(found.get(keys[name]) or empty(), stats)
+        self.cache.set_many(updated, timeout)
+
+    def collect(self, now=None):
+        """{view: agregados} somando as últimas janelas."""
+        if now is None:
+            now = time.time()
+        current = int(now) // self.window
+        windows = range(current - self.windows + 1, current + 1)
+        indexes = self.cache.get_many([self._index_key(w) for w in windows])
+        keys = {}
+        for window in windows:
+            for name in indexes.get(self._index_key(window), ()):
+                keys[self._stats_key(window, name)] = name
+        totals = {}
+        for key, stats in self.cache.get_many(keys.keys()).items():
+            merge(totals.setdefault(keys[key], empty()), stats)
+        return totals
+
+    def report(self, now=None):
+        return [summary(name, stats) for name, stats in self.collect(now).items()]
+
+
+store = Store()
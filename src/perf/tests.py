@@ -0,0 +1,233 @@
+# coding: utf-8
+import logging
+import shutil
+import tempfile
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.cache import get_cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.storage import default_storage
+from django.core.urlresolvers import reverse
+from django.template import Context, Template
+from django.test import TestCase
+from django.test.utils import override_settings
+from ..core.models import Speaker, Talk
+from . import instrumentation, sqllog
+from .middleware import PerfMiddleware, ProfileMiddleware
+from .models import Profile
+from .stats import Store, percentile, store
+
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        instrumentation.install()
+
+    def test_counts_sql(self):
+        instrumentation.start()
+        list(Talk.objects.all())
+        list(Talk.objects.all())
+        sql_count, sql_time, template_time, repeated = instrumentation.stop()
+        self.assertEqual(2, sql_count)
+
+    def test_ignores_outside_requests(self):
+        instrumentation.start()
+        instrumentation.stop()
+        list(Talk.objects.all())
+        self.assertEqual(0, instrumentation.state.sql_count)
+
+    def test_nested_templates_counted_once(self):
+        outer = Template('{% for i in items %}{% include "perf/report_table.html" %}{% endfor %}')
+        instrumentation.start()
+        outer.render(Context({'items': range(20), 'rows': []}))
+        self.assertEqual(0, instrumentation.state.template_depth)
+        self.assertTrue(instrumentation.stop()[2] > 0)
+
+
+class StoreTest(TestCase):
+    def setUp(self):
+        self.store = Store(cache=get_cache('django.core.cache.backends.locmem.LocMemCache',
+                                           LOCATION='perf-tests'), prefix='test-perf')
+        self.store.cache.clear()
+
+    def test_percentile(self):
+        buckets = [0] * 24
+        buckets[0], buckets[5], buckets[23] = 90, 9, 1
+        self.assertEqual(1, percentile(buckets, 50))
+        self.assertEqual(10, percentile(buckets, 95))
+        self.assertEqual(10, percentile(buckets, 99))
+        self.assertEqual(None, percentile(buckets, 100))
+
+    def test_buffers_until_flush(self):
+        """As medições só vão ao cache a cada PERF_FLUSH_INTERVAL."""
+        self.store.record('a', 5, 2, 1.0, 1.0, now=1000)
+        self.store.record('a', 50, 4, 1.0, 1.0, now=1001)
+        self.assertEqual(1, self.store.collect(now=1001)['a']['count'])
+        self.store.flush(now=1001)
+        stats = self.store.collect(now=1001)['a']
+        self.assertEqual((2, 6, 4), (stats['count'], stats['sql_count'], stats['max_queries']))
+
+    def test_merges_processes(self):
+        """Medições de processos diferentes são somadas."""
+        other = Store(cache=self.store.cache, prefix='test-perf')
+        self.store.record('a', 5, 1, 0, 0, now=1000)
+        other.record('a', 5, 1, 0, 0, now=1000)
+        self.assertEqual(2, self.store.collect(now=1000)['a']['count'])
+
+    @override_settings(PERF_WINDOW=60, PERF_WINDOWS=2)
+    def test_rolling_windows(self):
+        self.store.record('a', 5, 1, 0, 0, now=0)
+        self.store.record('a', 5, 1, 0, 0, now=60)
+        self.assertEqual(2, self.store.collect(now=60)['a']['count'])
+        self.assertEqual(1, self.store.collect(now=120)['a']['count'])
+        self.assertEqual({}, self.store.collect(now=180))
+
+
+class MiddlewareTest(TestCase):
+    def setUp(self):
+        store.cache.clear()
+        store.pending = {}
+
+    def test_records_by_url_name(self):
+        self.client.get(reverse('core:talks'))
+        store.flush()
+        stats = store.collect()['core:talks']
+        self.assertEqual(1, stats['count'])
+        self.assertTrue(stats['sql_count'] >= 1)
+
+    def test_unresolved_not_recorded(self):
+        self.client.get('/nao-existe/')
+        store.flush()
+        self.assertEqual({}, store.collect())
+
+    @override_settings(PERF_ENABLED=False)
+    def test_disabled(self):
+        for middleware in (PerfMiddleware, ProfileMiddleware):
+            self.assertRaises(MiddlewareNotUsed, middleware)
+
+
+class ReportViewTest(TestCase):
+    def test_staff_only(self):
+        resp = self.client.get(reverse('perf:report'))
+        self.assertEqual(200, resp.status_code)
+        self.assertTemplateUsed(resp, 'admin/login.html')
+
+    def test_report(self):
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.client.get(reverse('core:talks'))
+        resp = self.client.get(reverse('perf:report'))
+        self.assertContains(resp, 'core:talks', count=2)
+
+
+class CapturingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class SqlLogTest(TestCase):
+    def setUp(self):
+        instrumentation.install()
+        self.handler = CapturingHandler()
+        self.handlers, sqllog.logger.handlers = sqllog.logger.handlers, [self.handler]
+
+    def tearDown(self):
+        sqllog.logger.handlers = self.handlers
+
+    @override_settings(PERF_SLOW_QUERY_MS=0)
+    def test_slow_query_from_view(self):
+        """A consulta lenta é registrada com a view e o nosso código que a fez."""
+        self.client.get(reverse('core:talks'))
+        record = self.handler.records[0]
+        self.assertEqual('core:talks', record.context)
+        self.assertTrue(any('core/' in line for line in record.stack), record.stack)
+        self.assertIn('params=', record.getMessage())
+
+    @override_settings(PERF_SLOW_QUERY_MS=0)
+    def test_slow_query_from_template(self):
+        """Consultas disparadas por um template apontam a tag."""
+        Template('{% for talk in talks %}{{ talk.title }}{% endfor %}').render(
+            Context({'talks': Talk.objects.all()}))
+        self.assertIn('{% for talk in talks %}', self.handler.records[0].template)
+
+    @override_settings(PERF_SLOW_QUERY_MS=0)
+    def test_slow_query_from_command(self):
+        call_command('run_payment_jobs')
+        self.assertEqual('manage.py run_payment_jobs', self.handler.records[0].context)
+
+    def test_fast_queries_not_logged(self):
+        list(Talk.objects.all())
+        self.assertEqual([], self.handler.records)
+
+    @override_settings(PERF_REPEATED_QUERY_THRESHOLD=3)
+    def test_repeated_queries(self):
+        """O mesmo SQL repetido na requisição é sinalizado uma vez."""
+        instrumentation.start('teste')
+        for pk in range(5):
+            Speaker.objects.filter(pk=pk).exists()
+        list(Talk.objects.all())
+        self.assertEqual(1, instrumentation.stop()[3])
+        self.assertEqual(1, len(self.handler.records))
+        self.assertEqual((3, 'teste'), (self.handler.records[0].count, self.handler.records[0].context))
+
+
+class ProfileTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media)
+        self.settings.enable()
+        # O default_storage guarda o MEDIA_ROOT de quando foi montado.
+        default_storage._setup()
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def tearDown(self):
+        self.settings.disable()
+        default_storage._setup()
+        shutil.rmtree(self.media)
+
+    def test_not_for_anonymous(self):
+        self.client.logout()
+        self.client.get(reverse('core:talks'), {'_profile': '1'})
+        self.assertFalse(Profile.objects.exists())
+
+    def test_stores_profile(self):
+        """A página é devolvida normalmente e o perfil fica guardado."""
+        resp = self.client.get(reverse('core:talks'), {'_profile': '1'})
+        self.assertEqual(200, resp.status_code)
+        profile = Profile.objects.get()
+        self.assertEqual(str(profile.pk), resp['X-Profile-Id'])
+        self.assertEqual('core:talks', profile.view)
+        self.assertTrue(profile.sql_count >= 1)
+        self.assertIn('core/talks.html', [row['key'] for row in profile.get_breakdown()['templates']])
+
+    def test_header(self):
+        self.client.get(reverse('core:talks'), HTTP_X_PROFILE='1')
+        self.assertTrue(Profile.objects.exists())
+
+    def test_text_report(self):
+        """Com _profile=text a resposta é o relatório, ordenável."""
+        resp = self.client.get(reverse('admin:export_subscriptions'), {'_profile': 'text'})
+        self.assertEqual('text/plain; charset=utf-8', resp['Content-Type'])
+        self.assertContains(resp, 'cumulative time')
+        self.assertContains(resp, 'export_subscriptions')
+        resp = self.client.get(reverse('admin:export_subscriptions'),
+                               {'_profile': 'text', '_profile_sort': 'calls'})
+        self.assertContains(resp, 'call count')
+
+    @override_settings(PERF_PROFILE_KEEP=2)
+    def test_retention(self):
+        for i in range(3):
+            self.client.get(reverse('core:talks'), {'_profile': '1'})
+        self.assertEqual(2, Profile.objects.count())
+
+    def test_admin_report_and_download(self):
+        self.client.get(reverse('core:talks'), {'_profile': '1'})
+        profile = Profile.objects.get()
+        resp = self.client.get(reverse('admin:perf_profile_report', args=[profile.pk]), {'sort': 'time'})
+        self.assertContains(resp, 'internal time')
+        resp = self.client.get(reverse('admin:perf_profile_download', args=[profile.pk]))
+        self.assertEqual('attachment; filename=perfil-%d.prof' % profile.pk, resp['Content-Disposition'])
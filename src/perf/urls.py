@@ -0,0 +1,6 @@
+# coding: utf-8
+from django.conf.urls import patterns, url
+
+urlpatterns = patterns('src.perf.views',
+    url(r'^$', 'report', name='report'),
+)
@@ -0,0 +1,19 @@
+# coding: utf-8
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.generic.simple import direct_to_template
+from .stats import store
+
+
+TOP = 20
+
+
+@staff_member_required
+def report(request):
+    store.flush()
+    rows = store.report()
+    return direct_to_template(request, 'perf/report.html', {
+        'title': u'Desempenho das views',
+        'slowest': sorted(rows, key=lambda r: (r['p95_ms'] is None, r['p95_ms'], r['mean_ms']), reverse=True)[:TOP],
+        'heaviest': sorted(rows, key=lambda r: r['queries'], reverse=True)[:TOP],
+        'window_hours': store.window * store.windows / 3600.0,
+    })
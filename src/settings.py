@@ -24,6 +24,31 @@ DATABASES = {
     }
 }
 
+# Database performance profile (see src/core/dbprofile.py): 'tuned' applies
+# SQLITE_PRAGMAS to every SQLite connection and keeps PostgreSQL connections
+# open between requests, with a health check; 'plain' leaves Django's defaults.
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'tuned')
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('busy_timeout', 5000),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),
+    ('temp_store', 'MEMORY'),
+)
+DATABASE_CONN_MAX_AGE = 600
+DATABASE_HEALTH_CHECK_INTERVAL = 30
+DATABASE_LOCK_RETRIES = 5
+
+# Read replicas (aliases in DATABASES) for the public pages; see
+# src/core/routers.py. Reads of REPLICA_APPS models go to a healthy replica,
+# everything else and all writes stay on 'default'. After a write the client
+# reads from 'default' for REPLICA_PIN_SECONDS.
+DATABASE_REPLICAS = ()
+DATABASE_ROUTERS = ['src.core.routers.ReplicaRouter']
+REPLICA_APPS = ('core',)
+REPLICA_CHECK_INTERVAL = 10
+REPLICA_PIN_SECONDS = 5
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -84,9 +109,116 @@ STATICFILES_FINDERS = (
 #    'django.contrib.staticfiles.finders.DefaultStorageFinder',
 )
 
+# In production collectstatic writes content-hashed copies of every file
+# (used by {% static %}) plus .gz/.br variants of the text ones, and
+# src.core.static.serve picks the variant from Accept-Encoding. Defaults to
+# on when DEBUG is off. With STATIC_SENDFILE_HEADER ('X-Sendfile' or
+# 'X-Accel-Redirect') the web server sends the file body itself.
+STATIC_HASHED = os.environ.get('STATIC_HASHED', str(not DEBUG)) == 'True'
+if STATIC_HASHED:
+    STATICFILES_STORAGE = 'src.core.static.CompressedCachedStorage'
+STATIC_MAX_AGE = 60 * 60
+STATIC_SENDFILE_HEADER = os.environ.get('STATIC_SENDFILE_HEADER') or None
+STATIC_SENDFILE_PREFIX = '/protected-static/'
+
+# Speaker avatar thumbnails (see src/core/thumbnails.py), generated after
+# upload by AVATAR_WORKERS background threads (0 runs them inline). Needs
+# Pillow; without it the original avatar is used.
+AVATAR_SIZES = (('small', 64), ('medium', 200), ('large', 400))
+AVATAR_FORMATS = ('webp', 'jpeg')
+AVATAR_QUALITY = 80
+AVATAR_WORKERS = 2
+
+# In-process search index over talks and speakers (see src/core/search.py).
+# Each process catches up with changes made by other processes every
+# SEARCH_SYNC_INTERVAL seconds; SEARCH_MAX_TERMS bounds the distinct terms
+# indexed per talk or speaker. With SEARCH_WARMUP the index is built when
+# src/wsgi.py warms up the process instead of on the first search.
+SEARCH_WARMUP = True
+SEARCH_SYNC_INTERVAL = 30
+SEARCH_SYNC_OVERLAP = 5
+SEARCH_MAX_TERMS = 200
+
+# Days shown on the subscription stats dashboard in the admin.
+SUBSCRIPTION_STATS_DAYS = 60
+
 # Make this unique, and don't share it with anybody.
 SECRET_KEY = '$ucj9rg63kp9w%n*$h*9x!v+o32huc2ddu^=lr)26bpdk@dr7y'
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # One key per subscribed CPF; keep it apart from the page cache so that
+    # culling there never drops registry entries. LocMemCache is for
+    # development only: each worker would hold (and warm) its own copy.
+    # In production use a shared backend (memcached, redis) sized for every
+    # CPF, e.g.
+    #     'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+    #     'LOCATION': '127.0.0.1:11211',
+    'cpf_registry': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'cpf-registry',
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
+    # Hashed static file names (STATIC_HASHED). Django's
+    # CachedStaticFilesStorage uses this alias when it exists; in the small
+    # default cache the names would be culled and rehashed from disk.
+    'staticfiles': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'staticfiles',
+        'TIMEOUT': 60 * 60 * 24 * 365,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # To share the cache between worker processes:
+    # 'default': {
+    #     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    #     'LOCATION': PROJECT_DIR.child('cache'),
+    # },
+}
+
+# Cache for the public pages (see core/pagecache.py). Disabled while
+# developing so template changes show up immediately.
+PAGE_CACHE_ENABLED = not DEBUG
+PAGE_CACHE_ALIAS = 'default'
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Registry of subscribed CPFs kept in the cache, so that the subscription
+# form only queries the database for CPFs that may already be taken. It is
+# never built on a request: with CPF_REGISTRY_WARMUP src/wsgi.py builds it
+# when the process starts (a no-op if a shared cache already holds it);
+# `manage.py warm_cpf_registry` rebuilds it. Until then the form always
+# queries the database.
+CPF_REGISTRY_ENABLED = True
+CPF_REGISTRY_WARMUP = True
+CPF_REGISTRY_ALIAS = 'cpf_registry'
+
+# Per-view timing aggregates (see src/perf). Each process flushes its
+# measurements to the cache every PERF_FLUSH_INTERVAL seconds; use a shared
+# backend (memcached) in production so that the report covers all processes.
+PERF_ENABLED = True
+PERF_CACHE_ALIAS = 'default'
+PERF_FLUSH_INTERVAL = 10
+PERF_WINDOW = 60 * 60
+PERF_WINDOWS = 24
+
+# Statements slower than this are logged to 'src.perf.sql' with the calling
+# view or command and a trimmed stack; so is any statement repeated this many
+# times within one request (an N+1 signature).
+PERF_SLOW_QUERY_MS = 100
+PERF_REPEATED_QUERY_THRESHOLD = 5
+PERF_STACK_DEPTH = 6
+
+# Number of on-demand request profiles kept (oldest are deleted).
+PERF_PROFILE_KEEP = 50
+
+# Largest list accepted by the partner batch subscription API.
+SUBSCRIPTION_API_MAX_BATCH = 1000
+
+# Above this many subscriptions the admin change list switches to keyset
+# pagination, estimated counts and index-friendly search. None disables it.
+SUBSCRIPTION_ADMIN_HIGH_VOLUME_ROWS = 100000
+
 # List of callables that know how to import templates from various sources.
 TEMPLATE_LOADERS = (
     'django.template.loaders.filesystem.Loader',
@@ -94,12 +226,27 @@ TEMPLATE_LOADERS = (
 #     'django.template.loaders.eggs.Loader',
 )
 
+# In production, compile each template once per process; src/wsgi.py also
+# warms up URLs, admin, templates and middleware before serving requests.
+# Both default to on when DEBUG is off and can be forced with env vars.
+TEMPLATE_CACHE = os.environ.get('TEMPLATE_CACHE', str(not DEBUG)) == 'True'
+WSGI_WARMUP = os.environ.get('WSGI_WARMUP', str(not DEBUG)) == 'True'
+if TEMPLATE_CACHE:
+    TEMPLATE_LOADERS = (
+        ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+    )
+
 MIDDLEWARE_CLASSES = (
+    # First, so that it also times the other middlewares.
+    'src.perf.middleware.PerfMiddleware',
+    'src.core.middleware.ReplicaPinMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    # Last: staff users can profile a request with ?_profile=1.
+    'src.perf.middleware.ProfileMiddleware',
     # Uncomment the next line for simple clickjacking protection:
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
@@ -135,6 +282,7 @@ INSTALLED_APPS = (
     # Minhas apps
     'src.core',
     'src.subscriptions',
+    'src.perf',
 )
 
 # A sample logging configuration. The only tangible logging
@@ -155,7 +303,11 @@ LOGGING = {
             'level': 'ERROR',
             'filters': ['require_debug_false'],
             'class': 'django.utils.log.AdminEmailHandler'
-        }
+        },
+        'console': {
+            'level': 'WARNING',
+            'class': 'logging.StreamHandler',
+        },
     },
     'loggers': {
         'django.request': {
@@ -163,6 +315,11 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'src.perf.sql': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     }
 }
 
@@ -1,35 +1,245 @@
 # coding: utf8
+import csv
+import json
+from datetime import datetime
+from django.conf import settings
 from django.conf.urls import patterns, url
-from django.http import HttpResponse
-from django.utils.datetime_safe import datetime
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseRedirect
+from django.template.response import TemplateResponse
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, ERROR_FLAG
+from django.utils import timezone
 from django.utils.translation import ungettext, ugettext as _
-from .models import Subscription
+from . import stats
+from .models import ApiToken, ConfirmationEmail, PaymentJob, Subscription
 
 
 __author__ = 'viniciusfaria'
 
 
+class Echo(object):
+    """
+    Pseudo-arquivo para o csv.writer: cada linha escrita é devolvida
+    imediatamente, em vez de acumulada em memória.
+    """
+    def write(self, value):
+        return value
+
+
+# Parâmetro da URL com a posição (created_at, id) da paginação por chave.
+CURSOR_VAR = 'cursor'
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+# Em modo de alto volume, contagens com filtro param de contar neste limite.
+COUNT_LIMIT = 1000
+
+# Abaixo disso a estimativa é trocada pela contagem exata, que é barata.
+EXACT_COUNT_BELOW = 1000
+
+
+def estimated_count(model, using='default'):
+    """
+    Quantidade aproximada de linhas da tabela, sem COUNT(*): as estatísticas
+    do PostgreSQL ou o maior id no SQLite. Tabelas pequenas são contadas.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [model._meta.db_table])
+    else:
+        cursor.execute('SELECT MAX(%s) FROM %s' % (qn(model._meta.pk.column), qn(model._meta.db_table)))
+    row = cursor.fetchone()
+    estimate = int(row[0] or 0) if row else 0
+    if estimate < EXACT_COUNT_BELOW:
+        return model._default_manager.using(using).count()
+    return estimate
+
+
+def encode_cursor(obj):
+    return '%s_%d' % (obj.created_at.astimezone(timezone.utc).strftime(CURSOR_FORMAT), obj.pk)
+
+
+def decode_cursor(value):
+    try:
+        created_at, pk = value.split('_')
+        created_at = datetime.strptime(created_at, CURSOR_FORMAT).replace(tzinfo=timezone.utc)
+        return created_at, int(pk)
+    except ValueError:
+        raise IncorrectLookupParameters(value)
+
+
+def after_cursor(queryset, created_at, pk):
+    """Linhas depois de (created_at, pk) na ordem (created_at, id)."""
+    # created_at >= x limita a faixa do índice (created_at, id); só com o OR
+    # seriam duas buscas e uma ordenação de todo o resultado.
+    return queryset.filter(Q(created_at__gte=created_at), Q(created_at__gt=created_at) | Q(pk__gt=pk))
+
+
+class HighVolumeMixin(object):
+    """
+    Consulta da lista de inscrições para tabelas grandes: ordem fixa por
+    (created_at, id), sem date_hierarchy e com a busca direcionada pelo
+    formato do termo (veja SubscriptionAdmin.search_queryset).
+    """
+    def __init__(self, request, model, list_display, list_display_links,
+                 list_filter, date_hierarchy, *args):
+        # O date_hierarchy agrega a tabela inteira para montar os links.
+        super(HighVolumeMixin, self).__init__(request, model, list_display,
+            list_display_links, list_filter, None, *args)
+
+    def get_ordering(self, request, queryset):
+        return ['created_at', 'pk']
+
+    def get_query_set(self, request):
+        self.cursor = self.params.pop(CURSOR_VAR, None)
+        search_fields, self.search_fields = self.search_fields, ()
+        try:
+            qs = super(HighVolumeMixin, self).get_query_set(request)
+        finally:
+            self.search_fields = search_fields
+        return self.model_admin.search_queryset(qs, self.query)
+
+
+class KeysetChangeList(HighVolumeMixin, ChangeList):
+    """Paginação por chave: cada página começa logo após a última linha da anterior."""
+    keyset = True
+
+    def get_results(self, request):
+        qs = self.query_set
+        if self.cursor:
+            qs = after_cursor(qs, *decode_cursor(self.cursor))
+
+        rows = list(qs[:self.list_per_page + 1])
+        self.result_list = rows[:self.list_per_page]
+        self.next_cursor = None
+        if len(rows) > self.list_per_page:
+            self.next_cursor = encode_cursor(self.result_list[-1])
+
+        self.full_result_count = self.model_admin.estimated_count(request)
+        self.filtered = bool(self.query_set.query.where)
+        if self.filtered:
+            self.result_count = len(self.query_set.values_list('pk', flat=True)[:COUNT_LIMIT])
+        else:
+            self.result_count = self.full_result_count
+        self.count_capped = self.filtered and self.result_count >= COUNT_LIMIT
+        self.can_show_all = False
+        self.show_all = False
+        self.multi_page = bool(self.cursor or self.next_cursor)
+        self.paginator = None
+
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor})
+
+    def first_page_url(self):
+        return self.get_query_string(remove=[CURSOR_VAR])
+
+
+class ExportChangeList(ChangeList):
+    """
+    ChangeList usada apenas para montar o queryset com os filtros, a busca e
+    o date_hierarchy da tela. Não conta nem pagina os resultados.
+    """
+    def get_results(self, request):
+        pass
+
+
+class HighVolumeExportChangeList(HighVolumeMixin, ExportChangeList):
+    pass
+
+
+def iter_in_chunks(queryset, fields, chunk_size):
+    """
+    Percorre o queryset em blocos ordenados pela chave primária, de modo
+    que apenas `chunk_size` linhas fiquem em memória por vez.
+    """
+    queryset = queryset.order_by('pk').values_list('pk', *fields)
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            break
+        for row in rows:
+            yield row[1:]
+        last_pk = rows[-1][0]
+
+
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ('name', 'email', 'phone', 'created_at', 'subscribed_today', 'paid',)
     date_hierarchy = 'created_at'
     search_fields = ('name', 'cpf', 'email', 'phone', 'created_at',)
     list_filter = ['created_at']
     actions = ['mark_as_paid']
+    export_fields = ('name', 'email')
+    export_chunk_size = 1000
+
+    def estimated_count(self, request):
+        if not hasattr(request, '_subscriptions_estimate'):
+            request._subscriptions_estimate = estimated_count(self.model)
+        return request._subscriptions_estimate
+
+    def high_volume(self, request):
+        """Modo para tabelas grandes, a partir de SUBSCRIPTION_ADMIN_HIGH_VOLUME_ROWS linhas."""
+        threshold = getattr(settings, 'SUBSCRIPTION_ADMIN_HIGH_VOLUME_ROWS', None)
+        return threshold is not None and self.estimated_count(request) >= threshold
+
+    def get_changelist(self, request, **kwargs):
+        if self.high_volume(request):
+            return KeysetChangeList
+        return super(SubscriptionAdmin, self).get_changelist(request, **kwargs)
+
+    def search_queryset(self, queryset, query):
+        """
+        Busca que pode usar índices: CPF completo é comparação exata, números
+        são prefixo de CPF ou telefone, e-mails são exatos e o resto é prefixo
+        do nome. Os índices de prefixo de telefone e nome (migração 0011) são
+        do PostgreSQL.
+        """
+        for bit in query.split():
+            digits = bit.replace('.', '').replace('-', '')
+            if digits.isdigit() and len(digits) == 11:
+                q = Q(cpf=digits)
+            elif digits.isdigit():
+                q = Q(cpf__startswith=digits) | Q(phone__startswith=bit)
+            elif '@' in bit:
+                q = Q(email=bit) | Q(email=bit.lower())
+            else:
+                q = Q(name__istartswith=bit)
+            queryset = queryset.filter(q)
+        return queryset
+
+    def queryset(self, request):
+        # "Inscrito hoje?" calculado no banco, na mesma consulta da lista.
+        qs = super(SubscriptionAdmin, self).queryset(request)
+        connection = connections[qs.db]
+        today = timezone.localtime(timezone.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+        column = '%s.%s' % (connection.ops.quote_name(self.model._meta.db_table),
+                            connection.ops.quote_name('created_at'))
+        return qs.extra(select={'created_today': '%s >= %%s' % column},
+                        select_params=[connection.ops.value_to_db_datetime(today)])
 
     def subscribed_today(self, obj):
-        return obj.created_at.date() == datetime.today().date()
+        if hasattr(obj, 'created_today'):
+            return bool(obj.created_today)
+        return timezone.localtime(obj.created_at).date() == timezone.localtime(timezone.now()).date()
 
     subscribed_today.short_description = u'Inscrito hoje?'
     subscribed_today.boolean = True
 
     def mark_as_paid(self, request, queryset):
-        count = queryset.update(paid=True)
+        # Um UPDATE único em milhares de linhas segura o lock da tabela e a
+        # requisição; a marcação é feita em blocos pelo run_payment_jobs.
+        job = PaymentJob.create_for(queryset)
         msg = ungettext(
-            u'%(count)d inscrição foi marcada como paga.',
-            u'%(count)d inscrições foram marcadas como pagas.',
-            count
-        ) % {'count': count}
+            u'%(count)d inscrição será marcada como paga (tarefa %(job)s).',
+            u'%(count)d inscrições serão marcadas como pagas (tarefa %(job)s).',
+            job.total
+        ) % {'count': job.total, 'job': job}
         self.message_user(request, msg)
 
     mark_as_paid.short_description = _(u'Marcar como pagas')
@@ -41,17 +251,94 @@ class SubscriptionAdmin(admin.ModelAdmin):
             # controle de permissões e cache automaticamente para nós.
             url(r'exportar-inscricoes/$',
                 self.admin_site.admin_view(self.export_subscriptions),
-                name='export_subscriptions')
+                name='export_subscriptions'),
+            url(r'estatisticas/$',
+                self.admin_site.admin_view(self.stats_dashboard),
+                name='subscription_stats'),
+            url(r'estatisticas\.json$',
+                self.admin_site.admin_view(self.stats_json),
+                name='subscription_stats_json'),
         )
         # A ordem é importante. As URLs originais do admin são muito permissivas
         # e acabam sendo encontradas antes da nossa se elas estiverem na frente.
         return extra_url + original_urls
 
+    def get_export_queryset(self, request):
+        list_display = self.get_list_display(request)
+        if self.high_volume(request):
+            changelist = HighVolumeExportChangeList
+        else:
+            changelist = ExportChangeList
+        cl = changelist(request, self.model, list_display,
+            self.get_list_display_links(request, list_display),
+            self.list_filter, self.date_hierarchy, self.search_fields,
+            self.list_select_related, self.list_per_page,
+            self.list_max_show_all, self.list_editable, self)
+        return cl.query_set
+
+    def export_rows(self, queryset):
+        writer = csv.writer(Echo())
+        for row in iter_in_chunks(queryset, self.export_fields, self.export_chunk_size):
+            yield writer.writerow([unicode(value).encode('utf-8') for value in row])
+
     def export_subscriptions(self, request):
-        subscriptions = self.model.objects.all()
-        rows = [','.join([s.name, s.email]) for s in subscriptions]
-        response = HttpResponse('\r\n'.join(rows), content_type='text/csv')
+        try:
+            queryset = self.get_export_queryset(request)
+        except IncorrectLookupParameters:
+            changelist = reverse('admin:subscriptions_subscription_changelist')
+            return HttpResponseRedirect(changelist + '?' + ERROR_FLAG + '=1')
+
+        # O conteúdo é um gerador: as linhas são enviadas à medida que são
+        # lidas do banco, sem montar o arquivo inteiro em memória.
+        response = HttpResponse(self.export_rows(queryset), content_type='text/csv')
         response['Content-Disposition'] = 'attachment; filename=inscricoes.csv'
         return response
 
-admin.site.register(Subscription, SubscriptionAdmin)
\ No newline at end of file
+
+    def stats_dashboard(self, request):
+        # Lê só as linhas diárias de DailyStats e as variações pendentes, não as inscrições.
+        data = stats.document(getattr(settings, 'SUBSCRIPTION_STATS_DAYS', 60))
+        data['days'].reverse()
+        return TemplateResponse(request, 'admin/subscriptions/stats.html', dict(
+            data, title=u'Estatísticas das inscrições', opts=self.model._meta))
+
+    def stats_json(self, request):
+        days = request.GET.get('dias')
+        data = stats.document(int(days) if days and days.isdigit() else None)
+        return HttpResponse(json.dumps(data), content_type='application/json')
+
+
+class ConfirmationEmailAdmin(admin.ModelAdmin):
+    list_display = ('recipient', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'last_error')
+    list_filter = ['status']
+    search_fields = ('recipient',)
+
+
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ('name', 'key', 'active', 'created_at')
+    list_filter = ['active']
+    readonly_fields = ('key',)
+
+
+class PaymentJobAdmin(admin.ModelAdmin):
+    list_display = ('__unicode__', 'status', 'progress_bar', 'processed', 'total', 'updated',
+                    'created_at', 'finished_at')
+    list_filter = ['status']
+    readonly_fields = ('status', 'total', 'processed', 'updated', 'last_pk', 'max_pk', 'locked_until',
+                       'created_at', 'finished_at')
+    exclude = ('pks',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def progress_bar(self, obj):
+        return u'<progress value="%(p)d" max="100">%(p)d%%</progress> %(p)d%%' % {'p': obj.progress()}
+
+    progress_bar.short_description = u'Progresso'
+    progress_bar.allow_tags = True
+
+
+admin.site.register(Subscription, SubscriptionAdmin)
+admin.site.register(ConfirmationEmail, ConfirmationEmailAdmin)
+admin.site.register(PaymentJob, PaymentJobAdmin)
+admin.site.register(ApiToken, ApiTokenAdmin)
\ No newline at end of file
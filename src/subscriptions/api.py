@@ -0,0 +1,77 @@
+# coding: utf-8
+"""
+Inscrições em lote para parceiros.
+
+Cada item é validado com as mesmas regras do importador (as do
+SubscriptionForm). Os válidos são gravados com bulk_create numa única
+transação, junto com os e-mails de confirmação, que ficam na outbox. Um
+CPF inscrito por outra requisição entre a verificação e o insert volta
+como rejeitado.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from .forms import DUPLICATE_CPF
+from .importer import Importer, existing_cpfs, pks_by_cpf
+from .models import ApiToken
+from .outbox import queue_confirmations
+
+
+def authenticate(request):
+    """O ApiToken ativo do cabeçalho `Authorization: Token <chave>`, ou None."""
+    scheme, _, key = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme.lower() != 'token' or not key.strip():
+        return None
+    try:
+        return ApiToken.objects.get(key=key.strip(), active=True)
+    except ApiToken.DoesNotExist:
+        return None
+
+
+def max_batch():
+    return getattr(settings, 'SUBSCRIPTION_API_MAX_BATCH', 1000)
+
+
+def serialize_errors(errors):
+    return dict((field, [unicode(m) for m in messages]) for field, messages in errors.items())
+
+
+@transaction.commit_on_success
+def subscribe_batch(items):
+    """
+    Grava os itens válidos e devolve um resultado por item, na ordem
+    recebida: {'index', 'status': 'created', 'id'} ou
+    {'index', 'status': 'rejected', 'errors'}.
+    """
+    importer = Importer(chunk_size=len(items))
+    rows = []
+    for index, item in enumerate(items):
+        if isinstance(item, dict):
+            rows.append((index, item))
+        else:
+            importer.reject(index, {}, {'__all__': [u'Cada item deve ser um objeto.']})
+
+    accepted = importer.validate_chunk(rows)
+    sid = transaction.savepoint()
+    try:
+        objs = importer.save(accepted)
+    except IntegrityError:
+        # Outra requisição gravou algum destes CPFs depois da verificação.
+        transaction.savepoint_rollback(sid)
+        taken = existing_cpfs(cleaned['cpf'] for index, cleaned in accepted)
+        for index, cleaned in accepted:
+            if cleaned['cpf'] in taken:
+                importer.reject(index, cleaned, {'cpf': [DUPLICATE_CPF]})
+        accepted = [(index, cleaned) for index, cleaned in accepted if cleaned['cpf'] not in taken]
+        objs = importer.save(accepted)
+    else:
+        transaction.savepoint_commit(sid)
+    pks = pks_by_cpf(obj.cpf for obj in objs)
+    for obj in objs:
+        obj.pk = pks[obj.cpf]
+    queue_confirmations(objs)
+
+    results = [{'index': index, 'status': 'created', 'id': obj.pk}
+               for (index, cleaned), obj in zip(accepted, objs)]
+    results.extend({'index': index, 'status': 'rejected', 'errors': serialize_errors(errors)}
+                   for index, cpf, errors in importer.rejects)
+    return sorted(results, key=lambda result: result['index'])
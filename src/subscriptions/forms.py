@@ -2,9 +2,11 @@
 from django import forms
 from django.core.exceptions import ValidationError
 from django.core.validators import EMPTY_VALUES
-from django.utils.translation import ungettext, ugettext as _
+from django.utils.translation import ungettext, ugettext as _, ugettext_lazy
 from .models import Subscription
+from .registry import cpf_registry
 
+DUPLICATE_CPF = ugettext_lazy(u'CPF já inscrito.')
 
 
 def CpfValidator(value):
@@ -54,6 +56,19 @@ class SubscriptionForm(forms.ModelForm):
         model = Subscription
         exclude = ('paid',)
 
+    def _get_validation_exclusions(self):
+        # A unicidade do CPF é verificada em clean_cpf.
+        exclude = super(SubscriptionForm, self)._get_validation_exclusions()
+        exclude.append('cpf')
+        return exclude
+
+    def clean_cpf(self):
+        cpf = self.cleaned_data['cpf']
+        # Só vai ao banco se o registro indicar que o CPF pode estar inscrito.
+        if cpf_registry.might_contain(cpf) and Subscription.objects.filter(cpf=cpf).exists():
+            raise ValidationError(DUPLICATE_CPF)
+        return cpf
+
     def clean(self):
         super(SubscriptionForm, self).clean()
         if not self.cleaned_data.get('email') and\
@@ -0,0 +1,219 @@
+# coding: utf-8
+"""
+Importação em lote de inscrições (CSV ou JSONL).
+
+As linhas são validadas com as mesmas regras do SubscriptionForm
+(CpfValidator, PhoneField e e-mail ou telefone obrigatório), a unicidade
+do CPF é verificada por lote com uma consulta `cpf__in` e as inscrições
+válidas são gravadas com bulk_create.
+"""
+import csv
+import json
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.utils.translation import ugettext as _
+from .forms import CpfValidator, PhoneField
+from . import stats
+from .models import Subscription
+from .registry import cpf_registry
+
+
+# Limite de parâmetros por consulta (o SQLite aceita no máximo 999).
+LOOKUP_SIZE = 500
+
+phone_field = PhoneField(required=False)
+
+
+# Os leitores devolvem (linha, dados) ou, para linhas que não puderam ser
+# lidas, (linha, ValidationError); o Importer rejeita estas últimas.
+
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    line = 1
+    while True:
+        line += 1
+        try:
+            row = next(reader)
+        except StopIteration:
+            break
+        except csv.Error, e:
+            yield line, ValidationError(_(u'Linha inválida: %s') % e)
+            continue
+        try:
+            data = dict((k, (v or '').decode('utf-8')) for k, v in row.items() if k)
+        except UnicodeDecodeError:
+            data = ValidationError(_(u'A linha não está em UTF-8.'))
+        yield line, data
+
+
+def read_jsonl(stream):
+    for line, row in enumerate(stream, 1):
+        if not row.strip():
+            continue
+        try:
+            data = json.loads(row)
+        except ValueError, e:
+            # Inclui UnicodeDecodeError.
+            data = ValidationError(_(u'JSON inválido: %s') % e)
+        else:
+            if not isinstance(data, dict):
+                data = ValidationError(_(u'Cada linha deve ser um objeto.'))
+        yield line, data
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+def clean_phone(value):
+    """Aceita 'DDD-NÚMERO' (como o PhoneWidget) ou o par [ddd, número]."""
+    if not value:
+        return ''
+    if not isinstance(value, (list, tuple)):
+        value = unicode(value).split('-', 1)
+    return phone_field.clean(list(value) + [None] * (2 - len(value)))
+
+
+def clean_row(data):
+    """
+    Valida um dicionário com os campos da inscrição e devolve os dados limpos.
+    Levanta ValidationError com todas as mensagens encontradas.
+    """
+    errors = {}
+    cleaned = {}
+
+    name = unicode(data.get('name') or '').strip()
+    if not name:
+        errors['name'] = [_(u'Este campo é obrigatório.')]
+    elif len(name) > Subscription._meta.get_field('name').max_length:
+        errors['name'] = [_(u'Nome muito longo.')]
+    cleaned['name'] = name
+
+    cpf = unicode(data.get('cpf') or '').strip()
+    try:
+        CpfValidator(cpf)
+    except ValidationError, e:
+        errors['cpf'] = e.messages
+    cleaned['cpf'] = cpf
+
+    email = unicode(data.get('email') or '').strip()
+    if len(email) > Subscription._meta.get_field('email').max_length:
+        errors['email'] = [_(u'E-mail muito longo.')]
+    elif email:
+        try:
+            validate_email(email)
+        except ValidationError, e:
+            errors['email'] = e.messages
+    cleaned['email'] = email
+
+    try:
+        cleaned['phone'] = clean_phone(data.get('phone'))
+    except ValidationError, e:
+        errors['phone'] = e.messages
+        cleaned['phone'] = ''
+
+    if not errors and not email and not cleaned['phone']:
+        errors['__all__'] = [_(u'Informe seu e-mail ou telefone.')]
+
+    if errors:
+        raise ValidationError(errors)
+    return cleaned
+
+
+def pks_by_cpf(cpfs):
+    """{cpf: pk} das inscrições gravadas, já que bulk_create não devolve as chaves."""
+    cpfs = list(cpfs)
+    found = {}
+    for i in range(0, len(cpfs), LOOKUP_SIZE):
+        found.update(Subscription.objects.filter(cpf__in=cpfs[i:i + LOOKUP_SIZE])
+                     .values_list('cpf', 'pk'))
+    return found
+
+
+def existing_cpfs(cpfs):
+    """
+    CPFs já cadastrados, consultados em blocos com `cpf__in`. O registro de
+    CPFs não é usado aqui: uma consulta por bloco custa pouco e um CPF que o
+    cache tenha perdido derrubaria o bulk_create do bloco inteiro.
+    """
+    cpfs = list(cpfs)
+    found = set()
+    for i in range(0, len(cpfs), LOOKUP_SIZE):
+        found.update(Subscription.objects.filter(cpf__in=cpfs[i:i + LOOKUP_SIZE])
+                     .values_list('cpf', flat=True))
+    return found
+
+
+class Importer(object):
+    """
+    Valida e grava inscrições em lotes de `chunk_size` linhas.
+
+    `rejects` acumula (linha, cpf, erros) de tudo o que não foi importado.
+    """
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.created = 0
+        self.rejects = []
+        self.seen = set()
+
+    def reject(self, line, data, errors):
+        self.rejects.append((line, data.get('cpf', ''), errors))
+
+    def run(self, rows):
+        chunk = []
+        for line, data in rows:
+            chunk.append((line, data))
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return self
+
+    def validate_chunk(self, chunk):
+        """Devolve a lista de (linha, dados limpos) que podem ser gravados."""
+        valid = []
+        for line, data in chunk:
+            if isinstance(data, ValidationError):
+                self.reject(line, {}, {'__all__': data.messages})
+                continue
+            try:
+                valid.append((line, clean_row(data)))
+            except ValidationError, e:
+                self.reject(line, data, e.message_dict)
+
+        existing = existing_cpfs(set(cleaned['cpf'] for line, cleaned in valid))
+        accepted = []
+        for line, cleaned in valid:
+            cpf = cleaned['cpf']
+            if cpf in existing or cpf in self.seen:
+                self.reject(line, cleaned, {'cpf': [_(u'CPF já inscrito.')]})
+                continue
+            self.seen.add(cpf)
+            accepted.append((line, cleaned))
+        return accepted
+
+    @transaction.commit_on_success
+    def import_chunk(self, chunk):
+        return self.save(self.validate_chunk(chunk))
+
+    def save(self, accepted):
+        """Grava as linhas aceitas por validate_chunk (sem controlar a transação)."""
+        objs = [Subscription(**cleaned) for line, cleaned in accepted]
+        Subscription.objects.bulk_create(objs, batch_size=LOOKUP_SIZE)
+        cpf_registry.add(*[obj.cpf for obj in objs])
+        stats.record_created(objs)
+        self.created += len(objs)
+        return objs
+
+
+def write_rejects(rejects, stream):
+    writer = csv.writer(stream)
+    writer.writerow(['line', 'cpf', 'errors'])
+    for line, cpf, errors in sorted(rejects):
+        messages = u'; '.join(u'%s: %s' % (field, u' '.join(unicode(m) for m in msgs))
+                              for field, msgs in sorted(errors.items()))
+        writer.writerow([line, unicode(cpf).encode('utf-8'), messages.encode('utf-8')])
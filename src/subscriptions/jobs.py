@@ -0,0 +1,89 @@
+# coding: utf-8
+"""
+Worker das marcações de pagamento (PaymentJob).
+
+Cada bloco de inscrições é atualizado junto com o progresso da tarefa em
+uma transação curta, então uma tarefa interrompida recomeça do bloco em que
+parou, sem repetir nem pular inscrições.
+
+Antes de começar, o worker reserva a tarefa com um UPDATE condicional, que
+só um worker consegue fazer; a reserva vale por LEASE e é renovada a cada
+bloco. Se o worker morrer, outro a retoma quando a reserva vencer. Cada
+bloco começa renovando a reserva com outro UPDATE condicional (o mesmo
+locked_until gravado por este worker e ainda não vencido): um worker que
+perdeu a reserva para de gravar em vez de disputar a tarefa com o novo.
+"""
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from . import stats
+from .models import PaymentJob, Subscription
+
+
+CHUNK_SIZE = 1000
+
+LEASE = timedelta(minutes=5)
+
+
+@transaction.commit_on_success
+def claim(job):
+    """Reserva a tarefa para este worker; False se outro já está com ela."""
+    now = timezone.now()
+    claimed = (PaymentJob.objects.filter(pk=job.pk).exclude(status=PaymentJob.DONE)
+               .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+               .update(status=PaymentJob.RUNNING, locked_until=now + LEASE))
+    if claimed:
+        job.status, job.locked_until = PaymentJob.RUNNING, now + LEASE
+    return bool(claimed)
+
+
+def renew(job):
+    """Renova a reserva deste worker; False se ela venceu ou passou para outro."""
+    now = timezone.now()
+    renewed = (PaymentJob.objects.filter(pk=job.pk, status=PaymentJob.RUNNING,
+                                         locked_until=job.locked_until, locked_until__gt=now)
+               .update(locked_until=now + LEASE))
+    if renewed:
+        job.locked_until = now + LEASE
+    return bool(renewed)
+
+
+@transaction.commit_on_success
+def run_chunk(job, chunk_size=CHUNK_SIZE):
+    """
+    Processa o próximo bloco; devolve False quando não há mais nada ou
+    quando este worker perdeu a reserva (nada é gravado nesse caso).
+    """
+    # A renovação trava a linha da tarefa até o fim da transação.
+    if not renew(job):
+        return False
+    pks = job.next_pks(chunk_size)
+    if pks:
+        job.updated += stats.set_paid(Subscription.objects.filter(pk__in=pks))
+        job.processed += len(pks)
+        job.last_pk = pks[-1]
+        fields = {'updated': job.updated, 'processed': job.processed, 'last_pk': job.last_pk}
+    else:
+        job.status, job.finished_at, job.locked_until = PaymentJob.DONE, timezone.now(), None
+        fields = {'status': job.status, 'finished_at': job.finished_at, 'locked_until': None}
+    PaymentJob.objects.filter(pk=job.pk).update(**fields)
+    return bool(pks)
+
+
+def run_job(job, chunk_size=CHUNK_SIZE):
+    """Executa a tarefa até o fim, se conseguir reservá-la."""
+    if not claim(job):
+        return None
+    while run_chunk(job, chunk_size):
+        pass
+    return job
+
+
+def run_pending(chunk_size=CHUNK_SIZE):
+    """
+    Executa as tarefas aguardando ou interrompidas, da mais antiga para a
+    mais nova, pulando as que outro worker já reservou.
+    """
+    jobs = PaymentJob.objects.exclude(status=PaymentJob.DONE).order_by('pk')
+    return filter(None, [run_job(job, chunk_size) for job in jobs])
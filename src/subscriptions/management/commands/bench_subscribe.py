@@ -0,0 +1,65 @@
+# coding: utf-8
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import Client
+from django.test.utils import override_settings
+from south.management.commands import patch_for_test_db_setup
+from ...models import Subscription
+from ...registry import cpf_registry
+
+
+class Command(BaseCommand):
+    help = (u'Mede o POST de inscrição com e sem o registro de CPFs, num banco '
+            u'de teste com --rows inscrições.')
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', default=10000,
+                    help=u'Inscrições existentes antes da medida.'),
+        make_option('--requests', type='int', default=500,
+                    help=u'POSTs por cenário.'),
+    )
+
+    def handle(self, *args, **options):
+        patch_for_test_db_setup()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            self.bench(options['rows'], options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def bench(self, rows, requests):
+        Subscription.objects.bulk_create(
+            [Subscription(name='Pessoa %d' % i, cpf='%011d' % i, email='p%d@exemplo.com' % i)
+             for i in xrange(rows)], batch_size=500)
+        connection.use_debug_cursor = True
+        client = Client()
+        url = reverse('subscriptions:subscribe')
+        start = [rows]
+
+        def new_cpf():
+            start[0] += 1
+            return '%011d' % start[0]
+
+        def duplicate_cpf():
+            return '%011d' % (start[0] % rows)
+
+        self.stdout.write(u'%-10s %-10s %12s %10s\n' % (u'registro', u'CPF', u'ms/POST', u'queries'))
+        for enabled in (False, True):
+            with override_settings(CPF_REGISTRY_ENABLED=enabled):
+                cpf_registry.clear()
+                if enabled:
+                    cpf_registry.warm()
+                for label, cpf in ((u'novo', new_cpf), (u'repetido', duplicate_cpf)):
+                    queries, elapsed = 0, 0.0
+                    for i in xrange(requests):
+                        began = time.time()
+                        client.post(url, {'name': u'Bench', 'cpf': cpf(),
+                                          'email': 'bench@exemplo.com'})
+                        elapsed += time.time() - began
+                        # connection.queries é zerada no início de cada requisição.
+                        queries += len(connection.queries)
+                    self.stdout.write(u'%-10s %-10s %12.3f %10.2f\n' % (
+                        enabled and u'ligado' or u'desligado', label,
+                        elapsed * 1000 / requests, float(queries) / requests))
@@ -0,0 +1,85 @@
+# coding: utf-8
+import os
+import tempfile
+import threading
+import time
+from optparse import make_option
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import RequestFactory
+from south.management.commands import patch_for_test_db_setup
+from ...models import Subscription
+
+
+class Command(BaseCommand):
+    help = (u'Envia inscrições de várias threads ao mesmo tempo contra um banco '
+            u'SQLite de teste em arquivo e falha se alguma não for gravada.')
+    option_list = BaseCommand.option_list + (
+        make_option('--threads', type='int', default=16),
+        make_option('--requests', type='int', default=25,
+                    help=u'Inscrições enviadas por thread.'),
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError(u'Este teste é para o SQLite.')
+
+        # Em memória cada thread veria um banco próprio: usa um arquivo.
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        connection.settings_dict['TEST_NAME'] = path
+        patch_for_test_db_setup()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        connection.close()
+        try:
+            self.hammer(options['threads'], options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def hammer(self, threads, requests):
+        application = WSGIHandler()
+        url = reverse('subscriptions:subscribe')
+        statuses, errors = {}, []
+        lock = threading.Lock()
+
+        def worker(n):
+            factory = RequestFactory()
+            for i in range(requests):
+                number = n * requests + i
+                environ = factory.post(url, {
+                    'name': u'Pessoa %d' % number, 'cpf': '%011d' % number,
+                    'email': 'p%d@exemplo.com' % number, 'csrfmiddlewaretoken': 'hammer',
+                }, HTTP_COOKIE='%s=hammer' % settings.CSRF_COOKIE_NAME).environ
+                status = []
+                try:
+                    body = application(environ, lambda s, h, exc_info=None: status.append(s))
+                    ''.join(body)
+                except Exception, e:
+                    status.append('erro %r' % e)
+                    with lock:
+                        errors.append((number, e))
+                with lock:
+                    code = status[0].split()[0]
+                    statuses[code] = statuses.get(code, 0) + 1
+            connection.close()
+
+        began = time.time()
+        pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.time() - began
+
+        total = threads * requests
+        created = Subscription.objects.count()
+        self.stdout.write(u'%d inscrições em %.2f s (%.0f/s), %d gravadas, respostas: %s\n' % (
+            total, elapsed, total / elapsed, created,
+            u', '.join(u'%s: %d' % item for item in sorted(statuses.items()))))
+        if created != total or statuses.get('302') != total:
+            for number, error in sorted(errors)[:10]:
+                self.stderr.write(u'Pessoa %d: %r\n' % (number, error))
+            raise CommandError(u'%d de %d inscrições falharam.' % (total - created, total))
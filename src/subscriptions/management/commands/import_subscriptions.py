@@ -0,0 +1,44 @@
+# coding: utf-8
+import os
+import sys
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from ...importer import Importer, READERS, write_rejects
+
+
+class Command(BaseCommand):
+    args = '<arquivo>'
+    help = u'Importa inscrições de um arquivo CSV ou JSONL ("-" lê da entrada padrão).'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', choices=READERS.keys(),
+                    help=u'Formato do arquivo (padrão: pela extensão).'),
+        make_option('--chunk-size', type='int', default=1000,
+                    help=u'Linhas validadas e gravadas por lote.'),
+        make_option('--rejects',
+                    help=u'Arquivo CSV com as linhas rejeitadas e os motivos.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError(u'Informe o arquivo a importar.')
+        path = args[0]
+
+        format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if format not in READERS:
+            raise CommandError(u'Formato desconhecido: %s' % format)
+
+        stream = sys.stdin if path == '-' else open(path, 'rb')
+        start = time.time()
+        try:
+            importer = Importer(options['chunk_size']).run(READERS[format](stream))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if options['rejects']:
+            with open(options['rejects'], 'wb') as report:
+                write_rejects(importer.rejects, report)
+
+        self.stdout.write(u'%d inscrições importadas, %d rejeitadas em %.1fs.\n' % (
+            importer.created, len(importer.rejects), time.time() - start))
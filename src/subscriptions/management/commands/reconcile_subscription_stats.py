@@ -0,0 +1,25 @@
+# coding: utf-8
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from ...stats import fold, reconcile
+
+
+class Command(BaseCommand):
+    help = u'Recalcula as estatísticas diárias a partir das inscrições e corrige as diferenças.'
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', default=False,
+                    help=u'Só mostra as diferenças, sem corrigir.'),
+        make_option('--fold', action='store_true', default=False,
+                    help=u'Só consolida as variações pendentes (rode a cada minuto).'),
+    )
+
+    def handle(self, *args, **options):
+        if options['fold']:
+            self.stdout.write(u'%d variações consolidadas.\n' % fold())
+            return
+        drift = reconcile(dry_run=options['dry_run'])
+        for day, (total, paid), (expected_total, expected_paid) in drift:
+            self.stdout.write(u'%s: %d inscrições e %d pagas, deveriam ser %d e %d.\n' % (
+                day, total, paid, expected_total, expected_paid))
+        self.stdout.write(u'%d dias com diferença%s.\n' % (
+            len(drift), ' (nada foi alterado)' if options['dry_run'] and drift else ''))
@@ -0,0 +1,26 @@
+# coding: utf-8
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from ...jobs import CHUNK_SIZE, run_pending
+
+
+class Command(BaseCommand):
+    help = u'Executa as marcações de pagamento agendadas pelo admin.'
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', type='int', default=CHUNK_SIZE,
+                    help=u'Inscrições atualizadas por transação.'),
+        make_option('--loop', action='store_true', default=False,
+                    help=u'Continua rodando, verificando novas tarefas periodicamente.'),
+        make_option('--interval', type='float', default=5,
+                    help=u'Segundos entre verificações quando não há tarefas.'),
+    )
+
+    def handle(self, *args, **options):
+        while True:
+            for job in run_pending(options['chunk_size']):
+                self.stdout.write(u'Tarefa %s: %d de %d inscrições, %d marcadas como pagas.\n' % (
+                    job, job.processed, job.total, job.updated))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
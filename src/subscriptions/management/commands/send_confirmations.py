@@ -0,0 +1,33 @@
+# coding: utf-8
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from ...outbox import drain, MAX_ATTEMPTS
+
+
+class Command(BaseCommand):
+    help = u'Envia os e-mails de confirmação pendentes, em lotes.'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=100,
+                    help=u'E-mails enviados por conexão SMTP.'),
+        make_option('--max-attempts', type='int', default=MAX_ATTEMPTS,
+                    help=u'Tentativas antes de desistir de um e-mail.'),
+        make_option('--loop', action='store_true', default=False,
+                    help=u'Continua rodando, verificando a outbox periodicamente.'),
+        make_option('--interval', type='float', default=5,
+                    help=u'Segundos entre verificações quando a outbox está vazia.'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        while True:
+            # Esvazia tudo o que já está na hora de enviar, lote a lote.
+            while True:
+                sent, failed = drain(batch_size, options['max_attempts'])
+                if sent or failed:
+                    self.stdout.write(u'%d enviados, %d falhas\n' % (sent, failed))
+                if sent + failed < batch_size:
+                    break
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
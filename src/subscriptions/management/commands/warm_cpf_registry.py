@@ -0,0 +1,22 @@
+# coding: utf-8
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from ...registry import cpf_registry
+
+
+class Command(BaseCommand):
+    help = u'Monta o registro de CPFs inscritos a partir do banco (rode no deploy, antes do tráfego).'
+    option_list = BaseCommand.option_list + (
+        make_option('--force', action='store_true', default=False,
+                    help=u'Esvazia e remonta o registro mesmo que já esteja montado.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['force']:
+            cpf_registry.clear()
+        if cpf_registry.is_warm():
+            self.stdout.write(u'O registro já está montado.\n')
+        elif cpf_registry.warm():
+            self.stdout.write(u'Registro montado.\n')
+        else:
+            self.stdout.write(u'Outro processo está montando o registro.\n')
@@ -1,11 +1,19 @@
 # coding: utf-8
+import binascii
+import bisect
+import os
 from django.db import models
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from . import stats
+from .registry import cpf_registry
 
 
 class Subscription(models.Model):
     name = models.CharField('Nome', max_length=100)
     cpf = models.CharField('CPF', max_length=11, unique=True)
-    email = models.EmailField('E-mail', blank=True)
+    email = models.EmailField('E-mail', blank=True, db_index=True)
     phone = models.CharField('Telefone', max_length=20, blank=True)
     created_at = models.DateTimeField('Criado em', auto_now_add=True)
     paid = models.BooleanField()
@@ -20,3 +28,190 @@ class Subscription(models.Model):
         verbose_name = u"Inscrição"
         verbose_name_plural = u"Inscrições"
 
+
+
+class ConfirmationEmail(models.Model):
+    """E-mail de confirmação aguardando envio (outbox)."""
+    PENDING, SENDING, SENT, FAILED = 'P', 'E', 'S', 'F'
+    STATUSES = (
+        (PENDING, u'Pendente'),
+        (SENDING, u'Enviando'),
+        (SENT, u'Enviado'),
+        (FAILED, u'Falhou'),
+    )
+
+    subscription = models.ForeignKey('Subscription', verbose_name=u'Inscrição')
+    recipient = models.EmailField('Destinatário')
+    status = models.CharField('Situação', max_length=1, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField('Tentativas', default=0)
+    next_attempt_at = models.DateTimeField('Próxima tentativa', default=timezone.now)
+    # Lote (de outbox.drain) que reservou o e-mail para envio.
+    claim = models.CharField(max_length=32, blank=True, editable=False)
+    last_error = models.TextField('Último erro', blank=True)
+    created_at = models.DateTimeField('Criado em', auto_now_add=True)
+    sent_at = models.DateTimeField('Enviado em', null=True, blank=True)
+
+    def __unicode__(self):
+        return self.recipient
+
+    class Meta:
+        ordering = ["next_attempt_at"]
+        verbose_name = u"E-mail de confirmação"
+        verbose_name_plural = u"E-mails de confirmação"
+
+
+class PaymentJob(models.Model):
+    """
+    Marcação de inscrições como pagas feita em segundo plano, em blocos
+    ordenados pela chave primária. `pks` guarda as chaves das inscrições
+    escolhidas no agendamento, e não a consulta, que dependeria da versão do
+    código; `last_pk` guarda até onde já foi feito, para retomar de lá se o
+    worker reiniciar.
+    """
+    PENDING, RUNNING, DONE = 'P', 'R', 'D'
+    STATUSES = (
+        (PENDING, u'Aguardando'),
+        (RUNNING, u'Em andamento'),
+        (DONE, u'Concluída'),
+    )
+
+    # Chaves das inscrições, em ordem crescente e separadas por vírgula.
+    pks = models.TextField(default='')
+    status = models.CharField('Situação', max_length=1, choices=STATUSES, default=PENDING)
+    total = models.PositiveIntegerField('Total')
+    processed = models.PositiveIntegerField('Processadas', default=0)
+    updated = models.PositiveIntegerField('Marcadas como pagas', default=0)
+    last_pk = models.PositiveIntegerField(default=0)
+    # Maior chave existente ao agendar: inscrições feitas depois ficam de fora.
+    max_pk = models.PositiveIntegerField(null=True, blank=True)
+    # Worker que está com a tarefa a mantém reservada até aqui (veja jobs.claim).
+    locked_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField('Criada em', auto_now_add=True)
+    finished_at = models.DateTimeField('Concluída em', null=True, blank=True)
+
+    def __unicode__(self):
+        return u'#%d' % self.pk
+
+    @classmethod
+    def create_for(cls, queryset):
+        """
+        Agenda a marcação das inscrições do queryset (filtros inclusos).
+        Inscrições feitas depois ficam de fora.
+        """
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+        return cls.objects.create(pks=','.join(str(pk) for pk in pks), total=len(pks),
+                                  max_pk=pks[-1] if pks else 0)
+
+    def pk_list(self):
+        if getattr(self, '_pk_list', None) is None:
+            self._pk_list = [int(pk) for pk in self.pks.split(',') if pk]
+        return self._pk_list
+
+    def next_pks(self, limit):
+        """As próximas `limit` chaves depois de last_pk."""
+        pks = self.pk_list()
+        start = bisect.bisect_right(pks, self.last_pk)
+        return pks[start:start + limit]
+
+    def progress(self):
+        if not self.total:
+            return 100
+        return 100 * self.processed / self.total
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = u"Marcação de pagamento"
+        verbose_name_plural = u"Marcações de pagamento"
+
+
+def generate_key():
+    return binascii.hexlify(os.urandom(20))
+
+
+class ApiToken(models.Model):
+    """Chave de acesso de um parceiro à API de inscrições em lote."""
+    name = models.CharField('Parceiro', max_length=100)
+    key = models.CharField('Chave', max_length=40, unique=True, default=generate_key)
+    active = models.BooleanField('Ativa', default=True)
+    created_at = models.DateTimeField('Criada em', auto_now_add=True)
+
+    def __unicode__(self):
+        return self.name
+
+    class Meta:
+        ordering = ["name"]
+        verbose_name = u"Chave da API"
+        verbose_name_plural = u"Chaves da API"
+
+
+class DailyStats(models.Model):
+    """
+    Inscrições e pagamentos de cada dia, consolidados a partir de
+    DailyStatsDelta (veja stats.py) para que os totais não precisem agregar
+    a tabela inteira.
+    """
+    day = models.DateField('Dia', unique=True)
+    total = models.IntegerField('Inscrições', default=0)
+    paid = models.IntegerField('Pagas', default=0)
+
+    def __unicode__(self):
+        return unicode(self.day)
+
+    @property
+    def unpaid(self):
+        return self.total - self.paid
+
+    class Meta:
+        ordering = ["day"]
+        verbose_name = u"Estatística diária"
+        verbose_name_plural = u"Estatísticas diárias"
+
+
+class DailyStatsDelta(models.Model):
+    """
+    Variação de DailyStats gravada por uma alteração nas inscrições. Só
+    recebe INSERTs, que não disputam a linha do dia; stats.fold() soma as
+    variações em DailyStats e as apaga.
+    """
+    day = models.DateField('Dia')
+    total = models.IntegerField('Inscrições', default=0)
+    paid = models.IntegerField('Pagas', default=0)
+
+    def __unicode__(self):
+        return u'%s: %+d, %+d' % (self.day, self.total, self.paid)
+
+    class Meta:
+        verbose_name = u"Variação diária"
+        verbose_name_plural = u"Variações diárias"
+
+
+# Mantém o registro de CPFs inscritos (veja registry.py). Gravações em massa
+# (bulk_create) não disparam signals e atualizam o registro diretamente.
+@receiver(post_save, sender=Subscription)
+def register_cpf(sender, instance, **kwargs):
+    cpf_registry.add(instance.cpf)
+
+
+@receiver(post_delete, sender=Subscription)
+def unregister_cpf(sender, instance, **kwargs):
+    cpf_registry.discard(instance.cpf)
+
+
+# Estatísticas diárias (veja stats.py). As gravações em massa (bulk_create,
+# update) atualizam as estatísticas diretamente.
+@receiver(pre_save, sender=Subscription)
+def remember_paid(sender, instance, raw=False, **kwargs):
+    instance._stored = None
+    if instance.pk and not raw:
+        instance._stored = (Subscription.objects.filter(pk=instance.pk)
+                            .values_list('created_at', 'paid')[:1] or [None])[0]
+
+
+@receiver(post_save, sender=Subscription)
+def count_saved(sender, instance, created, **kwargs):
+    stats.record_saved(instance, created, getattr(instance, '_stored', None))
+
+
+@receiver(post_delete, sender=Subscription)
+def count_deleted(sender, instance, **kwargs):
+    stats.record_deleted(instance)
@@ -0,0 +1,122 @@
+# coding: utf-8
+"""
+Outbox dos e-mails de confirmação.
+
+A view apenas registra o e-mail pendente; o envio é feito depois, em lotes,
+pelo comando `send_confirmations`, usando uma única conexão SMTP por lote.
+
+Antes de enviar, cada lote reserva os seus e-mails com um UPDATE
+condicional (só os que ainda estão pendentes), então duas execuções
+simultâneas do comando não enviam o mesmo e-mail. A reserva vale por
+CLAIM_TIMEOUT: se o processo morrer no meio do lote, os e-mails voltam a
+ser enviados depois disso (e os que já tinham saído, enviados de novo).
+"""
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+from .models import ConfirmationEmail
+
+
+SUBJECT = u'Cadastrado com Sucesso'
+MESSAGE = u'Obrigado pela sua inscrição!'
+
+# Espera antes da n-ésima nova tentativa: BACKOFF * 2 ** (n - 1).
+BACKOFF = timedelta(minutes=1)
+MAX_ATTEMPTS = 5
+
+# Tempo que um lote tem para enviar os e-mails que reservou.
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def queue_confirmation(subscription):
+    """Registra a confirmação para envio posterior, se houver e-mail."""
+    if not subscription.email:
+        return None
+    return ConfirmationEmail.objects.create(
+        subscription=subscription, recipient=subscription.email)
+
+
+def queue_confirmations(subscriptions):
+    """Como queue_confirmation, para um lote de inscrições já gravadas."""
+    entries = [ConfirmationEmail(subscription=s, recipient=s.email)
+               for s in subscriptions if s.email]
+    ConfirmationEmail.objects.bulk_create(entries)
+    return entries
+
+
+def build_message(entry, connection=None):
+    return EmailMessage(SUBJECT, MESSAGE, settings.DEFAULT_FROM_EMAIL,
+                        [entry.recipient], connection=connection)
+
+
+def pending(now=None):
+    """Pendentes na hora de tentar, inclusive as reservas vencidas."""
+    now = now or timezone.now()
+    return ConfirmationEmail.objects.filter(
+        status__in=(ConfirmationEmail.PENDING, ConfirmationEmail.SENDING), next_attempt_at__lte=now)
+
+
+def claim(batch_size, now):
+    """Reserva até `batch_size` e-mails pendentes para este lote e os devolve."""
+    pks = list(pending(now).values_list('pk', flat=True)[:batch_size])
+    if not pks:
+        return []
+    token = uuid.uuid4().hex
+    # Só as linhas que nenhum outro lote reservou nesse meio tempo.
+    pending(now).filter(pk__in=pks).update(
+        status=ConfirmationEmail.SENDING, claim=token, next_attempt_at=now + CLAIM_TIMEOUT)
+    return list(ConfirmationEmail.objects.filter(pk__in=pks, claim=token))
+
+
+def record_failure(entry, error, now, max_attempts=MAX_ATTEMPTS):
+    """Conta a tentativa e reagenda com backoff, ou desiste depois de `max_attempts`."""
+    entry.attempts += 1
+    entry.last_error = unicode(error)
+    if entry.attempts >= max_attempts:
+        entry.status = ConfirmationEmail.FAILED
+    else:
+        entry.status = ConfirmationEmail.PENDING
+        entry.next_attempt_at = now + BACKOFF * 2 ** (entry.attempts - 1)
+    entry.save()
+
+
+def drain(batch_size=100, max_attempts=MAX_ATTEMPTS, connection=None):
+    """
+    Reserva um lote de e-mails pendentes e o envia reutilizando a mesma
+    conexão. Falhas, inclusive ao abrir a conexão, são reagendadas com
+    backoff exponencial até `max_attempts`. Devolve a quantidade de
+    (enviados, falhas).
+    """
+    now = timezone.now()
+    entries = claim(batch_size, now)
+    if not entries:
+        return 0, 0
+
+    connection = connection or get_connection()
+    sent = failed = 0
+    try:
+        try:
+            connection.open()
+        except Exception, e:
+            # Servidor fora do ar: o lote inteiro conta como uma tentativa falha.
+            for entry in entries:
+                record_failure(entry, e, now, max_attempts)
+            return 0, len(entries)
+        for entry in entries:
+            try:
+                connection.send_messages([build_message(entry, connection)])
+            except Exception, e:
+                failed += 1
+                record_failure(entry, e, now, max_attempts)
+            else:
+                sent += 1
+                entry.attempts += 1
+                entry.status = ConfirmationEmail.SENT
+                entry.sent_at = timezone.now()
+                entry.last_error = ''
+                entry.save()
+    finally:
+        connection.close()
+    return sent, failed
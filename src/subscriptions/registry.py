@@ -0,0 +1,117 @@
+# coding: utf-8
+"""
+Registro dos CPFs já inscritos, guardado em um cache próprio
+(CPF_REGISTRY_ALIAS) e compartilhado entre os processos.
+
+Cada CPF é uma chave do cache, gravada ou apagada com uma única operação:
+não há leitura seguida de escrita, então duas inscrições simultâneas não
+apagam uma a outra. Um CPF ausente do registro não está inscrito e o
+formulário pode dispensar a consulta ao banco; um CPF presente ainda é
+confirmado no banco, pois o registro pode guardar CPFs que já foram
+removidos.
+
+O registro só responde "não inscrito" depois de montado a partir do banco
+(chave "warm"). A montagem nunca acontece numa requisição: é feita pelo
+src/warmup.py ao iniciar o processo (CPF_REGISTRY_WARMUP) ou pelo comando
+warm_cpf_registry, por um só processo de cada vez. Enquanto isso, todo CPF
+conta como possível inscrito e o formulário consulta o banco; os CPFs
+gravados durante a montagem já entram no cache pelos signals de
+Subscription. Se ainda assim o cache descartar algum CPF, o pior caso é o
+insert esbarrar na constraint unique, e a view trata isso.
+"""
+from django.conf import settings
+from django.core.cache import get_cache
+
+
+FOREVER = 60 * 60 * 24 * 365
+
+# Tempo máximo de uma montagem; depois disso outro processo pode tentar.
+WARM_TIMEOUT = 5 * 60
+
+
+class CpfRegistry(object):
+    def __init__(self, cache=None, prefix='cpfs'):
+        self._cache = cache
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = get_cache(getattr(settings, 'CPF_REGISTRY_ALIAS', 'cpf_registry'))
+        return self._cache
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'CPF_REGISTRY_ENABLED', True)
+
+    def _warm_key(self):
+        return '%s:warm' % self.prefix
+
+    def _warming_key(self):
+        return '%s:warming' % self.prefix
+
+    def _cpf_key(self, cpf):
+        return '%s:cpf:%s' % (self.prefix, cpf)
+
+    def warm(self, chunk_size=5000):
+        """
+        Carrega do banco os CPFs de todas as inscrições. Devolve False, sem
+        ler o banco, se outro processo já estiver montando o registro.
+        """
+        from .models import Subscription
+
+        if not self.cache.add(self._warming_key(), True, WARM_TIMEOUT):
+            return False
+        chunk = []
+        for cpf in Subscription.objects.values_list('cpf', flat=True).iterator():
+            chunk.append(cpf)
+            if len(chunk) >= chunk_size:
+                self._set(chunk)
+                chunk = []
+        self._set(chunk)
+        self.cache.set(self._warm_key(), True, FOREVER)
+        self.cache.delete(self._warming_key())
+        return True
+
+    def _set(self, cpfs):
+        if cpfs:
+            self.cache.set_many(dict((self._cpf_key(cpf), True) for cpf in cpfs), FOREVER)
+
+    def is_warm(self):
+        return bool(self.cache.get(self._warm_key()))
+
+    def warm_if_cold(self):
+        """Monta o registro se ainda não estiver montado (num cache compartilhado, só o primeiro processo lê o banco)."""
+        if not self.enabled or self.is_warm():
+            return False
+        return self.warm()
+
+    def filter(self, cpfs):
+        """
+        Os CPFs de `cpfs` que podem já estar inscritos. Os demais certamente
+        não estão. Com o registro desligado ou ainda não montado, devolve todos.
+        """
+        cpfs = [cpf for cpf in cpfs if cpf]
+        if not self.enabled or not cpfs or not self.is_warm():
+            return set(cpfs)
+        keys = dict((self._cpf_key(cpf), cpf) for cpf in cpfs)
+        return set(keys[key] for key in self.cache.get_many(keys.keys()))
+
+    def might_contain(self, cpf):
+        return bool(self.filter([cpf]))
+
+    def add(self, *cpfs):
+        # Grava mesmo antes da montagem: uma montagem em andamento pode já ter lido o banco.
+        if self.enabled:
+            self._set([cpf for cpf in cpfs if cpf])
+
+    def discard(self, *cpfs):
+        if self.enabled:
+            self.cache.delete_many([self._cpf_key(cpf) for cpf in cpfs if cpf])
+
+    def clear(self):
+        """Esvazia o registro (o cache é só dele); a próxima consulta lê o banco de novo."""
+        self.cache.clear()
+
+
+cpf_registry = CpfRegistry()
@@ -0,0 +1,241 @@
+# coding: utf-8
+"""
+Estatísticas das inscrições mantidas de forma incremental.
+
+Cada dia (no fuso local) tem uma linha em DailyStats com o total de
+inscrições e quantas estão pagas. Sempre que uma inscrição é criada,
+apagada ou muda de situação, a variação é gravada como uma nova linha em
+DailyStatsDelta:
+
+* save()/delete(): pelos signals em models.py;
+* bulk_create (importador, API): record_created(objs);
+* update em massa (marcação de pagamento): set_paid(queryset).
+
+Só INSERTs: um UPDATE na linha do dia travaria essa linha até o fim da
+transação e as inscrições simultâneas esperariam umas pelas outras.
+fold() soma as variações em DailyStats e as apaga; o comando
+`reconcile_subscription_stats --fold` faz isso e deve rodar a cada minuto
+(cron). Sem --fold ele recalcula tudo a partir das inscrições e corrige
+qualquer diferença.
+
+fold() e reconcile() travam DailyStats (lock()) e não se intercalam.
+reconcile() ainda lê inscrições e variações num mesmo snapshot (no SQLite,
+com as escritas dos outros processos bloqueadas), para que uma inscrição
+gravada no meio da contagem não seja contada só num dos lados.
+
+Os totais, o dashboard do admin e o JSON leem DailyStats, uma linha por
+dia, mais as variações ainda não consolidadas.
+"""
+from collections import defaultdict
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+
+def local_day(value):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+
+def apply(deltas):
+    """Grava {dia: (inscrições, pagas)} como variações, num único INSERT."""
+    from .models import DailyStatsDelta
+    rows = [DailyStatsDelta(day=day, total=total, paid=paid)
+            for day, (total, paid) in sorted(deltas.items()) if total or paid]
+    if rows:
+        DailyStatsDelta.objects.bulk_create(rows)
+
+
+def lock(snapshot=False):
+    """
+    Trava DailyStats até o fim da transação. Com `snapshot`, as consultas
+    seguintes da transação veem o banco como estava logo depois da trava.
+    Deve ser o primeiro comando da transação.
+    """
+    from .models import DailyStats
+    table = connection.ops.quote_name(DailyStats._meta.db_table)
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        if snapshot:
+            cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        # Conflita consigo mesmo, mas não com leituras nem com os INSERTs em
+        # DailyStatsDelta. O LOCK não tira o snapshot: ele é tirado na
+        # primeira consulta, já com a trava.
+        cursor.execute('LOCK TABLE %s IN SHARE ROW EXCLUSIVE MODE' % table)
+    else:
+        # SQLite: a primeira escrita reserva o banco para esta transação;
+        # nenhum outro processo grava até o commit.
+        cursor.execute('UPDATE %s SET total = total WHERE 0 = 1' % table)
+
+
+def add_to_day(day, total, paid):
+    """Soma às linhas de DailyStats; só usado por fold(), que roda sozinho."""
+    from .models import DailyStats
+    changes = {'total': F('total') + total, 'paid': F('paid') + paid}
+    if DailyStats.objects.filter(day=day).update(**changes):
+        return
+    sid = transaction.savepoint()
+    try:
+        DailyStats.objects.create(day=day, total=total, paid=paid)
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+        DailyStats.objects.filter(day=day).update(**changes)
+    else:
+        transaction.savepoint_commit(sid)
+
+
+@transaction.commit_on_success
+def fold():
+    """Consolida as variações em DailyStats; devolve quantas foram somadas."""
+    from .models import DailyStatsDelta
+    lock()
+    # As variações travadas por outro fold() em andamento já não aparecem quando ele termina.
+    rows = list(DailyStatsDelta.objects.select_for_update().values_list('pk', 'day', 'total', 'paid'))
+    if not rows:
+        return 0
+    sums = defaultdict(lambda: [0, 0])
+    for pk, day, total, paid in rows:
+        sums[day][0] += total
+        sums[day][1] += paid
+    for day, (total, paid) in sorted(sums.items()):
+        if total or paid:
+            add_to_day(day, total, paid)
+    pks = [row[0] for row in rows]
+    for i in range(0, len(pks), 500):
+        DailyStatsDelta.objects.filter(pk__in=pks[i:i + 500]).delete()
+    return len(rows)
+
+
+def pending():
+    """{dia: [inscrições, pagas]} das variações ainda não consolidadas."""
+    from .models import DailyStatsDelta
+    sums = defaultdict(lambda: [0, 0])
+    for day, total, paid in DailyStatsDelta.objects.values('day').annotate(
+            total_sum=Sum('total'), paid_sum=Sum('paid')).values_list('day', 'total_sum', 'paid_sum'):
+        sums[day] = [total, paid]
+    return sums
+
+
+def collect(rows, sign=1):
+    """{dia: (inscrições, pagas)} de [(created_at, paid)]."""
+    deltas = defaultdict(lambda: [0, 0])
+    for created_at, paid in rows:
+        delta = deltas[local_day(created_at)]
+        delta[0] += sign
+        delta[1] += sign if paid else 0
+    return deltas
+
+
+def record_created(subscriptions):
+    """Inscrições gravadas sem signals (bulk_create preenche created_at nos objetos)."""
+    apply(collect((s.created_at, s.paid) for s in subscriptions))
+
+
+def record_saved(subscription, created, stored=None):
+    """Depois do save(): stored é o (created_at, paid) que estava no banco."""
+    if created or stored is None:
+        apply(collect([(subscription.created_at, subscription.paid)]))
+    elif stored != (subscription.created_at, subscription.paid):
+        deltas = collect([stored], sign=-1)
+        for day, (total, paid) in collect([(subscription.created_at, subscription.paid)]).items():
+            deltas[day][0] += total
+            deltas[day][1] += paid
+        apply(deltas)
+
+
+def record_deleted(subscription):
+    apply(collect([(subscription.created_at, subscription.paid)], sign=-1))
+
+
+def set_paid(queryset, paid=True):
+    """
+    queryset.update(paid=paid) com as estatísticas: as linhas que mudam são
+    travadas e contadas por dia antes do UPDATE. Devolve quantas mudaram.
+    """
+    changing = queryset.filter(paid=not paid).select_for_update()
+    rows = list(changing.values_list('pk', 'created_at'))
+    if not rows:
+        return 0
+    updated = queryset.model.objects.filter(pk__in=[pk for pk, created_at in rows]).update(paid=paid)
+    sign = 1 if paid else -1
+    apply(dict((day, (0, sign * count)) for day, (count, ignored) in collect(
+        (created_at, paid) for pk, created_at in rows).items()))
+    return updated
+
+
+def totals():
+    """{'total':, 'paid':, 'unpaid':, 'paid_ratio':} somando as linhas diárias e as variações."""
+    from .models import DailyStats, DailyStatsDelta
+    total = paid = 0
+    for model in (DailyStats, DailyStatsDelta):
+        sums = model.objects.aggregate(total=Sum('total'), paid=Sum('paid'))
+        total, paid = total + (sums['total'] or 0), paid + (sums['paid'] or 0)
+    return {'total': total, 'paid': paid, 'unpaid': total - paid,
+            'paid_ratio': float(paid) / total if total else 0.0}
+
+
+def merged(changes=None):
+    """{dia: DailyStats} com as variações pendentes somadas (as linhas não são gravadas)."""
+    from .models import DailyStats
+    if changes is None:
+        changes = pending()
+    rows = dict((row.day, row) for row in DailyStats.objects.all())
+    for day, (total, paid) in changes.items():
+        row = rows.setdefault(day, DailyStats(day=day))
+        row.total, row.paid = row.total + total, row.paid + paid
+    return rows
+
+
+def daily(days=None):
+    """Linhas de DailyStats com as variações pendentes, dos últimos `days` dias com inscrições ou de todos."""
+    result = [row for day, row in sorted(merged().items()) if row.total > 0]
+    return result[-days:] if days else result
+
+
+def document(days=None):
+    """Totais e série diária, no formato do JSON do admin."""
+    data = totals()
+    data['days'] = [{'day': row.day.isoformat(), 'total': row.total, 'paid': row.paid,
+                     'unpaid': row.unpaid} for row in daily(days)]
+    return data
+
+
+def recount(chunk_size=5000):
+    """{dia: (inscrições, pagas)} calculado a partir das inscrições, em blocos."""
+    from .models import Subscription
+    counts, last_pk = defaultdict(lambda: [0, 0]), 0
+    while True:
+        rows = list(Subscription.objects.filter(pk__gt=last_pk).order_by('pk')
+                    .values_list('pk', 'created_at', 'paid')[:chunk_size])
+        if not rows:
+            break
+        for day, (total, paid) in collect((created_at, paid) for pk, created_at, paid in rows).items():
+            counts[day][0] += total
+            counts[day][1] += paid
+        last_pk = rows[-1][0]
+    return dict((day, tuple(values)) for day, values in counts.items())
+
+
+@transaction.commit_on_success
+def reconcile(dry_run=False):
+    """Acerta DailyStats com a contagem real; devolve [(dia, gravado, correto)] das diferenças."""
+    from .models import DailyStats
+    # Contagem e variações do mesmo snapshot, sem fold() no meio.
+    lock(snapshot=True)
+    actual = recount()
+    changes = pending()
+    stored = dict((day, (row.total, row.paid)) for day, row in merged(changes).items())
+    drift = []
+    for day in sorted(set(actual) | set(stored)):
+        expected, current = actual.get(day, (0, 0)), stored.get(day, (0, 0))
+        if expected == current:
+            continue
+        drift.append((day, current, expected))
+        if dry_run:
+            continue
+        # DailyStats fica com o que falta para, somado às variações, dar o valor correto.
+        total, paid = expected[0] - changes[day][0], expected[1] - changes[day][1]
+        if not DailyStats.objects.filter(day=day).update(total=total, paid=paid):
+            DailyStats.objects.create(day=day, total=total, paid=paid)
+    return drift
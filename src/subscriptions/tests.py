@@ -1,13 +1,38 @@
 # coding: utf-8
+import asyncore
+import json
+import os
+import subprocess
+import sys
+from datetime import timedelta
+import smtpd
+import threading
+from StringIO import StringIO
+from tempfile import NamedTemporaryFile
 from django.contrib.auth.models import User
 from django.core import mail
+from django.core.management import call_command
+from django.core.mail import get_connection
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.exceptions import ValidationError
 from django.db.utils import IntegrityError
+from django.db import connection
+from django.db.models.query import QuerySet
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.unittest import skipUnless
+from django.utils import timezone
 from django.core.urlresolvers import reverse
-from mock import Mock
-from .models import Subscription
+from mock import Mock, patch
+from .models import ApiToken, ConfirmationEmail, DailyStats, DailyStatsDelta, PaymentJob, Subscription
+from .registry import CpfRegistry, cpf_registry
+from .jobs import claim, run_chunk, run_job, run_pending
+from .outbox import claim as claim_confirmations, drain, queue_confirmation
 from .forms import SubscriptionForm
-from .admin import SubscriptionAdmin, admin
+from .importer import Importer, clean_row, read_csv, read_jsonl, write_rejects
+from . import admin as subscriptions_admin, outbox, stats
+from .admin import KeysetChangeList, SubscriptionAdmin, admin, after_cursor, estimated_count
+from ..core.queryplan import QueryPlanMixin
 
 
 class SubscriptionUrlTest(TestCase):
@@ -119,11 +144,118 @@ class SubscribeViewPostTest(TestCase):
         """Post deve salvar Subscription no banco."""
         self.assertTrue(Subscription.objects.exists())
 
+    def test_email_queued(self):
+        """Post deve agendar a notificação do visitante, sem enviar na requisição."""
+        self.assertEquals(0, len(mail.outbox))
+        self.assertEquals(1, ConfirmationEmail.objects.filter(recipient='henrique@bastos.net').count())
+
     def test_email_sent(self):
-        """Post deve notificar visitante por email."""
+        """A outbox deve notificar visitante por email."""
+        drain()
         self.assertEquals(1, len(mail.outbox))
 
 
+class SubscribeViewDuplicateTest(TestCase):
+    def setUp(self):
+        Subscription.objects.create(name='Henrique Bastos', cpf='00000000000', email='henrique@bastos.net')
+        self.data = dict(name='Outro', cpf='00000000000', email='outro@bastos.net',
+                         phone_0='21', phone_1='96186180')
+
+    def test_friendly_error(self):
+        """CPF repetido volta ao formulário com uma mensagem de erro."""
+        resp = self.client.post(reverse('subscriptions:subscribe'), self.data)
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual([u'CPF já inscrito.'], resp.context['form'].errors['cpf'])
+
+    def test_registry_miss_falls_back_to_constraint(self):
+        """Se o registro não tiver o CPF, a constraint unique ainda barra a inscrição."""
+        cpf_registry.discard('00000000000')
+        resp = self.client.post(reverse('subscriptions:subscribe'), self.data)
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual([u'CPF já inscrito.'], resp.context['form'].errors['cpf'])
+        self.assertEqual(1, Subscription.objects.count())
+
+
+class CpfRegistryTest(TestCase):
+    def setUp(self):
+        self.registry = CpfRegistry(prefix='test-cpfs')
+        self.registry.clear()
+        Subscription.objects.create(name='Henrique Bastos', cpf='00000000000', email='henrique@bastos.net')
+
+    def test_never_warms_on_lookup(self):
+        """Sem montagem, toda consulta responde "talvez" sem ler o banco nem montar o registro."""
+        with self.assertNumQueries(0):
+            self.assertEqual(set(['00000000000', '11111111111']),
+                             self.registry.filter(['00000000000', '11111111111']))
+        self.assertFalse(self.registry.is_warm())
+
+    def test_warm(self):
+        self.assertTrue(self.registry.warm())
+        self.assertTrue(self.registry.might_contain('00000000000'))
+        self.assertFalse(self.registry.might_contain('11111111111'))
+
+    def test_warm_if_cold(self):
+        """Com o registro já montado (cache compartilhado), o processo não lê o banco."""
+        self.assertTrue(self.registry.warm_if_cold())
+        with self.assertNumQueries(0):
+            self.assertFalse(self.registry.warm_if_cold())
+
+    def test_no_query_after_warm(self):
+        """Depois de montado, o registro responde sem consultar o banco."""
+        self.registry.warm()
+        with self.assertNumQueries(0):
+            self.assertEqual(set(['00000000000']), self.registry.filter(['00000000000', '11111111111']))
+
+    def test_add_and_discard(self):
+        self.registry.warm()
+        self.registry.add('11111111111')
+        self.assertTrue(self.registry.might_contain('11111111111'))
+        self.registry.discard('11111111111')
+        self.assertFalse(self.registry.might_contain('11111111111'))
+
+    def test_concurrent_adds(self):
+        """Cada CPF é uma chave: adições de processos diferentes não se sobrescrevem."""
+        self.registry.warm()
+        other = CpfRegistry(cache=self.registry.cache, prefix='test-cpfs')
+        self.registry.add('11111111111')
+        other.add('22222222221')
+        self.assertEqual(set(['11111111111', '22222222221']),
+                         self.registry.filter(['11111111111', '22222222221', '33333333331']))
+
+    def test_add_during_warm(self):
+        """CPF gravado enquanto outro processo monta o registro não se perde."""
+        self.registry.cache.add(self.registry._warming_key(), True)
+        self.registry.add('11111111111')
+        self.registry.cache.set(self.registry._warm_key(), True)
+        self.assertTrue(self.registry.might_contain('11111111111'))
+
+    def test_warming_elsewhere(self):
+        """Enquanto outro processo monta o registro, todo CPF é possível e nada é lido do banco."""
+        self.registry.cache.add(self.registry._warming_key(), True)
+        with self.assertNumQueries(0):
+            self.assertFalse(self.registry.warm())
+            self.assertTrue(self.registry.might_contain('11111111111'))
+
+    def test_lost_warm_key(self):
+        """Sem a chave "warm" o registro volta a responder "talvez" até ser remontado."""
+        self.registry.warm()
+        self.registry.cache.delete(self.registry._warm_key())
+        with self.assertNumQueries(0):
+            self.assertTrue(self.registry.might_contain('11111111111'))
+
+    def test_warm_command(self):
+        cpf_registry.clear()
+        out = StringIO()
+        call_command('warm_cpf_registry', stdout=out)
+        self.assertTrue(cpf_registry.is_warm())
+        self.assertFalse(cpf_registry.might_contain('11111111111'))
+        self.assertIn(u'Registro montado', out.getvalue())
+
+    @override_settings(CPF_REGISTRY_ENABLED=False)
+    def test_disabled(self):
+        self.assertTrue(self.registry.might_contain('11111111111'))
+
+
 class SubscribeViewInvalidPostTest(TestCase):
     def setUp(self):
         data = dict(name='Henrique Bastos', cpf='000000000001', email='henrique@bastos.net', phone='21-96186180')
@@ -190,9 +322,186 @@ class CustomActionTest(TestCase):
         # action!
         self.modeladmin.mark_as_paid(Mock(), Subscription.objects.all())
 
+    def test_scheduled(self):
+        """A action só agenda a tarefa; nada é atualizado na requisição."""
+        self.assertEqual(0, Subscription.objects.filter(paid=True).count())
+        job = PaymentJob.objects.get()
+        self.assertEqual((PaymentJob.PENDING, 1), (job.status, job.total))
+
     def test_update(self):
         """Dados devem ser atualizados como pago de acordo com o Queryset."""
+        run_pending()
         self.assertEqual(1, Subscription.objects.filter(paid=True).count())
+        job = PaymentJob.objects.get()
+        self.assertEqual((PaymentJob.DONE, 1, 1, 100), (job.status, job.processed, job.updated, job.progress()))
+
+
+class PaymentJobTest(TestCase):
+    def setUp(self):
+        for i in range(5):
+            Subscription.objects.create(name='Pessoa %d' % i, cpf='0000000000%d' % i,
+                                        email='p%d@exemplo.com' % i)
+        self.pks = list(Subscription.objects.order_by('pk').values_list('pk', flat=True))
+
+    def test_keeps_filters(self):
+        """Só as inscrições filtradas no admin são marcadas."""
+        job = PaymentJob.create_for(Subscription.objects.filter(pk__in=self.pks[:2]))
+        run_job(job, chunk_size=1)
+        self.assertEqual(self.pks[:2], list(Subscription.objects.filter(paid=True)
+                                            .order_by('pk').values_list('pk', flat=True)))
+
+    def test_chunks_report_progress(self):
+        """Cada bloco grava o progresso."""
+        job = PaymentJob.create_for(Subscription.objects.all())
+        claim(job)
+        run_chunk(job, chunk_size=2)
+        job = PaymentJob.objects.get(pk=job.pk)
+        self.assertEqual((PaymentJob.RUNNING, 2, self.pks[1], 40),
+                         (job.status, job.processed, job.last_pk, job.progress()))
+
+    def test_resume(self):
+        """Uma tarefa interrompida continua de onde parou."""
+        job = PaymentJob.create_for(Subscription.objects.all())
+        claim(job)
+        run_chunk(job, chunk_size=2)
+        Subscription.objects.filter(pk=self.pks[0]).update(paid=False)
+        # O worker morreu: a reserva dele vence.
+        PaymentJob.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        run_pending(chunk_size=2)
+        job = PaymentJob.objects.get(pk=job.pk)
+        self.assertEqual((PaymentJob.DONE, 5), (job.status, job.processed))
+        self.assertEqual(self.pks[1:], list(Subscription.objects.filter(paid=True)
+                                            .order_by('pk').values_list('pk', flat=True)))
+
+    def test_already_paid(self):
+        """Inscrições já pagas contam como processadas, mas não como marcadas."""
+        Subscription.objects.filter(pk=self.pks[0]).update(paid=True)
+        job = run_job(PaymentJob.create_for(Subscription.objects.all()))
+        self.assertEqual((5, 4), (job.processed, job.updated))
+
+    def test_ignores_later_subscriptions(self):
+        """Inscrições feitas depois do agendamento não são marcadas."""
+        job = PaymentJob.create_for(Subscription.objects.filter(paid=False))
+        late = Subscription.objects.create(name='Depois', cpf='99999999999', email='d@exemplo.com')
+        job = run_job(job, chunk_size=2)
+        self.assertEqual((5, 5, 5), (job.total, job.processed, job.updated))
+        self.assertFalse(Subscription.objects.get(pk=late.pk).paid)
+
+    def test_claimed_job_is_skipped(self):
+        """Dois workers não executam a mesma tarefa."""
+        job = PaymentJob.create_for(Subscription.objects.all())
+        self.assertTrue(claim(PaymentJob.objects.get(pk=job.pk)))
+        self.assertFalse(claim(PaymentJob.objects.get(pk=job.pk)))
+        self.assertEqual([], run_pending())
+        self.assertEqual(0, PaymentJob.objects.get(pk=job.pk).processed)
+
+    def test_lost_lease(self):
+        """Worker cuja reserva venceu e passou para outro não grava mais nada."""
+        job = PaymentJob.create_for(Subscription.objects.all())
+        claim(job)
+        PaymentJob.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        other = PaymentJob.objects.get(pk=job.pk)
+        self.assertTrue(claim(other))
+        self.assertFalse(run_chunk(job, chunk_size=2))
+        self.assertEqual(0, Subscription.objects.filter(paid=True).count())
+        self.assertTrue(run_chunk(other, chunk_size=2))
+        self.assertEqual((2, 2), PaymentJob.objects.values_list('processed', 'updated').get(pk=job.pk))
+
+    def test_expired_lease(self):
+        """Com a reserva vencida o worker para, mesmo que ninguém a tenha retomado."""
+        job = PaymentJob.create_for(Subscription.objects.all())
+        claim(job)
+        PaymentJob.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        job.locked_until = PaymentJob.objects.get(pk=job.pk).locked_until
+        self.assertFalse(run_chunk(job))
+        self.assertEqual(0, PaymentJob.objects.get(pk=job.pk).processed)
+
+    def test_stores_pks(self):
+        """A tarefa guarda as chaves escolhidas, não a consulta."""
+        job = PaymentJob.create_for(Subscription.objects.filter(pk__in=self.pks[1:3]).order_by('-name'))
+        job = PaymentJob.objects.get(pk=job.pk)
+        self.assertEqual(self.pks[1:3], job.pk_list())
+        self.assertEqual((2, self.pks[2]), (job.total, job.max_pk))
+
+
+class BatchApiTest(TestCase):
+    def setUp(self):
+        self.token = ApiToken.objects.create(name='Parceiro')
+        Subscription.objects.create(name='Henrique Bastos', cpf='00000000000', email='henrique@bastos.net')
+
+    def post(self, items, key=None):
+        return self.client.post(reverse('subscriptions:batch'), json.dumps(items),
+                                content_type='application/json',
+                                HTTP_AUTHORIZATION='Token %s' % (key or self.token.key))
+
+    def test_requires_token(self):
+        """Sem chave válida a API responde 401."""
+        resp = self.post([], key='invalida')
+        self.assertEqual(401, resp.status_code)
+        self.assertEqual('Token', resp['WWW-Authenticate'])
+
+    def test_inactive_token(self):
+        ApiToken.objects.filter(pk=self.token.pk).update(active=False)
+        self.assertEqual(401, self.post([]).status_code)
+
+    def test_invalid_body(self):
+        resp = self.client.post(reverse('subscriptions:batch'), '{x', content_type='application/json',
+                                HTTP_AUTHORIZATION='Token %s' % self.token.key)
+        self.assertEqual(400, resp.status_code)
+        self.assertEqual(400, self.post({'name': 'x'}).status_code)
+
+    @override_settings(SUBSCRIPTION_API_MAX_BATCH=2)
+    def test_batch_limit(self):
+        self.assertEqual(400, self.post([{}, {}, {}]).status_code)
+
+    def test_results_per_item(self):
+        """Válidos são gravados; os demais voltam com os erros, na ordem enviada."""
+        resp = self.post([
+            {'name': 'Ana', 'cpf': '11111111111', 'email': 'ana@exemplo.com'},
+            {'name': 'Repetido', 'cpf': '00000000000', 'email': 'r@exemplo.com'},
+            {'name': 'Bia', 'cpf': '22222222222', 'phone': '21-96186180'},
+            {'name': 'Sem contato', 'cpf': '33333333333'},
+            'texto',
+        ])
+        self.assertEqual(200, resp.status_code)
+        data = json.loads(resp.content)
+        self.assertEqual((2, 3), (data['created'], data['rejected']))
+        self.assertEqual(['created', 'rejected', 'created', 'rejected', 'rejected'],
+                         [r['status'] for r in data['results']])
+        self.assertEqual(Subscription.objects.get(cpf='11111111111').pk, data['results'][0]['id'])
+        self.assertEqual({'cpf': [u'CPF já inscrito.']}, data['results'][1]['errors'])
+        self.assertIn('__all__', data['results'][3]['errors'])
+
+    def test_queues_confirmations(self):
+        """Os e-mails de confirmação ficam na outbox."""
+        self.post([{'name': 'Ana', 'cpf': '11111111111', 'email': 'ana@exemplo.com'},
+                   {'name': 'Bia', 'cpf': '22222222222', 'phone': '21-96186180'}])
+        self.assertEqual(0, len(mail.outbox))
+        entry = ConfirmationEmail.objects.get()
+        self.assertEqual(('ana@exemplo.com', '11111111111'), (entry.recipient, entry.subscription.cpf))
+
+    def test_bulk_queries(self):
+        """O número de consultas não cresce com o tamanho do lote."""
+        items = [{'name': 'P%d' % i, 'cpf': '%011d' % (i + 100), 'email': 'p%d@exemplo.com' % i}
+                 for i in range(50)]
+        # Chave, CPFs existentes, insert, estatística do dia, chaves geradas e
+        # insert dos e-mails.
+        with self.assertNumQueries(6):
+            self.post(items)
+        self.assertEqual(51, Subscription.objects.count())
+
+    def test_concurrent_duplicate(self):
+        """CPF gravado por outra requisição depois da verificação volta como rejeitado, sem erro 500."""
+        items = [{'name': 'Outro', 'cpf': '00000000000', 'email': 'outro@exemplo.com'},
+                 {'name': 'Ana', 'cpf': '11111111111', 'email': 'ana@exemplo.com'}]
+        # A verificação não vê a inscrição já gravada, como numa corrida.
+        with patch('src.subscriptions.importer.existing_cpfs', Mock(return_value=set())):
+            resp = self.post(items)
+        self.assertEqual(200, resp.status_code)
+        results = json.loads(resp.content)['results']
+        self.assertEqual(['rejected', 'created'], [r['status'] for r in results])
+        self.assertEqual({'cpf': [u'CPF já inscrito.']}, results[0]['errors'])
+        self.assertEqual(2, Subscription.objects.count())
 
 
 class ExportSubscriptionViewTest(TestCase):
@@ -214,6 +523,36 @@ class ExportSubscriptionViewTest(TestCase):
         self.assertTrue('attachment;' in self.resp['Content-Disposition'])
 
 
+class ExportSubscriptionContentTest(TestCase):
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        assert self.client.login(username='admin', password='admin')
+        Subscription.objects.create(name=u'Henrique Bastos', cpf='00000000000',
+            email='henrique@bastos.net')
+        Subscription.objects.create(name=u'Faria, Vinícius', cpf='11111111111',
+            email='vinicius@faria.net')
+
+    def test_rows(self):
+        u"""Cada inscrição vira uma linha, com os campos corretamente escapados."""
+        resp = self.client.get(reverse('admin:export_subscriptions'))
+        self.assertEqual(
+            'Henrique Bastos,henrique@bastos.net\r\n'
+            '"Faria, Vin\xc3\xadcius",vinicius@faria.net\r\n',
+            resp.content)
+
+    def test_chunks(self):
+        u"""A leitura em blocos não deve perder nem repetir linhas."""
+        modeladmin = SubscriptionAdmin(Subscription, admin.site)
+        modeladmin.export_chunk_size = 1
+        rows = list(modeladmin.export_rows(Subscription.objects.all()))
+        self.assertEqual(2, len(rows))
+
+    def test_search(self):
+        u"""A exportação respeita a busca feita na lista de inscrições."""
+        resp = self.client.get(reverse('admin:export_subscriptions'), {'q': 'Henrique'})
+        self.assertEqual('Henrique Bastos,henrique@bastos.net\r\n', resp.content)
+
+
 class ExportSubscriptionsNotFound(TestCase):
     def test_404(self):
         u"""Login é exigido para download do csv"""
@@ -229,6 +568,13 @@ class SubscriptionFormTest(TestCase):
         self.assertDictEqual(form.errors,
                 {'cpf': [u'O CPF deve conter apenas números']})
 
+    def test_new_cpf_skips_unique_query(self):
+        """CPF ausente do registro não é procurado no banco."""
+        cpf_registry.clear()
+        cpf_registry.warm()
+        with self.assertNumQueries(0):
+            self.assertTrue(self.make_and_validate_form(cpf='99999999999').is_valid())
+
     def test_cpf_has_11_digits(self):
         u"""CPF deve ter exatamente 11 dígitos."""
         form = self.make_and_validate_form(cpf='000000000012')
@@ -249,3 +595,488 @@ class SubscriptionFormTest(TestCase):
         form = SubscriptionForm(data)
         form.is_valid()
         return form
+
+
+class FailingBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise IOError('SMTP fora do ar')
+
+
+class OutboxTest(TestCase):
+    def setUp(self):
+        self.subscription = Subscription.objects.create(
+            name='Henrique Bastos', cpf='00000000000', email='henrique@bastos.net')
+        self.entry = queue_confirmation(self.subscription)
+
+    def test_no_email(self):
+        u"""Inscrição sem e-mail não gera confirmação."""
+        s = Subscription.objects.create(name='Sem Email', cpf='11111111111', phone='21-96186180')
+        self.assertIsNone(queue_confirmation(s))
+
+    def test_drain_sends_batch(self):
+        queue_confirmation(self.subscription)
+        self.assertEqual((2, 0), drain())
+        self.assertEqual(2, len(mail.outbox))
+        self.assertFalse(ConfirmationEmail.objects.exclude(status=ConfirmationEmail.SENT).exists())
+
+    def test_batch_size(self):
+        queue_confirmation(self.subscription)
+        self.assertEqual((1, 0), drain(batch_size=1))
+        self.assertEqual((1, 0), drain(batch_size=1))
+        self.assertEqual((0, 0), drain(batch_size=1))
+
+    def test_retry_with_backoff(self):
+        u"""Falhas são reagendadas com espera crescente."""
+        self.assertEqual((0, 1), drain(connection=FailingBackend()))
+        entry = ConfirmationEmail.objects.get(pk=self.entry.pk)
+        self.assertEqual(ConfirmationEmail.PENDING, entry.status)
+        self.assertEqual(1, entry.attempts)
+        self.assertIn('SMTP fora do ar', entry.last_error)
+        self.assertTrue(entry.next_attempt_at > timezone.now())
+        # Ainda não é hora de tentar de novo.
+        self.assertEqual((0, 0), drain())
+
+    def test_gives_up(self):
+        ConfirmationEmail.objects.update(attempts=4)
+        drain(connection=FailingBackend())
+        entry = ConfirmationEmail.objects.get(pk=self.entry.pk)
+        self.assertEqual(ConfirmationEmail.FAILED, entry.status)
+
+    def test_open_failure(self):
+        u"""Sem conexão com o servidor, o lote é reagendado e drain não levanta a exceção."""
+        queue_confirmation(self.subscription)
+        connection = EmailBackend()
+        connection.open = Mock(side_effect=IOError('Connection refused'))
+        self.assertEqual((0, 2), drain(connection=connection))
+        for entry in ConfirmationEmail.objects.all():
+            self.assertEqual((ConfirmationEmail.PENDING, 1), (entry.status, entry.attempts))
+            self.assertIn('Connection refused', entry.last_error)
+            self.assertTrue(entry.next_attempt_at > timezone.now())
+
+    def test_claimed_not_sent_twice(self):
+        u"""E-mails reservados por outro lote não são enviados de novo."""
+        queue_confirmation(self.subscription)
+        now = timezone.now()
+        self.assertEqual(2, len(claim_confirmations(10, now)))
+        self.assertEqual([], claim_confirmations(10, now))
+        self.assertEqual((0, 0), drain())
+        self.assertEqual(0, len(mail.outbox))
+
+    def test_claim_race(self):
+        u"""Só as linhas que o UPDATE conseguiu reservar são enviadas."""
+        other = queue_confirmation(self.subscription)
+        values_list = QuerySet.values_list
+
+        def taken_meanwhile(queryset, *args, **kwargs):
+            # Outro lote reserva `other` entre a leitura e o UPDATE deste.
+            pks = list(values_list(queryset, *args, **kwargs))
+            ConfirmationEmail.objects.filter(pk=other.pk).update(
+                status=ConfirmationEmail.SENDING, claim='outro',
+                next_attempt_at=timezone.now() + timedelta(minutes=10))
+            return pks
+
+        with patch.object(QuerySet, 'values_list', taken_meanwhile):
+            entries = claim_confirmations(10, timezone.now())
+        self.assertEqual([self.entry.pk], [e.pk for e in entries])
+
+    def test_expired_claim(self):
+        u"""Lote que morreu no meio: os e-mails voltam a ser enviados depois de CLAIM_TIMEOUT."""
+        claim_confirmations(10, timezone.now() - timedelta(minutes=11))
+        self.assertEqual((1, 0), drain())
+        self.assertEqual(ConfirmationEmail.SENT, ConfirmationEmail.objects.get(pk=self.entry.pk).status)
+
+
+class RecordingSMTPServer(smtpd.SMTPServer):
+    def __init__(self, *args, **kwargs):
+        smtpd.SMTPServer.__init__(self, *args, **kwargs)
+        self.messages = []
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((mailfrom, rcpttos, data))
+
+
+class OutboxSMTPTest(TestCase):
+    u"""Envio por SMTP de verdade, contra um servidor local."""
+    def setUp(self):
+        self.server = RecordingSMTPServer(('127.0.0.1', 0), None)
+        self.thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.1})
+        self.thread.daemon = True
+        self.thread.start()
+        s = Subscription.objects.create(name='Henrique Bastos', cpf='00000000000',
+                                        email='henrique@bastos.net')
+        queue_confirmation(s)
+        queue_confirmation(s)
+
+    def tearDown(self):
+        self.server.close()
+        self.thread.join()
+
+    def test_drain(self):
+        connection = get_connection('django.core.mail.backends.smtp.EmailBackend',
+            host='127.0.0.1', port=self.server.socket.getsockname()[1], use_tls=False)
+        self.assertEqual((2, 0), drain(connection=connection))
+        self.assertEqual(2, len(self.server.messages))
+
+
+class ImporterTest(TestCase):
+    CSV = (
+        'name,cpf,email,phone\n'
+        'Henrique Bastos,00000000000,henrique@bastos.net,21-96186180\n'
+        'Vinicius Faria,11111111111,,21-80862728\n'
+        'Duplicado,00000000000,outro@email.com,\n'
+        'CPF Ruim,123,sem@cpf.net,\n'
+        'Sem Contato,22222222222,,\n'
+    )
+
+    def test_clean_row(self):
+        data = clean_row({'name': 'Henrique', 'cpf': '00000000000', 'phone': '21-96186180'})
+        self.assertEqual('21-96186180', data['phone'])
+
+    def test_clean_row_errors(self):
+        with self.assertRaises(ValidationError) as cm:
+            clean_row({'name': '', 'cpf': 'ABC', 'phone': '21-x'})
+        self.assertItemsEqual(['name', 'cpf', 'phone'], cm.exception.message_dict)
+
+    def test_csv(self):
+        importer = Importer().run(read_csv(StringIO(self.CSV)))
+        self.assertEqual(2, importer.created)
+        self.assertItemsEqual(['00000000000', '11111111111'],
+                              Subscription.objects.values_list('cpf', flat=True))
+        self.assertItemsEqual([4, 5, 6], [line for line, cpf, errors in importer.rejects])
+
+    def test_jsonl(self):
+        rows = '{"name": "Henrique", "cpf": "00000000000", "email": "henrique@bastos.net"}\n'
+        importer = Importer().run(read_jsonl(StringIO(rows)))
+        self.assertEqual(1, importer.created)
+
+    def test_clean_row_email_length(self):
+        with self.assertRaises(ValidationError) as cm:
+            clean_row({'name': 'Henrique', 'cpf': '00000000000', 'email': 'a' * 70 + '@bastos.net'})
+        self.assertEqual(['email'], cm.exception.message_dict.keys())
+
+    def test_csv_bad_encoding(self):
+        u"""Linha que não está em UTF-8 é rejeitada e as demais são importadas."""
+        csv = 'name,cpf,email,phone\nJos\xe9,11111111111,jose@email.com,\nAna,22222222222,ana@email.com,\n'
+        importer = Importer().run(read_csv(StringIO(csv)))
+        self.assertEqual(1, importer.created)
+        self.assertEqual([2], [line for line, cpf, errors in importer.rejects])
+
+    def test_jsonl_bad_lines(self):
+        rows = ('{"name": "Ana", "cpf": "11111111111", "email": "ana@email.com"}\n'
+                '{"name": "quebrado"\n'
+                '"texto"\n'
+                '{"name": "Jos\xe9"}\n')
+        importer = Importer().run(read_jsonl(StringIO(rows)))
+        self.assertEqual(1, importer.created)
+        self.assertEqual([2, 3, 4], sorted(line for line, cpf, errors in importer.rejects))
+
+    def test_existing_cpf(self):
+        u"""CPFs já cadastrados são rejeitados sem consultar linha a linha."""
+        Subscription.objects.create(name='Henrique', cpf='00000000000', email='h@b.net')
+        rows = [(i, {'name': 'N', 'cpf': '%011d' % i, 'email': 'a@b.net'}) for i in range(50)]
+        importer = Importer(chunk_size=50)
+        # Uma consulta de CPFs existentes, um insert para o lote inteiro e a
+        # estatística do dia.
+        with self.assertNumQueries(3):
+            importer.run(rows)
+        self.assertEqual(49, importer.created)
+        self.assertEqual(1, len(importer.rejects))
+
+    def test_existing_cpf_missing_from_registry(self):
+        u"""CPF que o registro perdeu ainda é rejeitado pela consulta ao banco."""
+        Subscription.objects.create(name='Henrique', cpf='00000000000', email='h@b.net')
+        cpf_registry.discard('00000000000')
+        importer = Importer().run([(2, {'name': 'N', 'cpf': '00000000000', 'email': 'a@b.net'})])
+        self.assertEqual(0, importer.created)
+        self.assertEqual([(2, '00000000000')], [(line, cpf) for line, cpf, errors in importer.rejects])
+
+    def test_rejects_report(self):
+        importer = Importer().run(read_csv(StringIO(self.CSV)))
+        report = StringIO()
+        write_rejects(importer.rejects, report)
+        lines = report.getvalue().splitlines()
+        self.assertEqual(['line,cpf,errors', '4,00000000000,cpf: CPF j\xc3\xa1 inscrito.'], lines[:2])
+
+    def test_command(self):
+        with NamedTemporaryFile(suffix='.csv') as data:
+            data.write(self.CSV)
+            data.flush()
+            with NamedTemporaryFile(suffix='.csv') as rejects:
+                call_command('import_subscriptions', data.name, chunk_size=2,
+                             rejects=rejects.name, stdout=StringIO())
+                self.assertEqual(4, len(open(rejects.name).read().splitlines()))
+        self.assertEqual(2, Subscription.objects.count())
+
+
+class IndexTest(QueryPlanMixin, TestCase):
+    def test_default_ordering(self):
+        u"""A ordenação padrão (created_at) usa índice."""
+        self.assertSortsWithIndex(Subscription.objects.all())
+
+    def test_date_hierarchy(self):
+        qs = Subscription.objects.filter(created_at__year=2012, created_at__month=5)
+        self.assertUsesIndex(qs, 'subscriptions_subscription', 'created_at')
+
+    def test_outbox_pending(self):
+        qs = outbox.pending()
+        self.assertUsesIndex(qs, 'subscriptions_confirmationemail', 'status', 'next_attempt_at')
+
+    def test_keyset_cursor(self):
+        u"""A página seguinte da paginação por chave começa no índice, sem ordenar o resultado."""
+        qs = after_cursor(Subscription.objects.order_by('created_at', 'pk'), timezone.now(), 10)
+        self.assertUsesIndex(qs, 'subscriptions_subscription', 'created_at')
+        self.assertSortsWithIndex(qs)
+
+    def test_search_email(self):
+        modeladmin = admin.site._registry[Subscription]
+        qs = modeladmin.search_queryset(Subscription.objects.all(), 'Pessoa@Email.com')
+        self.assertUsesIndex(qs, 'subscriptions_subscription', 'email')
+
+    @skipUnless(connection.vendor == 'postgresql', u'Índices de prefixo só no PostgreSQL')
+    def test_search_prefix(self):
+        modeladmin = admin.site._registry[Subscription]
+        for query, column in (('henri', 'name'), ('2196', 'phone'), ('2196', 'cpf')):
+            qs = modeladmin.search_queryset(Subscription.objects.all(), query)
+            self.assertUsesIndex(qs, 'subscriptions_subscription', column)
+
+
+@override_settings(SUBSCRIPTION_ADMIN_HIGH_VOLUME_ROWS=0)
+class HighVolumeAdminTest(TestCase):
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        assert self.client.login(username='admin', password='admin')
+        for i in range(5):
+            Subscription.objects.create(name='Pessoa %d' % i, cpf='%011d' % i,
+                                        email='pessoa%d@email.com' % i)
+        # A primeira inscrição é de ontem.
+        Subscription.objects.filter(pk=1).update(created_at=timezone.now() - timezone.timedelta(days=1))
+        self.modeladmin = admin.site._registry[Subscription]
+        self.modeladmin.list_per_page = 2
+        self.url = reverse('admin:subscriptions_subscription_changelist')
+
+    def tearDown(self):
+        self.modeladmin.list_per_page = SubscriptionAdmin.list_per_page
+
+    def names(self, resp):
+        return [s.name for s in resp.context['cl'].result_list]
+
+    def test_keyset_pages(self):
+        resp = self.client.get(self.url)
+        cl = resp.context['cl']
+        self.assertIsInstance(cl, KeysetChangeList)
+        self.assertEqual(['Pessoa 0', 'Pessoa 1'], self.names(resp))
+
+        resp = self.client.get(self.url + cl.next_page_url())
+        self.assertEqual(['Pessoa 2', 'Pessoa 3'], self.names(resp))
+        resp = self.client.get(self.url + resp.context['cl'].next_page_url())
+        self.assertEqual(['Pessoa 4'], self.names(resp))
+        self.assertIsNone(resp.context['cl'].next_cursor)
+
+    def test_no_full_count(self):
+        u"""A lista não faz COUNT(*) na tabela nem agrega o date_hierarchy."""
+        subscriptions_admin.EXACT_COUNT_BELOW = 0
+        try:
+            with self.settings(DEBUG=True):
+                start = len(connection.queries)
+                resp = self.client.get(self.url)
+                sql = [q['sql'] for q in connection.queries[start:] if 'subscriptions_subscription' in q['sql']]
+        finally:
+            subscriptions_admin.EXACT_COUNT_BELOW = 1000
+        self.assertFalse([q for q in sql if 'COUNT(' in q or 'django_date_trunc' in q], sql)
+        self.assertEqual(2, len(sql))
+        self.assertEqual(5, resp.context['cl'].full_result_count)
+
+    def test_estimated_count(self):
+        self.assertEqual(5, estimated_count(Subscription))
+
+    def test_search_cpf(self):
+        resp = self.client.get(self.url, {'q': '000.000.000-03'})
+        self.assertEqual(['Pessoa 3'], self.names(resp))
+
+    def test_search_email(self):
+        resp = self.client.get(self.url, {'q': 'Pessoa4@email.com'})
+        self.assertEqual(['Pessoa 4'], self.names(resp))
+
+    def test_search_name_prefix(self):
+        resp = self.client.get(self.url, {'q': 'pessoa'})
+        self.assertEqual(5, resp.context['cl'].result_count)
+
+    def test_subscribed_today(self):
+        resp = self.client.get(self.url)
+        self.assertEqual([False, True], [self.modeladmin.subscribed_today(s)
+                                         for s in resp.context['cl'].result_list])
+
+
+class ChangeListTest(TestCase):
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        assert self.client.login(username='admin', password='admin')
+        Subscription.objects.create(name='Henrique Bastos', cpf='00000000000', email='henrique@bastos.net')
+        self.resp = self.client.get(reverse('admin:subscriptions_subscription_changelist'))
+
+    def test_get(self):
+        u"""Tabelas pequenas continuam com a paginação normal do admin."""
+        self.assertEqual(200, self.resp.status_code)
+        self.assertNotIsInstance(self.resp.context['cl'], KeysetChangeList)
+
+    def test_subscribed_today(self):
+        subscription = self.resp.context['cl'].result_list[0]
+        self.assertTrue(SubscriptionAdmin(Subscription, admin.site).subscribed_today(subscription))
+
+
+class ConcurrentSubscribeTest(TestCase):
+    def test_hammer(self):
+        """Inscrições simultâneas de várias threads no SQLite são todas gravadas."""
+        env = dict(os.environ, DATABASE_PROFILE='tuned', PYTHONIOENCODING='utf-8')
+        process = subprocess.Popen(
+            [sys.executable, 'manage.py', 'hammer_subscribe', '--threads', '8', '--requests', '10'],
+            cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        self.assertEqual(0, process.returncode, output)
+        self.assertIn('80 gravadas', output)
+
+
+class DailyStatsTest(TestCase):
+    def setUp(self):
+        self.today = stats.local_day(timezone.now())
+        self.subscription = Subscription.objects.create(name='Henrique Bastos', cpf='12345678901',
+                                                        email='henrique@bastos.net')
+
+    def counts(self, day=None):
+        row = stats.merged().get(day or self.today)
+        return (row.total, row.paid) if row else (0, 0)
+
+    def test_create(self):
+        self.assertEqual((1, 0), self.counts())
+        Subscription.objects.create(name='Outra', cpf='00000000000', paid=True)
+        self.assertEqual((2, 1), self.counts())
+
+    def test_insert_only(self):
+        """Uma inscrição só insere a sua variação; a linha do dia não é atualizada."""
+        stats.fold()
+        with self.settings(DEBUG=True):
+            start = len(connection.queries)
+            Subscription.objects.create(name='Outra', cpf='00000000000')
+            sql = [q['sql'] for q in connection.queries[start:]]
+        self.assertFalse([q for q in sql if 'subscriptions_dailystats"' in q or 'UPDATE' in q], sql)
+
+    def test_fold(self):
+        Subscription.objects.create(name='Outra', cpf='00000000000', paid=True)
+        self.assertEqual(2, stats.fold())
+        self.assertEqual(0, DailyStatsDelta.objects.count())
+        self.assertEqual([(self.today, 2, 1)], list(DailyStats.objects.values_list('day', 'total', 'paid')))
+        self.assertEqual((2, 1), self.counts())
+        out = StringIO()
+        Subscription.objects.create(name='Mais uma', cpf='22222222222')
+        call_command('reconcile_subscription_stats', fold=True, stdout=out)
+        self.assertIn(u'1 variações consolidadas.', out.getvalue())
+        self.assertEqual((3, 1), self.counts())
+
+    def test_paid_change(self):
+        self.subscription.paid = True
+        self.subscription.save()
+        self.assertEqual((1, 1), self.counts())
+        self.subscription.save()
+        self.assertEqual((1, 1), self.counts())
+        self.subscription.paid = False
+        self.subscription.save()
+        self.assertEqual((1, 0), self.counts())
+
+    def test_delete(self):
+        self.subscription.paid = True
+        self.subscription.save()
+        self.subscription.delete()
+        self.assertEqual((0, 0), self.counts())
+
+    def test_day_change(self):
+        yesterday = self.subscription.created_at - timedelta(days=1)
+        self.subscription.created_at = yesterday
+        self.subscription.save()
+        self.assertEqual((0, 0), self.counts())
+        self.assertEqual((1, 0), self.counts(stats.local_day(yesterday)))
+
+    def test_importer(self):
+        Importer().run(read_csv(StringIO('name,cpf,email,phone\nA,11111111111,a@a.com,\nB,22222222222,,21-96186180\n')))
+        self.assertEqual((3, 0), self.counts())
+
+    def test_payment_job(self):
+        Subscription.objects.create(name='Outra', cpf='00000000000')
+        run_job(PaymentJob.create_for(Subscription.objects.all()), chunk_size=1)
+        self.assertEqual((2, 2), self.counts())
+
+    def test_set_paid(self):
+        Subscription.objects.create(name='Outra', cpf='00000000000', paid=True)
+        self.assertEqual(1, stats.set_paid(Subscription.objects.all()))
+        self.assertEqual((2, 2), self.counts())
+        self.assertEqual(2, stats.set_paid(Subscription.objects.all(), paid=False))
+        self.assertEqual((2, 0), self.counts())
+
+    def test_totals(self):
+        Subscription.objects.create(name='Outra', cpf='00000000000', paid=True)
+        self.assertEqual({'total': 2, 'paid': 1, 'unpaid': 1, 'paid_ratio': 0.5}, stats.totals())
+
+    def test_reconcile(self):
+        Subscription.objects.filter(pk=self.subscription.pk).update(paid=True)
+        DailyStats.objects.create(day=self.today - timedelta(days=3), total=5, paid=1)
+        out = StringIO()
+        call_command('reconcile_subscription_stats', dry_run=True, stdout=out)
+        self.assertIn(u'2 dias com diferença (nada foi alterado)', out.getvalue())
+        self.assertEqual((1, 0), self.counts())
+        call_command('reconcile_subscription_stats', stdout=StringIO())
+        self.assertEqual((1, 1), self.counts())
+        self.assertEqual((0, 0), self.counts(self.today - timedelta(days=3)))
+        self.assertEqual([], stats.reconcile())
+        # Com a variação pendente, o valor consolidado continua certo.
+        stats.fold()
+        self.assertEqual([(self.today, 1, 1)], list(DailyStats.objects.filter(total__gt=0)
+                                                    .values_list('day', 'total', 'paid')))
+
+    def test_reconcile_locks_first(self):
+        """A contagem e as variações são lidas depois da trava compartilhada com fold()."""
+        calls = []
+        with patch.object(stats, 'lock', side_effect=lambda **kwargs: calls.append(('lock', kwargs))):
+            with patch.object(stats, 'recount', side_effect=lambda: calls.append('recount') or {}):
+                with patch.object(stats, 'pending', side_effect=lambda: calls.append('pending') or {}):
+                    stats.reconcile()
+        self.assertEqual([('lock', {'snapshot': True}), 'recount', 'pending'], calls)
+
+    def test_fold_locks(self):
+        with patch.object(stats, 'lock') as lock:
+            stats.fold()
+        self.assertTrue(lock.called)
+
+
+class DailyStatsAdminTest(TestCase):
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        for i in range(4):
+            Subscription.objects.create(name='Pessoa %d' % i, cpf='0000000000%d' % i, paid=i % 2 == 0)
+
+    def test_json(self):
+        resp = self.client.get(reverse('admin:subscription_stats_json'))
+        data = json.loads(resp.content)
+        self.assertEqual((4, 2, 2, 0.5), (data['total'], data['paid'], data['unpaid'], data['paid_ratio']))
+        self.assertEqual([{'day': stats.local_day(timezone.now()).isoformat(), 'total': 4, 'paid': 2,
+                           'unpaid': 2}], data['days'])
+
+    def test_reads_only_daily_rows(self):
+        """O número de consultas não depende da quantidade de inscrições."""
+        self.client.get(reverse('admin:subscription_stats_json'))
+        with self.assertNumQueries(6):
+            self.client.get(reverse('admin:subscription_stats_json'))
+        for i in range(4, 8):
+            Subscription.objects.create(name='Pessoa %d' % i, cpf='0000000000%d' % i)
+        with self.assertNumQueries(6):
+            self.client.get(reverse('admin:subscription_stats_json'))
+
+    def test_dashboard(self):
+        resp = self.client.get(reverse('admin:subscription_stats'))
+        self.assertContains(resp, u'Pagas (%): 50%')
+        self.assertContains(resp, u'<td>4</td><td>2</td><td>2</td>', html=False)
+
+    def test_staff_only(self):
+        self.client.logout()
+        resp = self.client.get(reverse('admin:subscription_stats_json'))
+        self.assertNotEqual('application/json', resp['Content-Type'])
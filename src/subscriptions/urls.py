@@ -4,4 +4,5 @@ from django.conf.urls import patterns, include, url
 urlpatterns = patterns('src.subscriptions.views',
     url(r'^$', 'subscribe', name='subscribe'),
     url(r'^(\d+)/$', 'success', name='success'),
+    url(r'^api/lote/$', 'batch', name='batch'),
 )
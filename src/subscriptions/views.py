@@ -1,12 +1,17 @@
 # coding: utf-8
-from django.conf import settings
-from django.core.mail import send_mail
+import json
 from django.core.urlresolvers import reverse
+from django.db import IntegrityError, transaction
 from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.views.generic.simple import direct_to_template
-from .forms import SubscriptionForm
+from ..core.dbprofile import retry_on_lock
+from .api import authenticate, max_batch, subscribe_batch
+from .forms import DUPLICATE_CPF, SubscriptionForm
 from .models import Subscription
+from .outbox import queue_confirmation
 
 
 def create(request):
@@ -15,13 +20,19 @@ def create(request):
     if not form.is_valid():
         return direct_to_template(request, 'subscriptions/subscription_form.html', {'form': form})
 
-    subscription = form.save()
-    send_mail(
-        subject=u'Cadastrado com Sucesso',
-        message=u'Obrigado pela sua inscrição!',
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[subscription.email]
-    )
+    def save():
+        with transaction.commit_on_success():
+            subscription = form.save()
+            # O e-mail é enviado depois, pelo comando send_confirmations.
+            queue_confirmation(subscription)
+        return subscription
+
+    try:
+        subscription = retry_on_lock(save)
+    except IntegrityError:
+        # Outra requisição gravou o mesmo CPF depois da validação.
+        form._errors['cpf'] = form.error_class([DUPLICATE_CPF])
+        return direct_to_template(request, 'subscriptions/subscription_form.html', {'form': form})
 
     return HttpResponseRedirect(reverse('subscriptions:success', args=[subscription.pk]))
 
@@ -40,3 +51,34 @@ def subscribe(request):
 def success(request, pk):
     subscription = get_object_or_404(Subscription, pk=pk)
     return direct_to_template(request, 'subscriptions/subscription_detail.html', {'subscription': subscription})
+
+
+def json_response(data, status=200):
+    return HttpResponse(json.dumps(data), content_type='application/json', status=status)
+
+
+@csrf_exempt
+@require_POST
+def batch(request):
+    """
+    Recebe uma lista JSON de inscrições (name, cpf, email, phone) e
+    responde com o resultado de cada uma.
+    """
+    if authenticate(request) is None:
+        response = json_response({'error': u'Chave de acesso inválida.'}, status=401)
+        response['WWW-Authenticate'] = 'Token'
+        return response
+
+    try:
+        items = json.loads(request.body)
+    except ValueError:
+        return json_response({'error': u'JSON inválido.'}, status=400)
+    if not isinstance(items, list):
+        return json_response({'error': u'Envie uma lista de inscrições.'}, status=400)
+    if len(items) > max_batch():
+        return json_response({'error': u'Envie no máximo %d inscrições por vez.' % max_batch()},
+                             status=400)
+
+    results = subscribe_batch(items)
+    created = sum(1 for result in results if result['status'] == 'created')
+    return json_response({'created': created, 'rejected': len(results) - created, 'results': results})
@@ -15,6 +15,8 @@ urlpatterns = patterns('src',
     # Uncomment the admin/doc line below to enable admin documentation:
     # url(r'^admin/doc/', include('django.contrib.admindocs.urls')),
 
+    url(r'^admin/desempenho/', include('src.perf.urls', namespace='perf')),
+
     # Uncomment the next line to enable the admin:
     url(r'^admin/', include(admin.site.urls)),
     url(r'^', include('src.core.urls', namespace='core')),
@@ -22,6 +24,6 @@ urlpatterns = patterns('src',
 
 if settings.DEBUG is False:
     urlpatterns += patterns('',
-        url(r'^static/(?P<path>.*)$', 'django.views.static.serve',
+        url(r'^static/(?P<path>.*)$', 'src.core.static.serve',
                 {'document_root': settings.STATIC_ROOT}),
     )
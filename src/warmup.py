@@ -0,0 +1,88 @@
+# coding: utf-8
+"""
+Aquecimento do processo antes de ele receber requisições.
+
+Sem isto a primeira requisição de cada worker paga pela importação das
+apps e do admin (admin.autodiscover), pela montagem dos resolvers de URL,
+pela carga das middlewares, pela compilação dos templates que usar, com
+SEARCH_WARMUP, pela montagem do índice de busca e, com CPF_REGISTRY_WARMUP,
+pela montagem do registro de CPFs (que de outro modo nunca é montado).
+Com o loader de templates em cache (TEMPLATE_CACHE), os templates
+compilados aqui valem para todo o processo.
+"""
+import os
+import time
+from django.conf import settings
+from django.core.urlresolvers import get_resolver, get_urlconf
+from django.db.models.loading import get_models
+from django.template.loader import get_template
+from django.utils.importlib import import_module
+
+
+PROJECT_PREFIX = 'src.'
+
+
+def template_dirs():
+    """Diretórios de templates do projeto (TEMPLATE_DIRS e apps do projeto)."""
+    dirs = list(settings.TEMPLATE_DIRS)
+    for app in settings.INSTALLED_APPS:
+        if app.startswith(PROJECT_PREFIX):
+            path = os.path.join(os.path.dirname(import_module(app).__file__), 'templates')
+            if os.path.isdir(path):
+                dirs.append(path)
+    return dirs
+
+
+def project_templates():
+    names = set()
+    for root in template_dirs():
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith('.html'):
+                    names.add(os.path.relpath(os.path.join(dirpath, filename), root))
+    return sorted(names)
+
+
+def compile_templates():
+    for name in project_templates():
+        get_template(name)
+
+
+def build_urls():
+    # Importar o urlconf executa o admin.autodiscover(); _populate monta
+    # os dicionários usados pelo reverse, inclusive dos namespaces.
+    resolver = get_resolver(get_urlconf())
+    resolver._populate()
+    for namespace in resolver.namespace_dict:
+        resolver.namespace_dict[namespace][1]._populate()
+
+
+def load_models():
+    get_models()
+
+
+def build_search_index():
+    from src.core.search import index
+    index.build()
+
+
+def warm_cpf_registry():
+    from src.subscriptions.registry import cpf_registry
+    cpf_registry.warm_if_cold()
+
+
+def warm_up(application=None):
+    """Executa cada etapa e devolve [(etapa, ms)]."""
+    steps = [('models', load_models), ('urls', build_urls), ('templates', compile_templates)]
+    if getattr(settings, 'SEARCH_WARMUP', False):
+        steps.append(('search', build_search_index))
+    if getattr(settings, 'CPF_REGISTRY_WARMUP', False):
+        steps.append(('cpf_registry', warm_cpf_registry))
+    if application is not None and hasattr(application, 'load_middleware'):
+        steps.append(('middleware', application.load_middleware))
+    timings = []
+    for name, step in steps:
+        began = time.time()
+        step()
+        timings.append((name, (time.time() - began) * 1000))
+    return timings
@@ -23,6 +23,13 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "src.settings")
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+# Prepare the worker (URLs, admin, templates, middleware) before it takes
+# traffic, instead of during its first requests. See src/warmup.py.
+from django.conf import settings
+if settings.WSGI_WARMUP:
+    from src.warmup import warm_up
+    warm_up(application)
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)